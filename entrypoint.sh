@@ -4,7 +4,6 @@ echo "Waiting for db_user_tracking to be ready..."
 ./wait-for-it.sh db_user_tracking 5432 60
 
 echo "Run migrations..."
-python manage.py makemigrations --noinput
 python manage.py migrate --noinput
 
 echo "Collect static files..."
@@ -21,5 +20,19 @@ else:
     print("Superuser has already been created")
 EOF
 
+echo "Starting traffic partition maintenance..."
+python manage.py traffic_partitions --loop &
+
+echo "Starting traffic ingest worker..."
+python manage.py traffic_ingest --loop &
+
+echo "Starting traffic rollup worker..."
+python manage.py traffic_rollup --loop --interval=60 &
+
+if [ "$ASGI" = "1" ]; then
+    echo "Starting Gunicorn with Uvicorn workers (ASGI)..."
+    exec gunicorn --workers=4 -k uvicorn_worker.UvicornWorker --bind 0.0.0.0:8000 user_tracking.asgi:application
+fi
+
 echo "Starting Gunicorn..."
 exec gunicorn --workers=4 --bind 0.0.0.0:8000 user_tracking.wsgi:application
\ No newline at end of file
@@ -0,0 +1,136 @@
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.utils import timezone
+from tracking.models import Visitor
+
+from .models import TrafficRollupState, TrafficStat, UserActivitySummary
+from .rollups import ROLLUP_SETTLE_SECONDS, settled_high_id
+
+User = get_user_model()
+
+USER_ACTIVITY_STATE = 'user_activity'
+
+# Окно, за которое в таблице пользователей считаются визиты и среднее время на сайте
+USER_STATS_WINDOW = timedelta(days=7)
+
+SUMMARY_COLUMNS = 'user_id, visit_count, total_time_on_site, avg_time_on_site, last_visit_at, last_hit_at, updated_at'
+
+# Показатели пересчитываются по всем визитам пользователя: time_on_site незавершённой сессии растёт с каждым
+# запросом, поэтому приращения визитов не суммируются. По индексу Visitor.user_id это дёшево
+SUMMARY_SELECT = f"""
+SELECT account.id,
+       COUNT(visit.session_key) FILTER (WHERE visit.start_time >= %(window_start)s),
+       COALESCE(SUM(visit.time_on_site) FILTER (WHERE visit.start_time >= %(window_start)s), 0),
+       COALESCE(AVG(visit.time_on_site) FILTER (WHERE visit.start_time >= %(window_start)s), 0),
+       MAX(visit.start_time),
+       {{last_hit_at}},
+       NOW()
+FROM {{users}}
+JOIN {User._meta.db_table} AS account ON account.id = users.user_id
+LEFT JOIN {Visitor._meta.db_table} AS visit ON visit.user_id = account.id AND visit.start_time < %(current_time)s
+GROUP BY account.id, users.last_hit_at
+"""
+
+SUMMARY_UPSERT = f"""
+ON CONFLICT (user_id) DO UPDATE SET
+    visit_count = EXCLUDED.visit_count,
+    total_time_on_site = EXCLUDED.total_time_on_site,
+    avg_time_on_site = EXCLUDED.avg_time_on_site,
+    last_visit_at = EXCLUDED.last_visit_at,
+    last_hit_at = {{last_hit_at}},
+    updated_at = EXCLUDED.updated_at
+"""
+
+# Пользователи с хитами в порции id TrafficStat и пользователи, чьи визиты вышли из окна с прошлого обновления
+CHANGED_USERS = f"""(
+    SELECT user_id, MAX(last_hit_at) AS last_hit_at
+    FROM (
+        SELECT user_id, MAX(created_at) AS last_hit_at FROM {TrafficStat._meta.db_table}
+        WHERE id > %(low_id)s AND id <= %(high_id)s AND user_id IS NOT NULL
+        GROUP BY user_id
+        UNION ALL
+        SELECT user_id, NULL FROM {Visitor._meta.db_table}
+        WHERE user_id IS NOT NULL AND start_time >= %(expired_since)s AND start_time < %(window_start)s
+    ) AS changed
+    GROUP BY user_id
+) AS users"""
+
+ALL_USERS = f"(SELECT id AS user_id, NULL::timestamptz AS last_hit_at FROM {User._meta.db_table}) AS users"
+
+UPDATE_SQL = (
+    f"INSERT INTO {UserActivitySummary._meta.db_table} AS summary ({SUMMARY_COLUMNS})"
+    + SUMMARY_SELECT.format(users=CHANGED_USERS, last_hit_at='users.last_hit_at')
+    + SUMMARY_UPSERT.format(last_hit_at='GREATEST(summary.last_hit_at, EXCLUDED.last_hit_at)')
+)
+
+# Последний хит каждого пользователя - по индексу (user_id, created_at)
+REBUILD_SQL = (
+    f"INSERT INTO {UserActivitySummary._meta.db_table} AS summary ({SUMMARY_COLUMNS})"
+    + SUMMARY_SELECT.format(
+        users=ALL_USERS,
+        last_hit_at=f'(SELECT MAX(created_at) FROM {TrafficStat._meta.db_table} WHERE user_id = account.id)',
+    )
+    + SUMMARY_UPSERT.format(last_hit_at='EXCLUDED.last_hit_at')
+)
+
+# Строки для пользователей, созданных в обход post_save (bulk_create, загрузка дампа)
+MISSING_SQL = f"""
+INSERT INTO {UserActivitySummary._meta.db_table} ({SUMMARY_COLUMNS})
+SELECT account.id, 0, 0, 0, NULL, NULL, NOW() FROM {User._meta.db_table} AS account
+WHERE NOT EXISTS (SELECT 1 FROM {UserActivitySummary._meta.db_table} WHERE user_id = account.id)
+ON CONFLICT (user_id) DO NOTHING
+"""
+
+
+def create_user_activity_summary(sender, instance, created, raw=False, **kwargs):
+    """Обработчик post_save пользователя: новый пользователь сразу попадает в таблицу пользователей."""
+    if created and not raw:
+        UserActivitySummary.objects.bulk_create([UserActivitySummary(user=instance)], ignore_conflicts=True)
+
+
+def update_user_activity(batch_size=100000, settle_seconds=ROLLUP_SETTLE_SECONDS):
+    """
+    Инкрементально обновляет UserActivitySummary: пересчитываются только пользователи, у которых появились хиты
+    (id TrafficStat выше отметки), и пользователи, чьи визиты вышли из окна USER_STATS_WINDOW.
+    При первом запуске (отметки ещё нет) строки пересчитываются для всех пользователей.
+    Возвращает количество обновлённых строк.
+    """
+    target_id = settled_high_id(USER_ACTIVITY_STATE, settle_seconds)
+
+    with connection.cursor() as cursor:
+        cursor.execute(MISSING_SQL)
+
+    updated = 0
+    while True:
+        with transaction.atomic():
+            state, created = TrafficRollupState.objects.select_for_update().get_or_create(name=USER_ACTIVITY_STATE)
+            current_time = timezone.now()
+            params = {'current_time': current_time, 'window_start': current_time - USER_STATS_WINDOW}
+
+            with connection.cursor() as cursor:
+                if created:
+                    cursor.execute(REBUILD_SQL, params)
+                    high_id = target_id
+                else:
+                    low_id = state.last_traffic_stat_id
+                    high_id = max(low_id, min(low_id + batch_size, target_id))
+                    cursor.execute(UPDATE_SQL, {
+                        **params,
+                        'low_id': low_id,
+                        'high_id': high_id,
+                        'expired_since': state.updated_at - USER_STATS_WINDOW,
+                    })
+                updated += cursor.rowcount
+
+            state.last_traffic_stat_id = high_id
+            state.save(update_fields=['last_traffic_stat_id', 'updated_at'])
+
+        if high_id >= target_id:
+            return updated
+
+
+def rebuild_user_activity(settle_seconds=ROLLUP_SETTLE_SECONDS):
+    TrafficRollupState.objects.filter(name=USER_ACTIVITY_STATE).delete()
+    return update_user_activity(settle_seconds=settle_seconds)
@@ -5,7 +5,7 @@ from .models import TrafficStat
 @admin.register(TrafficStat)
 class TrafficStatAdmin(admin.ModelAdmin):
     list_display = ('id', 'ip_address', 'user_name', 'user_agent', 'created_at', 'url', 'event', 'session_id')
-    search_fields = ('user__first_name', 'user__last_name', 'ip_address', 'user__email', 'url')
+    search_fields = ('user__first_name', 'user__last_name', 'ip_address', 'user__email', 'url__value')
 
     def user_name(self, obj):
         return f"{obj.user.first_name} {obj.user.last_name}" if obj.user else "-"
@@ -13,3 +13,5 @@ class TrafficStatAdmin(admin.ModelAdmin):
     user_name.short_description = 'Имя пользователя'
 
     list_filter = ('created_at', 'event')
+    list_select_related = ('user', 'user_agent', 'url')
+    raw_id_fields = ('user', 'user_agent', 'url')
@@ -4,3 +4,21 @@ from django.apps import AppConfig
 class TrafficConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'traffic'
+
+    def ready(self):
+        from django.conf import settings
+        from django.db import connections
+        from django.db.backends.signals import connection_created
+        from django.db.models.signals import post_save
+
+        from .activity import create_user_activity_summary
+        from .metrics import install_query_timer
+
+        # Замер SQL-запросов для TrafficMetricsMiddleware на всех соединениях, включая уже открытые
+        connection_created.connect(install_query_timer, dispatch_uid='traffic_query_timer')
+        for connection in connections.all(initialized_only=True):
+            install_query_timer(connection)
+
+        post_save.connect(
+            create_user_activity_summary, sender=settings.AUTH_USER_MODEL, dispatch_uid='traffic_user_activity_summary'
+        )
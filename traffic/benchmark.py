@@ -0,0 +1,417 @@
+import statistics
+import subprocess
+import time
+import zlib
+from datetime import timedelta
+from importlib import import_module
+
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.db import connection
+from django.db.models import Count
+from django.http import HttpResponse
+from django.test import RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+from tracking.models import Visitor
+
+from .activity import update_user_activity
+from .breakdown import update_top_keys
+from .buffer import get_buffer
+from .middleware import TrafficTrackingMiddleware
+from .models import TrafficStat, UrlPath, UserAgent
+from .pagination import encode_cursor
+from .rollups import update_hourly_rollups
+from .sessions import update_session_summaries
+from .spool import get_spool
+from .useragents import user_agent_fields
+
+User = get_user_model()
+
+BENCHMARK_USER_PREFIX = 'bench_user_'
+
+SYNTHETIC_USER_AGENTS = (
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/{}.0 Safari/537.36',
+    'Mozilla/5.0 (iPhone; CPU iPhone OS 17_{} like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Mobile/15E148',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 14_{}) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.0 Safari/605.1',
+    'Mozilla/5.0 (X11; Linux x86_64; rv:{0}.0) Gecko/20100101 Firefox/{0}.0',
+    'Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html) v{}',
+)
+
+
+def uniform(column, offset):
+    """SQL-выражение: равномерная величина из [0, 1), взятая из 8 hex-символов md5-хеша column начиная с offset."""
+    return f"((('x' || substr({column}, {offset}, 8))::bit(32)::bigint & 2147483647) / 2147483648.0)"
+
+
+# Синтетические хиты с номерами first..last из total. Подряд идущие session_length хитов образуют сессию.
+# Номер хита задаёт день (хиты идут от старых к новым, как при реальной записи, - иначе BRIN-индекс и
+# корреляция id с created_at были бы нереалистичными), остальные атрибуты сессии выводятся из md5 её номера,
+# поэтому порции независимы, а при том же salt данные воспроизводимы:
+# - время суток - среднее трёх равномерных величин (пик днём, спад ночью), текущий день - до момента генерации;
+# - доля registered_share сессий принадлежит пользователям, активность пользователей - по степенному закону;
+# - User-Agent и страницы выбираются с перекосом, близким к закону Ципфа: немногие значения дают большую часть хитов.
+SEED_HITS_SQL = f"""
+INSERT INTO {TrafficStat._meta.db_table} (ip_address, user_id, user_agent_id, url_id, session_id, created_at, weight)
+SELECT CASE WHEN registered THEN ('172.16.' || user_index %% 250 || '.' || user_index / 250 %% 250)::inet
+            ELSE ('10.' || guest %% 250 || '.' || guest / 250 %% 250 || '.' || guest / 62500 %% 250)::inet END,
+       CASE WHEN registered THEN (%(users)s::bigint[])[1 + user_index] END,
+       (%(user_agents)s::integer[])[1 + user_agent_index],
+       (%(urls)s::integer[])[1 + floor(cardinality(%(urls)s::integer[]) * power(random(), 3))::int],
+       h,
+       LEAST(
+           date_trunc('day', %(end)s::timestamptz) - day_offset * INTERVAL '1 day'
+           + day_time * CASE WHEN day_offset = 0 THEN %(end)s - date_trunc('day', %(end)s::timestamptz)
+                             ELSE INTERVAL '1 day' END
+           + g %% %(session_length)s * INTERVAL '40 seconds',
+           %(end)s
+       ) AS created_at,
+       1
+FROM (
+    SELECT g, h,
+           %(days)s - 1 - (g / %(session_length)s * %(session_length)s * %(days)s / %(total)s)::int AS day_offset,
+           ({uniform('h', 1)} + {uniform('h', 9)} + {uniform('h', 17)}) / 3 AS day_time,
+           {uniform('h', 25)} < %(registered_share)s AND cardinality(%(users)s::bigint[]) > 0 AS registered,
+           floor(cardinality(%(users)s::bigint[]) * power({uniform('h2', 1)}, 2.5))::int AS user_index,
+           floor(cardinality(%(user_agents)s::integer[]) * power({uniform('h2', 9)}, 3))::int AS user_agent_index,
+           floor({uniform('h2', 17)} * 15000000)::int AS guest
+    FROM (
+        SELECT g, h, md5(h) AS h2
+        FROM (
+            SELECT g, md5(%(salt)s || ':' || g / %(session_length)s) AS h
+            FROM generate_series(%(first)s::bigint, %(last)s::bigint) AS g
+        ) AS hits
+    ) AS hashed
+) AS sessions
+ORDER BY created_at
+"""
+
+# Visitor django-tracking2 на каждую сессию порции, ключ сессии совпадает с TrafficStat.session_id.
+# Сессии с хитами за последние два часа остаются незавершёнными - это онлайн-посетители.
+SEED_VISITORS_SQL = f"""
+INSERT INTO {Visitor._meta.db_table}
+    (session_key, user_id, ip_address, user_agent, start_time, expiry_age, expiry_time, time_on_site, end_time)
+SELECT stat.session_id, MIN(stat.user_id), host(MIN(stat.ip_address)), MIN(user_agent.value),
+       MIN(stat.created_at), 7200, MAX(stat.created_at) + INTERVAL '2 hours',
+       EXTRACT(EPOCH FROM MAX(stat.created_at) - MIN(stat.created_at))::int,
+       CASE WHEN MAX(stat.created_at) < NOW() - INTERVAL '2 hours' THEN MAX(stat.created_at) END
+FROM {TrafficStat._meta.db_table} AS stat
+LEFT JOIN {UserAgent._meta.db_table} AS user_agent ON user_agent.id = stat.user_agent_id
+WHERE stat.id > %(low_id)s AND stat.id <= %(high_id)s
+GROUP BY stat.session_id
+ON CONFLICT (session_key) DO NOTHING
+"""
+
+
+def ensure_benchmark_users(count):
+    """Пользователи bench_user_N для зарегистрированных хитов; существующие переиспользуются."""
+    existing = User.objects.filter(username__startswith=BENCHMARK_USER_PREFIX).count()
+    User.objects.bulk_create(
+        [
+            User(username=f'{BENCHMARK_USER_PREFIX}{i}', first_name='Bench', last_name=str(i),
+                 email=f'{BENCHMARK_USER_PREFIX}{i}@example.com', password='!')
+            for i in range(existing, count)
+        ],
+        batch_size=1000,
+    )
+    return list(
+        User.objects.filter(username__startswith=BENCHMARK_USER_PREFIX)
+        .order_by('pk').values_list('pk', flat=True)[:count]
+    )
+
+
+def ensure_dictionaries(url_count, user_agent_count):
+    """Id путей и User-Agent в порядке убывания популярности: первые элементы выбираются чаще."""
+    paths = ['/'] + [f'/page/{i}/' for i in range(1, url_count)]
+    agents = [
+        SYNTHETIC_USER_AGENTS[i % len(SYNTHETIC_USER_AGENTS)].format(100 + i // len(SYNTHETIC_USER_AGENTS))
+        for i in range(user_agent_count)
+    ]
+    UrlPath.objects.bulk_create([UrlPath(value=value) for value in paths], ignore_conflicts=True, batch_size=1000)
+    UserAgent.objects.bulk_create(
+        [UserAgent(value=value, **user_agent_fields(value)) for value in agents], ignore_conflicts=True, batch_size=1000
+    )
+    url_ids = dict(UrlPath.objects.filter(value__in=paths).values_list('value', 'pk'))
+    user_agent_ids = dict(UserAgent.objects.filter(value__in=agents).values_list('value', 'pk'))
+    return [url_ids[value] for value in paths], [user_agent_ids[value] for value in agents]
+
+
+def seed(hits, users=1000, days=90, registered_share=0.3, session_length=8, url_count=2000, user_agent_count=200,
+         chunk_size=500000, salt='bench', rollups=True, progress=None):
+    """
+    Генерирует hits синтетических хитов за последние days дней и Visitor для каждой их сессии.
+    rollups - сразу обновить почасовые агрегаты, сводки частых значений и сессий и сводку активности пользователей.
+    Хиты вставляются на стороне БД порциями по chunk_size, каждая порция фиксируется отдельно.
+    Повторный запуск с другим salt добавляет новые сессии.
+    Возвращает (число хитов, число созданных Visitor).
+    """
+    user_ids = ensure_benchmark_users(users)
+    url_ids, user_agent_ids = ensure_dictionaries(url_count, user_agent_count)
+    end = timezone.now()
+    visitors_before = Visitor.objects.count()
+    stat_table = TrafficStat._meta.db_table
+    # Сессия не делится между порциями: Visitor создаётся по хитам одной порции
+    chunk_size = max(session_length, chunk_size // session_length * session_length)
+
+    for first in range(0, hits, chunk_size):
+        last = min(first + chunk_size, hits) - 1
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM {stat_table}")
+            low_id = cursor.fetchone()[0]
+            # Воспроизводимый random() для выбора страницы внутри сессии
+            cursor.execute("SELECT setseed(%s)", [zlib.crc32(f'{salt}:{first}'.encode()) / 2 ** 32])
+            cursor.execute(SEED_HITS_SQL, {
+                'first': first, 'last': last, 'total': hits, 'salt': salt, 'end': end, 'days': days,
+                'session_length': session_length, 'registered_share': registered_share,
+                'users': user_ids, 'user_agents': user_agent_ids, 'urls': url_ids,
+            })
+            cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM {stat_table}")
+            high_id = cursor.fetchone()[0]
+            cursor.execute(SEED_VISITORS_SQL, {'low_id': low_id, 'high_id': high_id})
+        if progress:
+            progress(last + 1)
+
+    with connection.cursor() as cursor:
+        for model in (TrafficStat, Visitor, UrlPath, UserAgent):
+            cursor.execute(f"ANALYZE {model._meta.db_table}")
+
+    if rollups:
+        update_hourly_rollups(settle_seconds=0)
+        update_top_keys(settle_seconds=0)
+        update_session_summaries(settle_seconds=0)
+        update_user_activity(settle_seconds=0)
+
+    return hits, Visitor.objects.count() - visitors_before
+
+
+def rows_scanned():
+    """
+    Сумма строк, прочитанных последовательным и индексным сканированием таблиц БД (pg_stat_user_tables).
+    Статистика текущего соединения сбрасывается принудительно, что доступно с PostgreSQL 15; иначе None.
+    """
+    if connection.pg_version < 150000:
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_stat_force_next_flush()")
+        cursor.execute("SELECT pg_stat_clear_snapshot()")
+        cursor.execute("SELECT COALESCE(SUM(seq_tup_read + COALESCE(idx_tup_fetch, 0)), 0) FROM pg_stat_user_tables")
+        return int(cursor.fetchone()[0])
+
+
+class Scenario:
+    """Именованный вызов, замеряемый run(): задержка, число SQL-запросов и прочитанных строк на вызов."""
+
+    def __init__(self, name, call, description=''):
+        self.name = name
+        self.call = call
+        self.description = description
+
+    def run(self, iterations=50, warmup=5):
+        for _ in range(warmup):
+            self.call()
+
+        latencies, queries = [], []
+        scanned_before = rows_scanned()
+        for _ in range(iterations):
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                response = self.call()
+                latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                raise RuntimeError(f"Сценарий {self.name}: ответ {response.status_code}")
+            queries.append(len(captured.captured_queries))
+        scanned_after = rows_scanned()
+
+        quantiles = statistics.quantiles(latencies, n=100)
+        return {
+            'description': self.description,
+            'iterations': iterations,
+            'p50_ms': round(quantiles[49] * 1000, 3),
+            'p95_ms': round(quantiles[94] * 1000, 3),
+            'p99_ms': round(quantiles[98] * 1000, 3),
+            'mean_ms': round(statistics.fmean(latencies) * 1000, 3),
+            'queries': statistics.fmean(queries),
+            'rows_scanned': (
+                round((scanned_after - scanned_before) / iterations) if scanned_before is not None else None
+            ),
+        }
+
+
+def api_call(view, user, params=None, **kwargs):
+    """Вызов API-представления в обход маршрутизации и аутентификации; асинхронное - через async_to_sync."""
+    view_function = view.as_view()
+    if iscoroutinefunction(view_function):
+        view_function = async_to_sync(view_function)
+    factory = APIRequestFactory()
+
+    def call():
+        request = factory.get('/', params or {})
+        force_authenticate(request, user=user)
+        return view_function(request, **kwargs)
+
+    return call
+
+
+def middleware_call():
+    """Запрос гостя через TrafficTrackingMiddleware с пустым представлением: стоимость учёта одного хита."""
+    middleware = TrafficTrackingMiddleware(lambda request: HttpResponse())
+    session_store = import_module(settings.SESSION_ENGINE).SessionStore
+    factory = RequestFactory()
+
+    def call():
+        request = factory.get('/benchmark/', headers={'user-agent': SYNTHETIC_USER_AGENTS[0].format(120)})
+        request.session = session_store()
+        request.user = AnonymousUser()
+        return middleware(request)
+
+    return call
+
+
+def write_path():
+    if get_spool() is not None:
+        return 'spool'
+    if get_buffer() is not None:
+        return 'buffer'
+    return 'direct'
+
+
+def build_scenarios(deep_page=400, page_size=25):
+    from .views import (
+        ActiveUsersView, DailyTrafficStats, MonthlyTrafficStats, TrafficBreakdownView, TrafficFunnelView,
+        TrafficRetentionView, TrafficSeriesView, TrafficSessionsView, UserRequestLogView, WeeklyTrafficStats,
+        YearlyTrafficStats, filter_traffic_stats,
+    )
+
+    viewer = User.objects.filter(is_superuser=True).first() or User.objects.order_by('pk').first()
+    if viewer is None:
+        raise RuntimeError("Нет пользователей: сгенерируйте данные командой traffic_seed")
+
+    scenarios = [
+        Scenario('middleware', middleware_call(), f"Учёт хита middleware, запись: {write_path()}"),
+        Scenario('period_daily', api_call(DailyTrafficStats, viewer), "Статистика за текущий день"),
+        Scenario('period_weekly', api_call(WeeklyTrafficStats, viewer), "Статистика за текущую неделю"),
+        Scenario('period_monthly', api_call(MonthlyTrafficStats, viewer), "Статистика за текущий месяц"),
+        Scenario('period_yearly', api_call(YearlyTrafficStats, viewer), "Статистика за текущий год"),
+        Scenario(
+            'series_hourly_week',
+            api_call(TrafficSeriesView, viewer, {
+                'start': (timezone.localdate() - timedelta(days=6)).isoformat(),
+                'end': (timezone.localdate() + timedelta(days=1)).isoformat(),
+                'granularity': 'hour',
+            }),
+            "Временной ряд за 7 дней по часам",
+        ),
+        Scenario(
+            'series_minute_hour',
+            api_call(TrafficSeriesView, viewer, {
+                'start': (timezone.localtime() - timedelta(hours=1)).replace(tzinfo=None).isoformat(),
+                'end': timezone.localtime().replace(tzinfo=None).isoformat(),
+                'granularity': 'minute',
+            }),
+            "Временной ряд за последний час по минутам",
+        ),
+        Scenario(
+            'breakdown_url_year',
+            api_call(TrafficBreakdownView, viewer, {
+                'dimension': 'url',
+                'start': (timezone.localdate() - timedelta(days=365)).isoformat(),
+                'end': timezone.localdate().isoformat(),
+            }),
+            "Топ-10 страниц за год",
+        ),
+        Scenario(
+            'sessions_month',
+            api_call(TrafficSessionsView, viewer, {
+                'start': (timezone.localdate() - timedelta(days=30)).isoformat(),
+                'end': timezone.localdate().isoformat(),
+            }),
+            "Сессии за 30 дней",
+        ),
+        Scenario(
+            'funnel_week',
+            api_call(TrafficFunnelView, viewer, {
+                # Самые популярные страницы синтетических данных (ensure_dictionaries)
+                'step': ['/', '/page/1/', '/page/2/'],
+                'start': (timezone.localdate() - timedelta(days=7)).isoformat(),
+                'end': timezone.localdate().isoformat(),
+            }),
+            "Воронка из трёх страниц за 7 дней",
+        ),
+        Scenario('retention_weekly', api_call(TrafficRetentionView, viewer), "Удержание когорт за 12 недель"),
+        Scenario('active_users', api_call(ActiveUsersView, viewer), "Первая страница таблицы пользователей"),
+    ]
+
+    # Журнал самого активного за неделю пользователя - самый длинный
+    busiest = (
+        TrafficStat.objects.filter(user__isnull=False, created_at__gte=timezone.now() - timedelta(days=7))
+        .values('user').annotate(hits=Count('pk')).order_by('-hits').values_list('user', flat=True).first()
+    )
+    if busiest is None:
+        return scenarios
+
+    scenarios += [
+        Scenario('request_log_first_page',
+                 api_call(UserRequestLogView, viewer, {'page_size': page_size}, user_id=busiest),
+                 "Журнал запросов пользователя, первая страница"),
+        Scenario('request_log_deep_offset',
+                 api_call(UserRequestLogView, viewer, {'page_size': page_size, 'page': deep_page}, user_id=busiest),
+                 f"Журнал запросов пользователя, страница {deep_page} (OFFSET)"),
+    ]
+    # Курсор на ту же страницу строится по последней записи предыдущей страницы
+    offset = (deep_page - 1) * page_size
+    anchor = (
+        filter_traffic_stats(RequestFactory().get('/'), User(pk=busiest))
+        .values_list('created_at', 'pk')[offset - 1:offset].first()
+    )
+    if anchor is not None:
+        params = {'page_size': page_size, 'pagination': 'cursor', 'cursor': encode_cursor(*anchor)}
+        scenarios.append(Scenario(
+            'request_log_deep_cursor', api_call(UserRequestLogView, viewer, params, user_id=busiest),
+            f"Журнал запросов пользователя, страница {deep_page} (курсор)",
+        ))
+    return scenarios
+
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(iterations=50, warmup=5, deep_page=400, scenarios=None, stats_cache=False, progress=None):
+    """
+    Прогоняет сценарии в текущем процессе и возвращает отчёт для сохранения в JSON.
+    Кэш статистики за период по умолчанию выключен: замеряется вычисление, а не чтение из кэша.
+    """
+    overrides = {} if stats_cache else {'TRAFFIC_STATS_CACHE': {'ENABLED': False}}
+    results = {}
+    with override_settings(**overrides):
+        for scenario in build_scenarios(deep_page):
+            if scenarios and scenario.name not in scenarios:
+                continue
+            results[scenario.name] = scenario.run(iterations, warmup)
+            if progress:
+                progress(scenario.name, results[scenario.name])
+
+    return {
+        'commit': current_commit(),
+        'created_at': timezone.now().isoformat(),
+        'config': {
+            'write_path': write_path(),
+            'use_rollups': getattr(settings, 'TRAFFIC_USE_ROLLUPS', True),
+            'stats_cache': stats_cache,
+            'postgresql': connection.pg_version,
+        },
+        'dataset': {
+            'traffic_stats': TrafficStat.objects.count(),
+            'visitors': Visitor.objects.count(),
+            'users': User.objects.count(),
+        },
+        'scenarios': results,
+    }
@@ -0,0 +1,269 @@
+import heapq
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .hll import HyperLogLog
+from .models import TrafficRollupState, TrafficStat, TrafficTopKey, UrlPath, UserAgent
+from .rollups import ROLLUP_SETTLE_SECONDS, settled_high_id
+from .useragents import user_agent_fields
+
+TOP_KEYS_STATE = 'top_keys'
+
+# Ключей в суточной сводке измерения; top-N по сводкам точен при N много меньше ёмкости
+TOP_KEYS_CAPACITY = getattr(settings, 'TRAFFIC_TOP_KEYS_CAPACITY', 100)
+MAX_BREAKDOWN_LIMIT = 50
+
+# 1024 регистра, стандартная ошибка ~3.3%; за год на каждый ключ ответа объединяется до 365 скетчей (HyperLogLog.union)
+TOP_KEYS_HLL_PRECISION = 10
+
+USER_AGENT_JOIN = f'JOIN {UserAgent._meta.db_table} AS user_agent ON user_agent.id = stat.user_agent_id'
+
+# Измерение: (выражение ключа, соединение)
+DIMENSIONS = {
+    'url': ('stat.url_id::text', ''),
+    'user_agent': ('stat.user_agent_id::text', ''),
+    'browser': ('user_agent.browser', USER_AGENT_JOIN),
+    'os': ('user_agent.os', USER_AGENT_JOIN),
+    'device': ('user_agent.device', USER_AGENT_JOIN),
+    'ip': ('host(stat.ip_address)', ''),
+    'event': ('stat.event', ''),
+}
+
+# Посетитель - зарегистрированный пользователь или IP гостя, как в статистике за период
+VISITOR = "CASE WHEN stat.user_id IS NULL THEN host(stat.ip_address) ELSE 'u' || stat.user_id END"
+
+BATCH_SQL = f"""
+SELECT (stat.created_at AT TIME ZONE 'UTC')::date, {{key}}, SUM(stat.weight), ARRAY_AGG(DISTINCT {VISITOR})
+FROM {TrafficStat._meta.db_table} AS stat {{join}}
+WHERE stat.id > %s AND stat.id <= %s AND {{key}} <> ''
+GROUP BY 1, 2
+"""
+
+# Полные сутки UTC внутри интервала читаются из сводок, края интервала и ещё не учтённый хвост - из TrafficStat
+TOP_SQL = f"""
+WITH mark AS (
+    SELECT COALESCE(MAX(last_traffic_stat_id), 0) AS last_id
+    FROM {TrafficRollupState._meta.db_table} WHERE name = %(state)s
+),
+summary AS (
+    SELECT key, hits, error, visitors_hll FROM {TrafficTopKey._meta.db_table}
+    WHERE dimension = %(dimension)s AND day >= %(first_day)s AND day < %(last_day)s
+),
+raw AS (
+    SELECT key, hits, visitor FROM (
+        SELECT {{key}} AS key, stat.weight AS hits, {VISITOR} AS visitor
+        FROM {TrafficStat._meta.db_table} AS stat {{join}}
+        WHERE stat.created_at >= %(start)s AND stat.created_at < %(full_start)s
+        UNION ALL
+        SELECT {{key}}, stat.weight, {VISITOR}
+        FROM {TrafficStat._meta.db_table} AS stat {{join}}
+        WHERE stat.created_at >= %(full_end)s AND stat.created_at < %(end)s
+        UNION ALL
+        SELECT {{key}}, stat.weight, {VISITOR}
+        FROM {TrafficStat._meta.db_table} AS stat {{join}}
+        WHERE stat.id > (SELECT last_id FROM mark)
+          AND stat.created_at >= %(full_start)s AND stat.created_at < %(full_end)s
+    ) AS hits
+    WHERE key <> ''
+),
+totals AS (
+    SELECT key, SUM(hits) AS hits, SUM(error) AS error
+    FROM (SELECT key, hits, error FROM summary UNION ALL SELECT key, hits, 0 FROM raw) AS combined
+    GROUP BY key
+    ORDER BY hits DESC, key
+    LIMIT %(limit)s
+)
+SELECT totals.key, totals.hits, totals.error,
+       ARRAY(SELECT visitors_hll FROM summary WHERE summary.key = totals.key),
+       ARRAY(SELECT DISTINCT visitor FROM raw WHERE raw.key = totals.key)
+FROM totals
+ORDER BY totals.hits DESC, totals.key
+"""
+
+
+def parse_pending_user_agents(batch_size=1000):
+    """
+    Заполняет семейства браузера, ОС и устройства записям UserAgent, вставленным в обход справочника
+    (загрузка дампа, SQL). Возвращает количество разобранных записей.
+    """
+    parsed = 0
+    while True:
+        pending = list(UserAgent.objects.filter(browser__isnull=True).order_by('id')[:batch_size])
+        if not pending:
+            return parsed
+        for user_agent in pending:
+            for field, value in user_agent_fields(user_agent.value).items():
+                setattr(user_agent, field, value)
+        UserAgent.objects.bulk_update(pending, ['browser', 'os', 'device'])
+        parsed += len(pending)
+
+
+def merge_top_keys(summary, counts, capacity=TOP_KEYS_CAPACITY):
+    """
+    Добавляет точные счётчики порции counts {ключ: хиты} к сводке Space-Saving summary {ключ: (hits, error)}
+    и оставляет capacity ключей с наибольшими hits. Ключ, которого нет в заполненной сводке, встречался не чаще
+    её минимума, поэтому новый ключ получает этот минимум и в hits (оценка сверху), и в error.
+    """
+    floor = min(hits for hits, _ in summary.values()) if len(summary) >= capacity else 0
+    merged = dict(summary)
+    for key, hits in counts.items():
+        if key in merged:
+            merged[key] = (merged[key][0] + hits, merged[key][1])
+        else:
+            merged[key] = (floor + hits, floor)
+
+    if len(merged) > capacity:
+        merged = dict(heapq.nlargest(capacity, merged.items(), key=lambda item: item[1][0]))
+    return merged
+
+
+def update_day(dimension, day, counts, capacity):
+    """Вливает в сводку (dimension, day) порцию counts {ключ: (хиты, посетители)}."""
+    existing = {row.key: row for row in TrafficTopKey.objects.filter(dimension=dimension, day=day)}
+    merged = merge_top_keys(
+        {key: (row.hits, row.error) for key, row in existing.items()},
+        {key: hits for key, (hits, _) in counts.items()},
+        capacity,
+    )
+
+    evicted = existing.keys() - merged.keys()
+    if evicted:
+        TrafficTopKey.objects.filter(dimension=dimension, day=day, key__in=evicted).delete()
+
+    rows = []
+    for key, (hits, error) in merged.items():
+        if key not in counts:
+            continue
+        row = existing.get(key)
+        sketch = (
+            HyperLogLog.from_bytes(row.visitors_hll) if row is not None and row.visitors_hll is not None
+            else HyperLogLog(TOP_KEYS_HLL_PRECISION)
+        )
+        rows.append(TrafficTopKey(
+            dimension=dimension, day=day, key=key, hits=hits, error=error,
+            visitors_hll=sketch.update(counts[key][1]).to_bytes(),
+        ))
+
+    TrafficTopKey.objects.bulk_create(
+        rows, update_conflicts=True, unique_fields=['dimension', 'day', 'key'],
+        update_fields=['hits', 'error', 'visitors_hll'],
+    )
+
+
+def update_top_keys(batch_size=100000, settle_seconds=ROLLUP_SETTLE_SECONDS, capacity=TOP_KEYS_CAPACITY):
+    """
+    Инкрементально вливает новые строки TrafficStat (id выше отметки) в суточные сводки TrafficTopKey
+    по всем измерениям DIMENSIONS. Каждая порция обрабатывается в одной транзакции вместе со сдвигом отметки.
+    Возвращает количество обработанных id.
+    """
+    parse_pending_user_agents()
+
+    target_id = settled_high_id(TOP_KEYS_STATE, settle_seconds)
+
+    processed = 0
+    while True:
+        with transaction.atomic():
+            state, _ = TrafficRollupState.objects.select_for_update().get_or_create(name=TOP_KEYS_STATE)
+            low_id = state.last_traffic_stat_id
+            if low_id >= target_id:
+                return processed
+            high_id = min(low_id + batch_size, target_id)
+
+            for dimension, (key, join) in DIMENSIONS.items():
+                with connection.cursor() as cursor:
+                    cursor.execute(BATCH_SQL.format(key=key, join=join), [low_id, high_id])
+                    rows = cursor.fetchall()
+
+                days = defaultdict(dict)
+                for day, value, hits, visitors in rows:
+                    days[day][value] = (hits, visitors)
+                for day, counts in days.items():
+                    update_day(dimension, day, counts, capacity)
+
+            state.last_traffic_stat_id = high_id
+            state.save(update_fields=['last_traffic_stat_id', 'updated_at'])
+            processed += high_id - low_id
+
+
+def rebuild_top_keys(batch_size=100000, settle_seconds=ROLLUP_SETTLE_SECONDS):
+    with transaction.atomic():
+        TrafficTopKey.objects.all().delete()
+        TrafficRollupState.objects.filter(name=TOP_KEYS_STATE).delete()
+    return update_top_keys(batch_size=batch_size, settle_seconds=settle_seconds)
+
+
+def utc_midnight(moment, ceil=False):
+    moment = moment.astimezone(dt_timezone.utc)
+    midnight = datetime.combine(moment.date(), datetime.min.time(), tzinfo=dt_timezone.utc)
+    if ceil and midnight < moment:
+        midnight += timedelta(days=1)
+    return midnight
+
+
+def describe_keys(dimension, keys):
+    """Ключ измерения -> поля элемента ответа: для url и user_agent ключ - id записи справочника."""
+    if dimension == 'url':
+        values = dict(UrlPath.objects.filter(pk__in=keys).values_list('pk', 'value'))
+        return {key: {'value': values.get(int(key))} for key in keys}
+    if dimension == 'user_agent':
+        values = {
+            row['pk']: row
+            for row in UserAgent.objects.filter(pk__in=keys).values('pk', 'value', 'browser', 'os', 'device')
+        }
+        return {
+            key: {field: values.get(int(key), {}).get(field) for field in ('value', 'browser', 'os', 'device')}
+            for key in keys
+        }
+    return {key: {'value': key} for key in keys}
+
+
+def top_keys(dimension, start, end, limit=10):
+    """
+    limit самых частых значений измерения за [start, end): хиты с учётом весов, оценка их погрешности
+    (hits_error, 0 - точно) и число уникальных посетителей. Возвращает (элементы, приблизительно ли).
+    Полные сутки UTC берутся из сводок TrafficTopKey, поэтому запрос за год не группирует всю таблицу;
+    при TRAFFIC_USE_ROLLUPS = False и интервалах короче суток всё считается точно по TrafficStat.
+    """
+    if dimension not in DIMENSIONS:
+        raise ValueError(f"Неизвестное измерение: {dimension}")
+    if DIMENSIONS[dimension][1]:
+        parse_pending_user_agents()
+
+    full_start, full_end = utc_midnight(start, ceil=True), utc_midnight(end)
+    if not getattr(settings, 'TRAFFIC_USE_ROLLUPS', True) or full_start >= full_end:
+        full_start = full_end = end
+
+    key, join = DIMENSIONS[dimension]
+    with connection.cursor() as cursor:
+        cursor.execute(TOP_SQL.format(key=key, join=join), {
+            'state': TOP_KEYS_STATE,
+            'dimension': dimension,
+            'first_day': full_start.date(),
+            'last_day': full_end.date(),
+            'start': start,
+            'end': end,
+            'full_start': full_start,
+            'full_end': full_end,
+            'limit': limit,
+        })
+        rows = cursor.fetchall()
+
+    approximate = False
+    items = []
+    for value, hits, error, sketches, visitors in rows:
+        if sketches:
+            approximate = True
+            sketch = HyperLogLog.union(
+                (HyperLogLog.from_bytes(data) for data in sketches), TOP_KEYS_HLL_PRECISION
+            ).update(visitors)
+            visitor_count = sketch.cardinality()
+        else:
+            visitor_count = len(visitors)
+        items.append({'key': value, 'hits': int(hits), 'hits_error': int(error), 'visitors': visitor_count})
+
+    descriptions = describe_keys(dimension, [item['key'] for item in items])
+    return [{**descriptions[item.pop('key')], **item} for item in items], approximate
@@ -0,0 +1,260 @@
+import atexit
+import glob
+import json
+import logging
+import os
+import queue
+import re
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils.dateparse import parse_datetime
+
+from .dictionaries import resolve_hit
+from .models import TrafficStat
+from .spool import pid_alive
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_DROP = 'drop'
+OVERFLOW_BLOCK = 'block'
+OVERFLOW_SPILL = 'spill'
+
+# traffic-spill-<pid записавшего>.jsonl и тот же файл, взятый на загрузку: <...>.jsonl.<pid загружающего>.replay
+SPILL_FILE_RE = re.compile(r'traffic-spill-(?P<pid>\d+)\.jsonl(?:\.(?P<claimer>\d+)\.replay)?')
+
+DEFAULT_BUFFER_SETTINGS = {
+    'ENABLED': False,
+    'MAX_SIZE': 10000,
+    'BATCH_SIZE': 500,
+    'FLUSH_INTERVAL': 2.0,
+    'OVERFLOW': OVERFLOW_DROP,
+    'BLOCK_TIMEOUT': 0.5,
+    'SPILL_DIR': None,
+}
+
+
+def get_buffer_settings():
+    return {**DEFAULT_BUFFER_SETTINGS, **getattr(settings, 'TRAFFIC_BUFFER', {})}
+
+
+class TrafficBuffer:
+    """
+    Ограниченный буфер хитов в памяти процесса.
+    Фоновый поток сбрасывает накопленные записи через bulk_create при достижении BATCH_SIZE
+    или раз в FLUSH_INTERVAL секунд. При переполнении применяется политика OVERFLOW:
+    drop - хит отбрасывается, block - запрос ждёт BLOCK_TIMEOUT секунд, spill - хит пишется на диск.
+    """
+
+    def __init__(self, max_size=10000, batch_size=500, flush_interval=2.0, overflow=OVERFLOW_DROP,
+                 block_timeout=0.5, spill_dir=None):
+        if overflow not in (OVERFLOW_DROP, OVERFLOW_BLOCK, OVERFLOW_SPILL):
+            raise ValueError(f"Неизвестная политика переполнения: {overflow}")
+        if overflow == OVERFLOW_SPILL and not spill_dir:
+            raise ValueError("Для политики spill необходимо указать SPILL_DIR")
+
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self.spill_dir = spill_dir
+
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_size)
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._spill_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def start(self):
+        self._pid = os.getpid()
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name='traffic-buffer-flusher', daemon=True)
+        self._thread.start()
+
+    def _ensure_started(self):
+        # После fork (gunicorn --preload) поток родителя в дочернем процессе не существует
+        if self._pid != os.getpid() or self._thread is None or not self._thread.is_alive():
+            if self._pid != os.getpid():
+                self._queue = queue.Queue(maxsize=self.max_size)
+            self.start()
+
+    def add(self, hit):
+        self._ensure_started()
+
+        try:
+            self._queue.put_nowait(hit)
+        except queue.Full:
+            self._handle_overflow(hit)
+
+        if self._queue.qsize() >= self.batch_size:
+            self._wakeup.set()
+
+    def _handle_overflow(self, hit):
+        self._wakeup.set()
+
+        if self.overflow == OVERFLOW_BLOCK:
+            try:
+                self._queue.put(hit, timeout=self.block_timeout)
+                return
+            except queue.Full:
+                pass
+        elif self.overflow == OVERFLOW_SPILL:
+            self._spill([hit])
+            return
+
+        self.dropped += 1
+        logger.warning("Буфер трафика переполнен, хит отброшен (всего отброшено: %s)", self.dropped)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Ошибка фонового сброса буфера трафика")
+            finally:
+                close_old_connections()
+
+    def _drain(self):
+        batch = []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def flush(self):
+        """
+        Сбрасывает в БД всё накопленное содержимое буфера, а также ранее выгруженные на диск хиты.
+        Возвращает количество записанных строк.
+        """
+        written = 0
+        with self._flush_lock:
+            while True:
+                batch = self._drain()
+                if not batch:
+                    break
+                written += self._write(batch)
+
+            if self.spill_dir:
+                for hits in self._replay_spilled():
+                    written += self._write(hits)
+
+        return written
+
+    def _write(self, hits):
+        try:
+            # Хиты из файлов, выгруженных до перехода на справочники, ещё содержат строки
+            TrafficStat.objects.bulk_create(
+                [TrafficStat(**resolve_hit(hit)) for hit in hits], batch_size=self.batch_size
+            )
+            return len(hits)
+        except Exception:
+            logger.exception("Не удалось записать пакет из %s хитов", len(hits))
+            if self.spill_dir:
+                self._spill(hits)
+            else:
+                self.dropped += len(hits)
+            return 0
+
+    def _spill_path(self):
+        return os.path.join(self.spill_dir, f'traffic-spill-{os.getpid()}.jsonl')
+
+    def _spill(self, hits):
+        with self._spill_lock:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            with open(self._spill_path(), 'a', encoding='utf-8') as spill_file:
+                for hit in hits:
+                    spill_file.write(json.dumps({**hit, 'created_at': hit['created_at'].isoformat()}) + '\n')
+
+    def _claim_spilled(self):
+        """
+        Забирает на загрузку файлы выгрузки: свой - переименованием под _spill_lock, чтобы не разорвать
+        дописываемую строку, файлы и незавершённые загрузки завершившихся процессов. Файлы живых воркеров
+        не трогаются - каждый загружает свои сам. Возвращает пути взятых файлов.
+        """
+        pid = os.getpid()
+        claimed = []
+        for path in glob.glob(os.path.join(self.spill_dir, 'traffic-spill-*')):
+            match = SPILL_FILE_RE.fullmatch(os.path.basename(path))
+            if match is None:
+                continue
+            owner = int(match['claimer'] or match['pid'])
+            if owner != pid and pid_alive(owner):
+                continue
+
+            # Переименование атомарно: один и тот же файл не будет прочитан двумя воркерами
+            claimed_path = os.path.join(self.spill_dir, f"traffic-spill-{match['pid']}.jsonl.{pid}.replay")
+            try:
+                with self._spill_lock:
+                    if path != claimed_path:
+                        os.rename(path, claimed_path)
+            except OSError:
+                continue
+            claimed.append(claimed_path)
+        return claimed
+
+    def _replay_spilled(self):
+        for claimed_path in self._claim_spilled():
+            with open(claimed_path, encoding='utf-8') as spill_file:
+                hits = []
+                for number, line in enumerate(spill_file, 1):
+                    try:
+                        hit = json.loads(line)
+                        hit['created_at'] = parse_datetime(hit['created_at'])
+                        if hit['created_at'] is None:
+                            raise ValueError
+                    except (ValueError, TypeError, KeyError):
+                        # Обрезанная строка процесса, завершившегося во время записи
+                        logger.warning("Пропущена повреждённая запись %s:%s", claimed_path, number)
+                        continue
+                    hits.append(hit)
+                    if len(hits) >= self.batch_size:
+                        yield hits
+                        hits = []
+                if hits:
+                    yield hits
+            # Файл удаляется после загрузки целиком: при аварии загрузка повторится (возможны повторы пакетов)
+            os.remove(claimed_path)
+
+    def shutdown(self):
+        """Останавливает фоновый поток и сбрасывает остаток буфера. Вызывается при завершении воркера."""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None and self._thread.is_alive() and self._thread is not threading.current_thread():
+            self._thread.join(timeout=self.flush_interval + 5)
+        self.flush()
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_buffer():
+    """Возвращает буфер текущего процесса или None, если буферизация выключена в TRAFFIC_BUFFER."""
+    global _buffer
+
+    buffer_settings = get_buffer_settings()
+    if not buffer_settings['ENABLED']:
+        return None
+
+    with _buffer_lock:
+        if _buffer is None:
+            _buffer = TrafficBuffer(
+                max_size=buffer_settings['MAX_SIZE'],
+                batch_size=buffer_settings['BATCH_SIZE'],
+                flush_interval=buffer_settings['FLUSH_INTERVAL'],
+                overflow=buffer_settings['OVERFLOW'],
+                block_timeout=buffer_settings['BLOCK_TIMEOUT'],
+                spill_dir=buffer_settings['SPILL_DIR'],
+            )
+            atexit.register(_buffer.shutdown)
+
+    return _buffer
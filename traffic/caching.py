@@ -0,0 +1,119 @@
+import hashlib
+import json
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+DEFAULT_STATS_CACHE_SETTINGS = {
+    'ENABLED': True,
+    'ALIAS': 'default',
+    'KEY_PREFIX': 'traffic:period',
+    # TTL текущего (ещё не закрытого) периода
+    'CURRENT_TTL': 60,
+    # TTL закрытого периода. Опоздавшие хиты сбрасывают кеш сменой поколения (invalidate_late_hits),
+    # TTL ограничивает срок устаревшего ответа, если хиты записаны в обход агрегатора и загрузчика спула
+    'CLOSED_TTL': 24 * 60 * 60,
+    # Период считается закрытым спустя столько секунд после его конца: буфер и агрегатор успевают дописать хвост
+    'CLOSED_AFTER': 600,
+    # Single-flight: время жизни блокировки пересчёта и сколько ждать результата другого процесса
+    'LOCK_TIMEOUT': 30,
+    'WAIT_TIMEOUT': 10,
+    'POLL_INTERVAL': 0.05,
+}
+
+
+def get_stats_cache_settings():
+    return {**DEFAULT_STATS_CACHE_SETTINGS, **getattr(settings, 'TRAFFIC_STATS_CACHE', {})}
+
+
+def get_stats_cache():
+    return caches[get_stats_cache_settings()['ALIAS']]
+
+
+def _generation_key():
+    return f"{get_stats_cache_settings()['KEY_PREFIX']}:generation"
+
+
+def cache_generation():
+    return get_stats_cache().get_or_set(_generation_key(), 1, None)
+
+
+def invalidate_period_cache():
+    """Сбрасывает весь кеш статистики за период сменой поколения ключей (после пересчёта агрегатов, удаления секций)."""
+    cache = get_stats_cache()
+    try:
+        cache.incr(_generation_key())
+    except ValueError:
+        cache.set(_generation_key(), 2, None)
+
+
+def invalidate_late_hits(oldest_created_at, now=None):
+    """
+    Сбрасывает кеш, если записаны хиты уже закрытого периода: oldest_created_at - самое раннее время записанных хитов
+    (спул после простоя, выгрузка буфера, события с возрастом). Возвращает True, если кеш сброшен.
+    """
+    if oldest_created_at is None or not is_closed_period(oldest_created_at, now):
+        return False
+    invalidate_period_cache()
+    return True
+
+
+def period_cache_key(view_name, start, end, *variant):
+    parts = [view_name, start.isoformat(), end.isoformat(), timezone.get_current_timezone_name(), *map(str, variant)]
+    digest = hashlib.md5(':'.join(parts).encode()).hexdigest()
+    return f"{get_stats_cache_settings()['KEY_PREFIX']}:{cache_generation()}:{digest}"
+
+
+def is_closed_period(end, now=None):
+    now = now or timezone.now()
+    return end + timedelta(seconds=get_stats_cache_settings()['CLOSED_AFTER']) <= now
+
+
+def make_entry(status, data):
+    """Запись кеша: ответ, его ETag (хеш содержимого) и время вычисления для Last-Modified."""
+    body = json.dumps(data, cls=DjangoJSONEncoder, sort_keys=True, ensure_ascii=False)
+    return {
+        'status': status,
+        'data': data,
+        'etag': f'"{hashlib.md5(body.encode()).hexdigest()}"',
+        'last_modified': int(time.time()),
+    }
+
+
+def get_or_compute(key, compute, timeout):
+    """
+    Возвращает запись кеша по ключу, вычисляя её через compute() -> (status, data) при промахе.
+    Пересчёт холодного ключа выполняет один процесс (блокировка через cache.add),
+    остальные ждут его результат до WAIT_TIMEOUT и только затем считают сами.
+    """
+    cache_settings = get_stats_cache_settings()
+    cache = get_stats_cache()
+
+    entry = cache.get(key)
+    if entry is not None:
+        return entry
+
+    lock_key = f'{key}:lock'
+    token = uuid.uuid4().hex
+    if not cache.add(lock_key, token, cache_settings['LOCK_TIMEOUT']):
+        deadline = time.monotonic() + cache_settings['WAIT_TIMEOUT']
+        while time.monotonic() < deadline:
+            time.sleep(cache_settings['POLL_INTERVAL'])
+            entry = cache.get(key)
+            if entry is not None:
+                return entry
+            if cache.add(lock_key, token, cache_settings['LOCK_TIMEOUT']):
+                break
+
+    try:
+        entry = make_entry(*compute())
+        cache.set(key, entry, timeout)
+        return entry
+    finally:
+        if cache.get(lock_key) == token:
+            cache.delete(lock_key)
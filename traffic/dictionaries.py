@@ -0,0 +1,140 @@
+import threading
+from collections import OrderedDict
+from functools import partial
+
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.dispatch import receiver
+
+from .models import UrlPath, UserAgent
+from .useragents import user_agent_fields
+
+# Размер LRU-кэша строка -> id каждого справочника в процессе
+DEFAULT_DICTIONARY_CACHE_SIZE = 10000
+
+# Вычисляемые поля новой записи справочника по строке: User-Agent разбирается один раз, при вставке
+DICTIONARY_FIELDS = {UserAgent: user_agent_fields}
+
+
+class DictionaryCache:
+    """
+    Отображение строки в id записи справочника (UserAgent, UrlPath) с LRU-кэшем в памяти процесса.
+    Значения в справочниках не меняются и не удаляются, поэтому кэш не требует инвалидации:
+    на горячем пути запрос к БД выполняется только для строки, которой ещё нет в кэше.
+    """
+
+    def __init__(self, model, max_size=DEFAULT_DICTIONARY_CACHE_SIZE, fields=None):
+        self.model = model
+        self.max_size = max_size
+        self.fields = fields or (lambda value: {})
+        self.max_length = model._meta.get_field('value').max_length
+        self._ids = OrderedDict()
+        self._lock = threading.Lock()
+
+    def normalize(self, value):
+        return value[:self.max_length]
+
+    def cached(self, value):
+        with self._lock:
+            pk = self._ids.get(value)
+            if pk is not None:
+                self._ids.move_to_end(value)
+            return pk
+
+    def remember(self, value, pk):
+        with self._lock:
+            self._ids[value] = pk
+            self._ids.move_to_end(value)
+            while len(self._ids) > self.max_size:
+                self._ids.popitem(last=False)
+        return pk
+
+    def get_id(self, value):
+        if value is None:
+            return None
+        value = self.normalize(value)
+        pk = self.cached(value)
+        if pk is not None:
+            return pk
+
+        # get_or_create переживает гонку вставки одной строки из нескольких воркеров за счёт уникального индекса
+        pk = self.model.objects.get_or_create(value=value, defaults=self.fields(value))[0].pk
+        # id попадает в кэш только после фиксации: откат внешней транзакции не оставит ссылку на несуществующую запись
+        transaction.on_commit(partial(self.remember, value, pk))
+        return pk
+
+    def get_ids(self, values):
+        """
+        Пакетный вариант get_id: {строка: id} для всех values. Отсутствующие в кэше строки вставляются одним
+        INSERT ... ON CONFLICT DO NOTHING и читаются одним запросом.
+        """
+        ids, missing = {}, {}
+        for value in set(values) - {None}:
+            normalized = self.normalize(value)
+            pk = self.cached(normalized)
+            if pk is not None:
+                ids[value] = pk
+            else:
+                missing.setdefault(normalized, []).append(value)
+
+        if missing:
+            self.model.objects.bulk_create(
+                [self.model(value=value, **self.fields(value)) for value in missing], ignore_conflicts=True
+            )
+            for pk, normalized in self.model.objects.filter(value__in=list(missing)).values_list('pk', 'value'):
+                transaction.on_commit(partial(self.remember, normalized, pk))
+                for value in missing[normalized]:
+                    ids[value] = pk
+        return ids
+
+    async def aget_id(self, value):
+        if value is None:
+            return None
+        pk = self.cached(self.normalize(value))
+        if pk is not None:
+            return pk
+        return await sync_to_async(self.get_id)(value)
+
+    def clear(self):
+        with self._lock:
+            self._ids.clear()
+
+
+_caches = {}
+
+
+def get_dictionary_cache(model):
+    cache = _caches.get(model)
+    if cache is None:
+        cache = _caches[model] = DictionaryCache(
+            model,
+            getattr(settings, 'TRAFFIC_DICTIONARY_CACHE_SIZE', DEFAULT_DICTIONARY_CACHE_SIZE),
+            DICTIONARY_FIELDS.get(model),
+        )
+    return cache
+
+
+def resolve_hit(hit):
+    """Заменяет строки user_agent и url в словаре хита ссылками user_agent_id и url_id."""
+    if 'user_agent' in hit:
+        hit['user_agent_id'] = get_dictionary_cache(UserAgent).get_id(hit.pop('user_agent'))
+    if 'url' in hit:
+        hit['url_id'] = get_dictionary_cache(UrlPath).get_id(hit.pop('url'))
+    return hit
+
+
+async def aresolve_hit(hit):
+    if 'user_agent' in hit:
+        hit['user_agent_id'] = await get_dictionary_cache(UserAgent).aget_id(hit.pop('user_agent'))
+    if 'url' in hit:
+        hit['url_id'] = await get_dictionary_cache(UrlPath).aget_id(hit.pop('url'))
+    return hit
+
+
+@receiver(setting_changed)
+def reset_dictionary_caches(setting, **kwargs):
+    if setting == 'TRAFFIC_DICTIONARY_CACHE_SIZE':
+        _caches.clear()
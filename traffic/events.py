@@ -0,0 +1,128 @@
+import json
+import logging
+import re
+from datetime import timedelta
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .spool import copy_hits, get_spool
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EVENTS_SETTINGS = {
+    # Событий в одной пачке POST /api/traffic/events/
+    'MAX_BATCH': 100,
+    # Размер свойств события в JSON
+    'MAX_PROPERTIES_BYTES': 1024,
+    # Событие, отправленное позже, записывается со временем now - MAX_AGE_SECONDS
+    'MAX_AGE_SECONDS': 3600,
+}
+
+# Имя события: click, signup, checkout.paid, video:play
+EVENT_NAME_RE = re.compile(r'[\w.:-]{1,64}')
+URL_MAX_LENGTH = 255
+
+
+def get_events_settings():
+    return {**DEFAULT_EVENTS_SETTINGS, **getattr(settings, 'TRAFFIC_EVENTS', {})}
+
+
+def validate_event(data, events_settings):
+    """Проверенное событие {name, url, properties, age} или ValueError с описанием ошибки."""
+    if not isinstance(data, dict):
+        raise ValueError("Событие должно быть объектом")
+
+    name = data.get('name')
+    if not isinstance(name, str) or not EVENT_NAME_RE.fullmatch(name):
+        raise ValueError("name - от 1 до 64 букв, цифр и символов _ . : -")
+
+    url = data.get('url')
+    if url is not None and (not isinstance(url, str) or not url.startswith('/') or len(url) > URL_MAX_LENGTH):
+        raise ValueError(f"url - путь, начинающийся с /, не длиннее {URL_MAX_LENGTH} символов")
+
+    properties = data.get('properties')
+    if properties is not None:
+        if not isinstance(properties, dict):
+            raise ValueError("properties должно быть объектом")
+        encoded = json.dumps(properties, ensure_ascii=False, separators=(',', ':'))
+        if len(encoded.encode()) > events_settings['MAX_PROPERTIES_BYTES']:
+            raise ValueError(f"properties больше {events_settings['MAX_PROPERTIES_BYTES']} байт")
+        # jsonb не хранит символ NUL, такая строка сорвала бы COPY всей пачки
+        if '\\u0000' in encoded:
+            raise ValueError("properties не может содержать символ NUL")
+
+    # Возраст события на момент отправки пачки, а не время клиента: часы клиента могут расходиться с сервером
+    age_ms = data.get('age_ms', 0)
+    if isinstance(age_ms, bool) or not isinstance(age_ms, (int, float)) or age_ms < 0:
+        raise ValueError("age_ms - неотрицательное число миллисекунд")
+    age = min(timedelta(milliseconds=age_ms), timedelta(seconds=events_settings['MAX_AGE_SECONDS']))
+
+    return {'name': name, 'url': url, 'properties': properties or None, 'age': age}
+
+
+def validate_events(events, events_settings=None):
+    """
+    Проверяет пачку целиком за один проход. Возвращает (принятые события, отклонённые [{index, error}]):
+    ошибка в одном событии не отменяет остальные - повторить отправку маяк всё равно не может.
+    """
+    events_settings = events_settings or get_events_settings()
+    accepted, rejected = [], []
+    for index, data in enumerate(events):
+        try:
+            accepted.append(validate_event(data, events_settings))
+        except ValueError as error:
+            rejected.append({'index': index, 'error': str(error)})
+    return accepted, rejected
+
+
+def referer_path(request):
+    referer = request.META.get('HTTP_REFERER')
+    if not referer:
+        return None
+    return urlsplit(referer).path[:URL_MAX_LENGTH] or None
+
+
+def event_hits(events, request, user, session_id):
+    """Хиты событий в формате хитов TrafficTrackingMiddleware: посетитель и время берутся из запроса с пачкой."""
+    received_at = timezone.now()
+    base = {
+        'ip_address': request.META.get('REMOTE_ADDR'),
+        'user_id': user.pk if user is not None and user.is_authenticated else None,
+        'user_agent': request.META.get('HTTP_USER_AGENT', ''),
+        'session_id': session_id,
+        'weight': 1,
+    }
+    default_url = referer_path(request)
+    return [
+        {
+            **base,
+            'url': event['url'] or default_url,
+            'event': event['name'],
+            'properties': event['properties'],
+            'created_at': received_at - event['age'],
+        }
+        for event in events
+    ]
+
+
+def record_events(hits):
+    """
+    Записывает пачку хитов событий одной операцией: одним write в спул, если он включён,
+    иначе одним COPY в транзакции вместе с пополнением справочников.
+    """
+    if not hits:
+        return
+
+    spool = get_spool()
+    if spool is not None:
+        try:
+            spool.extend(hits)
+            return
+        except OSError:
+            logger.exception("Не удалось записать события в спул, события записываются в БД")
+
+    with transaction.atomic():
+        copy_hits(hits)
@@ -0,0 +1,113 @@
+import csv
+import io
+import json
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+EXPORT_FIELDS = ('id', 'created_at', 'ip_address', 'user_id', 'session_id', 'url', 'user_agent', 'event', 'weight')
+# Колонки выгрузки, которые читаются из справочников
+EXPORT_LOOKUPS = {'url': 'url__value', 'user_agent': 'user_agent__value'}
+
+# Размер порции серверного курсора и одновременно размер блока, отдаваемого клиенту
+EXPORT_CHUNK_SIZE = getattr(settings, 'TRAFFIC_EXPORT_CHUNK_SIZE', 5000)
+
+
+def iter_chunks(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Строки queryset кортежами EXPORT_FIELDS, порциями по chunk_size.
+    iterator() читает через серверный курсор, в памяти держится не больше одной порции.
+    """
+    chunk = []
+    fields = [EXPORT_LOOKUPS.get(field, field) for field in EXPORT_FIELDS]
+    for row in queryset.values_list(*fields).iterator(chunk_size=chunk_size):
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class Echo:
+    """Псевдофайл для csv.writer: write возвращает строку вместо записи."""
+
+    def write(self, value):
+        return value
+
+
+def stream_csv(queryset):
+    writer = csv.writer(Echo())
+    yield writer.writerow(EXPORT_FIELDS)
+    for chunk in iter_chunks(queryset):
+        yield ''.join(writer.writerow(row) for row in chunk)
+
+
+def stream_ndjson(queryset):
+    encoder = DjangoJSONEncoder(ensure_ascii=False)
+    for chunk in iter_chunks(queryset):
+        yield ''.join(encoder.encode(dict(zip(EXPORT_FIELDS, row))) + '\n' for row in chunk)
+
+
+class _ByteSink(io.RawIOBase):
+    """Буфер, из которого генератор забирает уже записанные ParquetWriter байты."""
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.buffer += data
+        return len(data)
+
+    def drain(self):
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+
+def parquet_schema():
+    return pyarrow.schema([
+        ('id', pyarrow.int64()),
+        ('created_at', pyarrow.timestamp('us', tz='UTC')),
+        ('ip_address', pyarrow.string()),
+        ('user_id', pyarrow.int64()),
+        ('session_id', pyarrow.string()),
+        ('url', pyarrow.string()),
+        ('user_agent', pyarrow.string()),
+        ('event', pyarrow.string()),
+        ('weight', pyarrow.int64()),
+    ])
+
+
+def stream_parquet(queryset):
+    """Каждая порция - отдельная группа строк Parquet; после неё клиенту отдаются накопленные байты."""
+    schema = parquet_schema()
+    sink = _ByteSink()
+    writer = pyarrow.parquet.ParquetWriter(sink, schema, compression='zstd')
+
+    for chunk in iter_chunks(queryset):
+        columns = list(zip(*chunk))
+        columns[2] = [str(ip) for ip in columns[2]]
+        writer.write_table(pyarrow.Table.from_arrays(
+            [pyarrow.array(column, type=field.type) for column, field in zip(columns, schema)], schema=schema
+        ))
+        yield sink.drain()
+
+    writer.close()
+    yield sink.drain()
+
+
+EXPORT_FORMATS = {
+    'csv': (stream_csv, 'text/csv; charset=utf-8'),
+    'ndjson': (stream_ndjson, 'application/x-ndjson'),
+    'parquet': (stream_parquet, 'application/vnd.apache.parquet'),
+}
@@ -0,0 +1,86 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+
+from .models import TrafficStat, UrlPath
+
+MAX_FUNNEL_STEPS = 10
+# Окно воронки по умолчанию и наибольшее, минуты
+DEFAULT_FUNNEL_WINDOW = 60
+MAX_FUNNEL_WINDOW = 7 * 24 * 60
+
+# Размер порции серверного курсора
+FUNNEL_CHUNK_SIZE = getattr(settings, 'TRAFFIC_FUNNEL_CHUNK_SIZE', 10000)
+
+
+def step_key(step, url_ids):
+    """Шаг воронки - путь страницы (начинается с /, совпадает с просмотром страницы) или имя клиентского события."""
+    if step.startswith('/'):
+        return 'url', url_ids.get(step)
+    return 'event', step
+
+
+def funnel_rows(steps, start, end):
+    """(session_id, url_id, event, created_at) хитов шагов воронки по порядку (session_id, created_at)."""
+    url_ids = dict(UrlPath.objects.filter(value__in=[step for step in steps if step.startswith('/')])
+                   .values_list('value', 'pk'))
+    events = [step for step in steps if not step.startswith('/')]
+    steps_filter = Q(url_id__in=list(url_ids.values()), event__isnull=True) | Q(event__in=events)
+
+    rows = (
+        TrafficStat.objects
+        .filter(steps_filter, created_at__gte=start, created_at__lt=end, session_id__isnull=False)
+        .order_by('session_id', 'created_at', 'id')
+        .values_list('session_id', 'url_id', 'event', 'created_at')
+        .iterator(chunk_size=FUNNEL_CHUNK_SIZE)
+    )
+    return rows, url_ids
+
+
+def funnel(steps, start, end, window=timedelta(minutes=DEFAULT_FUNNEL_WINDOW)):
+    """
+    Воронка за [start, end): сколько посетителей (session_id) прошли шаги steps по порядку так, что от первого
+    до последнего пройденного шага прошло не больше window. Другие хиты между шагами допускаются.
+    Хиты шагов читаются одним проходом по серверному курсору, в памяти - только состояние текущего посетителя:
+    started[k] - самое позднее начало попытки, дошедшей до шага k (у поздней попытки больше времени на остальные шаги).
+    Возвращает число посетителей, дошедших до каждого шага.
+    """
+    rows, url_ids = funnel_rows(steps, start, end)
+    positions = {}
+    for index, step in enumerate(steps):
+        positions.setdefault(step_key(step, url_ids), []).insert(0, index)
+
+    reached = [0] * len(steps)
+    current, started, deepest = None, None, -1
+
+    def finish():
+        for index in range(deepest + 1):
+            reached[index] += 1
+
+    for session_id, url_id, event, created_at in rows:
+        if session_id != current:
+            finish()
+            current, started, deepest = session_id, [None] * len(steps), -1
+
+        # Шаги проверяются с конца: один хит не засчитывается сразу за два одинаковых шага подряд
+        for index in positions.get(('url', url_id) if event is None else ('event', event), ()):
+            if index == 0:
+                started[0] = created_at
+            elif started[index - 1] is not None and created_at - started[index - 1] <= window:
+                started[index] = started[index - 1]
+            else:
+                continue
+            deepest = max(deepest, index)
+    finish()
+
+    result = []
+    for index, (step, visitors) in enumerate(zip(steps, reached)):
+        previous = reached[index - 1] if index else visitors
+        result.append({
+            'step': step,
+            'visitors': visitors,
+            'conversion': visitors / reached[0] if reached[0] else 0.0,
+            'step_conversion': visitors / previous if previous else 0.0,
+        })
+    return result
@@ -0,0 +1,92 @@
+import hashlib
+import math
+import zlib
+
+# 2^12 регистров: стандартная ошибка 1.04 / sqrt(4096) ~ 1.6%, в сжатом виде скетч занимает от десятков байт до ~3 КБ
+HLL_PRECISION = 12
+
+
+def relative_error(precision=HLL_PRECISION):
+    """Стандартная относительная ошибка оценки HyperLogLog: 1.04 / sqrt(2^precision)."""
+    return 1.04 / math.sqrt(1 << precision)
+
+
+class HyperLogLog:
+    """
+    Скетч HyperLogLog для приблизительного подсчёта уникальных значений.
+    Скетчи с одинаковой точностью объединяются (merge) без потери точности,
+    поэтому уникальные значения за период - объединение почасовых скетчей.
+    """
+
+    def __init__(self, precision=HLL_PRECISION, registers=None):
+        if not 4 <= precision <= 18:
+            raise ValueError(f"Недопустимая точность HyperLogLog: {precision}")
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = bytearray(registers) if registers is not None else bytearray(self.size)
+        if len(self.registers) != self.size:
+            raise ValueError("Число регистров не соответствует точности HyperLogLog")
+
+    @staticmethod
+    def _hash(value):
+        return int.from_bytes(hashlib.blake2b(str(value).encode(), digest_size=8).digest(), 'big')
+
+    def add(self, value):
+        hashed = self._hash(value)
+        index = hashed >> (64 - self.precision)
+        remainder = hashed & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - remainder.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def update(self, values):
+        for value in values:
+            self.add(value)
+        return self
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError("Нельзя объединить скетчи HyperLogLog с разной точностью")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    @classmethod
+    def union(cls, sketches, precision=HLL_PRECISION):
+        """
+        Объединение многих скетчей: регистры каждого скетча - одно большое целое с 8-битными полосами,
+        поразрядный максимум считается несколькими операциями над целыми без цикла по регистрам в Python.
+        Для тысяч скетчей (по одному на час за год) на порядок быстрее последовательных merge.
+        """
+        size = 1 << precision
+        # Ранг не больше 64 - precision + 1 < 128, поэтому старший бит каждой полосы свободен
+        high = int.from_bytes(b'\x80' * size, 'big')
+        result = 0
+        for sketch in sketches:
+            if sketch.precision != precision:
+                raise ValueError("Нельзя объединить скетчи HyperLogLog с разной точностью")
+            registers = int.from_bytes(sketch.registers, 'big')
+            # В полосах, где result >= registers, старший бит разности остаётся установленным
+            keep = ((result | high) - registers) & high
+            keep = (keep << 1) - (keep >> 7)
+            result = (result & keep) | (registers & ~keep)
+        return cls(precision, result.to_bytes(size, 'big'))
+
+    def cardinality(self):
+        m = self.size
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -register for register in self.registers)
+
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Малые мощности: линейный подсчёт по пустым регистрам точнее
+            estimate = m * math.log(m / zeros)
+
+        return int(round(estimate))
+
+    def to_bytes(self):
+        return bytes([self.precision]) + zlib.compress(bytes(self.registers))
+
+    @classmethod
+    def from_bytes(cls, data):
+        data = bytes(data)
+        return cls(precision=data[0], registers=zlib.decompress(data[1:]))
@@ -0,0 +1,140 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LIVE_SETTINGS = {
+    # Интервал опроса БД и трекера присутствия, один на процесс независимо от числа подключённых клиентов
+    'INTERVAL': 5.0,
+    # Комментарий-пинг в потоке SSE, чтобы прокси не закрывали простаивающее соединение
+    'KEEPALIVE': 15.0,
+    # Медленный клиент теряет события сверх QUEUE_SIZE, остальные клиенты его не ждут
+    'QUEUE_SIZE': 100,
+}
+
+
+def get_live_settings():
+    return {**DEFAULT_LIVE_SETTINGS, **getattr(settings, 'TRAFFIC_LIVE', {})}
+
+
+def diff_snapshots(previous, current):
+    """
+    События между двумя снимками: hits - показатели текущих корзин, online - число онлайн,
+    presence - пользователи, появившиеся и пропавшие из онлайна. previous=None - полный снимок для нового клиента.
+    """
+    events = []
+    if previous is None or previous['buckets'] != current['buckets']:
+        events.append(('hits', current['buckets']))
+    if previous is None or previous['online_count'] != current['online_count']:
+        events.append(('online', {'count': current['online_count']}))
+
+    before = previous['online_user_ids'] if previous else set()
+    online, offline = current['online_user_ids'] - before, before - current['online_user_ids']
+    if previous is None or online or offline:
+        events.append(('presence', {'online': sorted(online), 'offline': sorted(offline)}))
+
+    return events
+
+
+def format_event(name, data):
+    return f"event: {name}\ndata: {json.dumps(data, cls=DjangoJSONEncoder, ensure_ascii=False)}\n\n"
+
+
+class LiveFeed:
+    """
+    Раздача обновлений трафика подписчикам SSE.
+    Один фоновый поток на процесс раз в INTERVAL секунд снимает снимок (snapshot) и рассылает изменения
+    в очереди подписчиков, поэтому нагрузка на БД не растёт с числом открытых вкладок.
+    Поток запускается с первым подписчиком и останавливается, когда подписчиков не остаётся.
+    """
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self._subscribers = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._last = None
+
+    def subscribe(self):
+        """Регистрирует подписчика и возвращает его очередь событий - asyncio.Queue текущего цикла событий."""
+        queue = asyncio.Queue(maxsize=get_live_settings()['QUEUE_SIZE'])
+        loop = asyncio.get_running_loop()
+
+        with self._lock:
+            self._subscribers[queue] = loop
+            if self._last is not None:
+                for event in diff_snapshots(None, self._last):
+                    queue.put_nowait(event)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='traffic-live-feed', daemon=True)
+                self._thread.start()
+
+        return queue
+
+    def unsubscribe(self, queue):
+        with self._lock:
+            self._subscribers.pop(queue, None)
+
+    def _publish(self, events):
+        with self._lock:
+            subscribers = list(self._subscribers.items())
+
+        for queue, loop in subscribers:
+            for event in events:
+                try:
+                    loop.call_soon_threadsafe(self._put, queue, event)
+                except RuntimeError:
+                    # Цикл событий подписчика уже закрыт
+                    self.unsubscribe(queue)
+
+    @staticmethod
+    def _put(queue, event):
+        try:
+            queue.put_nowait(event)
+        except asyncio.QueueFull:
+            pass
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._subscribers:
+                    self._thread = None
+                    self._last = None
+                    return
+
+            try:
+                current = self.snapshot()
+                events = diff_snapshots(self._last, current)
+                self._last = current
+                if events:
+                    self._publish(events)
+            except Exception:
+                logger.exception("Не удалось получить снимок живой статистики")
+            finally:
+                close_old_connections()
+
+            time.sleep(get_live_settings()['INTERVAL'])
+
+    async def stream(self):
+        """Асинхронный генератор тела ответа text/event-stream для одного клиента."""
+        queue = self.subscribe()
+        live_settings = get_live_settings()
+        keepalive = live_settings['KEEPALIVE']
+        try:
+            yield f"retry: {int(live_settings['INTERVAL'] * 1000)}\n\n"
+            while True:
+                try:
+                    name, data = await asyncio.wait_for(queue.get(), timeout=keepalive)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield format_event(name, data)
+        finally:
+            self.unsubscribe(queue)
@@ -0,0 +1,63 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from traffic.benchmark import run_benchmark
+
+METRICS = ('p50_ms', 'p95_ms', 'p99_ms', 'queries', 'rows_scanned')
+
+
+class Command(BaseCommand):
+    help = (
+        "Замеры middleware и API статистики на текущих данных (см. traffic_seed): p50/p95/p99, "
+        "число SQL-запросов и прочитанных строк. Сохраните отчёт (--output) и сравните с ним на другом коммите "
+        "(--compare)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=50, help="Замеров на сценарий")
+        parser.add_argument('--warmup', type=int, default=5, help="Прогревочных вызовов на сценарий")
+        parser.add_argument('--deep-page', type=int, default=400, help="Номер глубокой страницы журнала запросов")
+        parser.add_argument('--scenario', action='append', dest='scenarios',
+                            help="Запустить только указанный сценарий, можно указать несколько")
+        parser.add_argument('--with-cache', action='store_true',
+                            help="Не выключать кэш статистики за период (TRAFFIC_STATS_CACHE)")
+        parser.add_argument('--output', help="Сохранить отчёт в JSON-файл")
+        parser.add_argument('--compare', help="JSON-файл ранее сохранённого отчёта для сравнения")
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 2:
+            raise CommandError("--iterations должен быть не меньше 2")
+
+        previous = {}
+        if options['compare']:
+            try:
+                with open(options['compare'], encoding='utf-8') as report_file:
+                    previous = json.load(report_file)['scenarios']
+            except (OSError, ValueError, KeyError) as exc:
+                raise CommandError(f"Не удалось прочитать отчёт {options['compare']}: {exc}")
+
+        report = run_benchmark(
+            iterations=options['iterations'],
+            warmup=options['warmup'],
+            deep_page=options['deep_page'],
+            scenarios=options['scenarios'],
+            stats_cache=options['with_cache'],
+            progress=lambda name, result: self.write_result(name, result, previous.get(name)),
+        )
+        self.stdout.write(f"Коммит: {report['commit']}, данные: {report['dataset']}")
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as report_file:
+                json.dump(report, report_file, indent=2, ensure_ascii=False)
+
+    def write_result(self, name, result, before):
+        self.stdout.write(self.style.MIGRATE_LABEL(f"{name}: {result['description']}"))
+        parts = []
+        for metric in METRICS:
+            value = result[metric]
+            part = f"{metric} {value}"
+            if before and before.get(metric) and value is not None:
+                part += f" (было {before[metric]}, {(value - before[metric]) / before[metric]:+.0%})"
+            parts.append(part)
+        self.stdout.write('  ' + ', '.join(parts))
@@ -0,0 +1,120 @@
+from datetime import timedelta
+from types import SimpleNamespace
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Max
+from django.http import QueryDict
+from django.utils import timezone
+
+from traffic.models import TrafficStat, UrlPath, UserAgent
+from traffic.stats import raw_period_queryset
+from traffic.views import filter_traffic_stats
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        "Выводит планы основных запросов к TrafficStat с индексами и без них (--compare). "
+        "Все изменения (тестовые данные, удаление индексов) выполняются в транзакции и откатываются."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0,
+                            help="Сгенерировать указанное число синтетических хитов перед замером")
+        parser.add_argument('--days', type=int, default=90,
+                            help="Период, на который распределяются синтетические хиты")
+        parser.add_argument('--compare', action='store_true',
+                            help="Дополнительно показать планы без индексов TrafficStat (до миграции 0003)")
+        parser.add_argument('--no-analyze', action='store_true',
+                            help="Не выполнять запросы, только EXPLAIN")
+        parser.add_argument('--url', default='page/42',
+                            help="Подстрока для фильтра url__value__icontains")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            if options['seed']:
+                self.seed(options['seed'], options['days'])
+
+            if options['compare']:
+                with transaction.atomic():
+                    self.drop_indexes()
+                    self.print_plans("БЕЗ ИНДЕКСОВ", options)
+                    transaction.set_rollback(True)
+
+            self.print_plans("С ИНДЕКСАМИ", options)
+            transaction.set_rollback(True)
+
+    def seed(self, count, days):
+        user_ids = list(User.objects.values_list('id', flat=True)[:1000])
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO {UserAgent._meta.db_table} (value)
+                SELECT 'Mozilla/5.0 (synthetic ' || g || ')' FROM generate_series(0, 39) AS g
+                ON CONFLICT (value) DO NOTHING;
+                INSERT INTO {UrlPath._meta.db_table} (value)
+                SELECT '/page/' || g || '/' FROM generate_series(0, 499) AS g
+                ON CONFLICT (value) DO NOTHING;
+                """
+            )
+            cursor.execute(
+                f"""
+                INSERT INTO {TrafficStat._meta.db_table} (ip_address, user_id, user_agent_id, created_at, url_id, session_id)
+                SELECT ('10.' || (g %% 250) || '.' || (g / 250 %% 250) || '.1')::inet,
+                       CASE WHEN g %% 3 = 0
+                            THEN (%(users)s::bigint[])[1 + (g / 3) %% NULLIF(cardinality(%(users)s::bigint[]), 0)]
+                       END,
+                       user_agent.id,
+                       NOW() - (%(count)s - g)::float / %(count)s * %(days)s * INTERVAL '1 day',
+                       url_path.id,
+                       md5((g / 20)::text)
+                FROM generate_series(1, %(count)s) AS g
+                JOIN {UserAgent._meta.db_table} AS user_agent
+                    ON user_agent.value = 'Mozilla/5.0 (synthetic ' || (g %% 40) || ')'
+                JOIN {UrlPath._meta.db_table} AS url_path ON url_path.value = '/page/' || (g %% 500) || '/'
+                """,
+                {'users': user_ids, 'count': count, 'days': days},
+            )
+            cursor.execute(f"ANALYZE {UserAgent._meta.db_table}")
+            cursor.execute(f"ANALYZE {UrlPath._meta.db_table}")
+            cursor.execute(f"ANALYZE {TrafficStat._meta.db_table}")
+        self.stdout.write(f"Сгенерировано хитов: {count}")
+
+    def drop_indexes(self):
+        with connection.cursor() as cursor:
+            for index in TrafficStat._meta.indexes + UrlPath._meta.indexes:
+                cursor.execute(f'DROP INDEX IF EXISTS "{index.name}"')
+            cursor.execute(f"ANALYZE {TrafficStat._meta.db_table}")
+
+    def get_queries(self, options):
+        end = timezone.now()
+        queries = [
+            ("Статистика за месяц по дням", raw_period_queryset(end - timedelta(days=30), end, 'day')),
+            (
+                "Активные сессии за 5 минут",
+                TrafficStat.objects.filter(created_at__gte=end - timedelta(minutes=5))
+                .values('session_id').annotate(last_active=Max('created_at')),
+            ),
+            (
+                "Поиск по URL",
+                filter_traffic_stats(SimpleNamespace(GET=QueryDict(f"url={options['url']}")))[:25],
+            ),
+        ]
+
+        user = User.objects.filter(traffic_stats__isnull=False).first()
+        if user:
+            queries += [
+                ("Последние хиты пользователя", TrafficStat.objects.filter(user=user).order_by('-created_at')[:25]),
+                ("Журнал запросов пользователя", filter_traffic_stats(SimpleNamespace(GET=QueryDict()), user)[:25]),
+            ]
+        return queries
+
+    def print_plans(self, title, options):
+        self.stdout.write(self.style.MIGRATE_HEADING(f"===== {title} ====="))
+        for name, queryset in self.get_queries(options):
+            plan = queryset.explain(analyze=not options['no_analyze'], buffers=not options['no_analyze'])
+            self.stdout.write(self.style.MIGRATE_LABEL(f"--- {name}"))
+            self.stdout.write(plan)
@@ -0,0 +1,55 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, close_old_connections
+
+from traffic.spool import expire_ingest_batches, get_spool_settings, ingest_ready, spool_status
+
+
+class Command(BaseCommand):
+    help = (
+        "Загружает хиты из локального спула (TRAFFIC_SPOOL) в TrafficStat через COPY. "
+        "Один воркер обслуживает все процессы приложения на хосте"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-records', type=int, default=50000,
+                            help="Примерное число хитов в одной транзакции COPY")
+        parser.add_argument('--loop', action='store_true',
+                            help="Работать в фоне, проверяя спул каждые --interval секунд")
+        parser.add_argument('--interval', type=float, default=1.0)
+        parser.add_argument('--status', action='store_true', help="Показать метрики отставания загрузки и выйти")
+
+    def handle(self, *args, **options):
+        spool_settings = get_spool_settings()
+        if not spool_settings['ENABLED']:
+            self.stdout.write("Спул выключен (TRAFFIC_SPOOL['ENABLED']), загружать нечего")
+            return
+
+        directory = spool_settings['DIR']
+        if options['status']:
+            for key, value in spool_status(directory).items():
+                self.stdout.write(f"{key}: {value}")
+            return
+
+        last_expired = 0.0
+        while True:
+            try:
+                ingested = ingest_ready(directory, options['max_records'])
+                if ingested or not options['loop']:
+                    self.stdout.write(f"Загружено хитов: {ingested}")
+
+                if time.monotonic() - last_expired > 3600:
+                    expire_ingest_batches(spool_settings['DEDUP_RETENTION_DAYS'])
+                    last_expired = time.monotonic()
+            except DatabaseError as exc:
+                # Сегменты остаются в спуле и будут загружены, когда БД снова станет доступна
+                if not options['loop']:
+                    raise
+                self.stderr.write(f"БД недоступна, загрузка будет повторена: {exc}")
+
+            if not options['loop']:
+                break
+
+            close_old_connections()
+            time.sleep(options['interval'])
@@ -0,0 +1,85 @@
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from importlib import import_module
+
+import requests
+from django.conf import settings
+from django.contrib.auth import get_user_model, BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.core.management.base import BaseCommand, CommandError
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        "Нагрузочный тест запущенного сервера: N параллельных клиентов в течение --duration секунд. "
+        "Запустите один раз против gunicorn (WSGI) и один раз против uvicorn (ASGI) и сравните результаты."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+        parser.add_argument('--path', action='append', dest='paths',
+                            help="Путь для запросов, можно указать несколько (по кругу). "
+                                 "По умолчанию - эндпоинты статистики за период")
+        parser.add_argument('--concurrency', type=int, default=50, help="Число одновременных клиентов")
+        parser.add_argument('--duration', type=float, default=30.0, help="Длительность теста в секундах")
+        parser.add_argument('--user', help="Имя пользователя, от которого выполняются запросы (сессия создаётся в БД)")
+
+    def handle(self, *args, **options):
+        paths = options['paths'] or [
+            '/api/traffic/daily/', '/api/traffic/weekly/', '/api/traffic/monthly/', '/api/traffic/yearly/',
+        ]
+        cookies = self.login(options['user']) if options['user'] else {}
+
+        deadline = time.monotonic() + options['duration']
+        latencies, errors = [], []
+        lock = threading.Lock()
+
+        def client(number):
+            with requests.Session() as session:
+                session.cookies.update(cookies)
+                i = number
+                while time.monotonic() < deadline:
+                    url = options['base_url'] + paths[i % len(paths)]
+                    i += 1
+                    started = time.perf_counter()
+                    try:
+                        status_code = session.get(url, timeout=30).status_code
+                    except requests.RequestException as exc:
+                        status_code = type(exc).__name__
+                    elapsed = time.perf_counter() - started
+                    with lock:
+                        if isinstance(status_code, int) and status_code < 500:
+                            latencies.append(elapsed)
+                        else:
+                            errors.append(status_code)
+
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            list(executor.map(client, range(options['concurrency'])))
+        elapsed = time.monotonic() - started
+
+        if not latencies:
+            raise CommandError(f"Нет успешных ответов, ошибки: {errors[:5]}")
+
+        quantiles = statistics.quantiles(latencies, n=100)
+        self.stdout.write(
+            f"Запросов: {len(latencies)}, ошибок: {len(errors)}, RPS: {len(latencies) / elapsed:.1f}\n"
+            f"Задержка, мс: p50 {quantiles[49] * 1000:.1f}, p95 {quantiles[94] * 1000:.1f}, "
+            f"p99 {quantiles[98] * 1000:.1f}, max {max(latencies) * 1000:.1f}"
+        )
+
+    def login(self, username):
+        try:
+            user = User.objects.get(username=username)
+        except User.DoesNotExist:
+            raise CommandError(f"Пользователь {username} не найден")
+
+        session = import_module(settings.SESSION_ENGINE).SessionStore()
+        session[SESSION_KEY] = user._meta.pk.value_to_string(user)
+        session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.save()
+        return {settings.SESSION_COOKIE_NAME: session.session_key}
@@ -0,0 +1,59 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from django.utils.timezone import localtime
+
+from traffic.partitions import (
+    PARTITION_INTERVALS, get_partitioning_settings, is_partitioned, ensure_partitions, expire_partitions,
+    default_partition_rows,
+)
+
+
+class Command(BaseCommand):
+    help = "Создаёт будущие секции TrafficStat и удаляет (или отключает) секции старше срока хранения"
+
+    def add_arguments(self, parser):
+        partitioning = get_partitioning_settings()
+        parser.add_argument('--interval', choices=PARTITION_INTERVALS, default=partitioning['INTERVAL'],
+                            help="Размер секции: день или месяц")
+        parser.add_argument('--premake', type=int, default=partitioning['PREMAKE'],
+                            help="Сколько интервалов вперёд создавать заранее")
+        parser.add_argument('--retention-days', type=int, default=partitioning['RETENTION_DAYS'],
+                            help="Срок хранения сырых хитов в днях. Без значения секции не удаляются")
+        parser.add_argument('--detach-only', action='store_true',
+                            help="Только отключать устаревшие секции, не удаляя их (например, для архивации)")
+        parser.add_argument('--loop', action='store_true',
+                            help="Работать в фоне, повторяя обслуживание каждые --interval-seconds секунд")
+        parser.add_argument('--interval-seconds', type=int, default=6 * 3600)
+
+    def handle(self, *args, **options):
+        if not is_partitioned():
+            raise CommandError("Таблица TrafficStat не секционирована, примените миграции traffic")
+
+        while True:
+            self.maintain(options)
+
+            if not options['loop']:
+                break
+
+            close_old_connections()
+            time.sleep(options['interval_seconds'])
+
+    def maintain(self, options):
+        for name, start, end, moved in ensure_partitions(options['interval'], options['premake']):
+            message = f"Создана секция {name} [{localtime(start):%Y-%m-%d %H:%M}, {localtime(end):%Y-%m-%d %H:%M})"
+            if moved:
+                message += f", перенесено из DEFAULT: {moved}"
+            self.stdout.write(message)
+
+        if options['retention_days'] is not None:
+            for name, start, end in expire_partitions(options['retention_days'], drop=not options['detach_only']):
+                action = "отключена" if options['detach_only'] else "удалена"
+                self.stdout.write(f"Секция {name} {action}")
+
+        rows = default_partition_rows()
+        if rows:
+            self.stdout.write(self.style.WARNING(
+                f"В DEFAULT-секции {rows} строк: увеличьте --premake или запускайте команду чаще"
+            ))
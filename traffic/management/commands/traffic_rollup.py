@@ -0,0 +1,54 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from traffic.activity import rebuild_user_activity, update_user_activity
+from traffic.breakdown import rebuild_top_keys, update_top_keys
+from traffic.rollups import update_hourly_rollups, rebuild_hourly_rollups, ROLLUP_SETTLE_SECONDS
+from traffic.sessions import rebuild_session_summaries, update_session_summaries
+
+
+class Command(BaseCommand):
+    help = (
+        "Инкрементально обновляет почасовые агрегаты трафика (TrafficHourlyRollup), суточные сводки частых значений "
+        "(TrafficTopKey) и сессий (TrafficSessionSummary) и сводку активности пользователей"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100000,
+                            help="Количество id TrafficStat, обрабатываемых в одной транзакции")
+        parser.add_argument('--settle-seconds', type=int, default=ROLLUP_SETTLE_SECONDS,
+                            help="Не агрегировать строки моложе указанного числа секунд")
+        parser.add_argument('--rebuild', action='store_true',
+                            help="Удалить агрегаты, сводки частых значений, сессий и активности пользователей "
+                                 "и пересчитать их с нуля")
+        parser.add_argument('--loop', action='store_true',
+                            help="Работать в фоне, повторяя обновление каждые --interval секунд")
+        parser.add_argument('--interval', type=int, default=60)
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            processed = rebuild_hourly_rollups(options['batch_size'], options['settle_seconds'])
+            self.stdout.write(self.style.SUCCESS(f"Агрегаты пересчитаны, обработано строк: {processed}"))
+            rebuild_top_keys(options['batch_size'], options['settle_seconds'])
+            self.stdout.write(self.style.SUCCESS("Сводки частых значений пересчитаны"))
+            days = rebuild_session_summaries(options['settle_seconds'])
+            self.stdout.write(self.style.SUCCESS(f"Сводки сессий пересчитаны, суток: {days}"))
+            users = rebuild_user_activity(options['settle_seconds'])
+            self.stdout.write(self.style.SUCCESS(f"Сводка активности пересчитана, пользователей: {users}"))
+            if not options['loop']:
+                return
+
+        while True:
+            processed = update_hourly_rollups(options['batch_size'], options['settle_seconds'])
+            update_top_keys(options['batch_size'], options['settle_seconds'])
+            update_session_summaries(options['settle_seconds'])
+            users = update_user_activity(options['batch_size'], options['settle_seconds'])
+            self.stdout.write(f"Обработано строк: {processed}, обновлено пользователей: {users}")
+
+            if not options['loop']:
+                break
+
+            close_old_connections()
+            time.sleep(options['interval'])
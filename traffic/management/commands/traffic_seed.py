@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from traffic.benchmark import seed
+
+
+class Command(BaseCommand):
+    help = (
+        "Генерирует синтетические TrafficStat и Visitor для нагрузочных замеров (traffic_benchmark). "
+        "Только для локальной или тестовой БД!"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hits', type=int, default=1000000, help="Число хитов")
+        parser.add_argument('--users', type=int, default=1000, help="Число пользователей bench_user_N")
+        parser.add_argument('--days', type=int, default=90, help="Глубина истории в днях")
+        parser.add_argument('--registered-share', type=float, default=0.3,
+                            help="Доля сессий зарегистрированных пользователей")
+        parser.add_argument('--session-length', type=int, default=8, help="Хитов в сессии")
+        parser.add_argument('--chunk-size', type=int, default=500000, help="Хитов в одной транзакции")
+        parser.add_argument('--salt', default='bench',
+                            help="Затравка генератора: тот же salt даёт те же сессии, другой - новые")
+        parser.add_argument('--no-rollups', action='store_true', help="Не обновлять почасовые агрегаты")
+
+    def handle(self, *args, **options):
+        if options['hits'] <= 0 or options['session_length'] <= 0 or options['days'] <= 0:
+            raise CommandError("--hits, --days и --session-length должны быть положительными")
+        if not 0 <= options['registered_share'] <= 1:
+            raise CommandError("--registered-share должен быть в интервале [0, 1]")
+
+        hits, visitors = seed(
+            options['hits'],
+            users=options['users'],
+            days=options['days'],
+            registered_share=options['registered_share'],
+            session_length=options['session_length'],
+            chunk_size=options['chunk_size'],
+            salt=options['salt'],
+            rollups=not options['no_rollups'],
+            progress=lambda done: self.stdout.write(f"Вставлено хитов: {done}"),
+        )
+        self.stdout.write(self.style.SUCCESS(f"Готово: хитов {hits}, посетителей {visitors}"))
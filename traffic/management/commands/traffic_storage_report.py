@@ -0,0 +1,95 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from traffic.models import TrafficStat, UrlPath, UserAgent
+
+# Размеры секционированной таблицы складываются из её секций, обычная таблица учитывается сама по себе
+SIZES_SQL = """
+SELECT COALESCE(SUM(GREATEST(class.reltuples, 0)), 0)::bigint,
+       COALESCE(SUM(pg_table_size(class.oid)), 0)::bigint,
+       COALESCE(SUM(pg_indexes_size(class.oid)), 0)::bigint
+FROM pg_class AS class
+WHERE class.oid IN (SELECT relid FROM pg_partition_tree(%(table)s::regclass) WHERE isleaf)
+   OR (class.oid = %(table)s::regclass AND class.relkind = 'r')
+"""
+
+
+def format_size(size):
+    for unit in ('Б', 'КБ', 'МБ', 'ГБ'):
+        if abs(size) < 1024 or unit == 'ГБ':
+            return f"{size:.0f} {unit}" if unit == 'Б' else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+class Command(BaseCommand):
+    help = (
+        "Размер таблиц и индексов журнала трафика и справочников. "
+        "Сохраните отчёт до миграции (--output) и сравните с ним после (--compare)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help="Сохранить отчёт в JSON-файл")
+        parser.add_argument('--compare', help="JSON-файл ранее сохранённого отчёта для сравнения")
+        parser.add_argument('--vacuum-full', action='store_true',
+                            help="Перед замером выполнить VACUUM FULL ANALYZE: после миграции место, занятое "
+                                 "удалёнными колонками и старыми версиями строк, освобождается только при "
+                                 "перезаписи таблицы. Берёт эксклюзивную блокировку!")
+
+    def handle(self, *args, **options):
+        tables = [model._meta.db_table for model in (TrafficStat, UserAgent, UrlPath)]
+
+        if options['vacuum_full']:
+            for table in tables:
+                if self.table_exists(table):
+                    with connection.cursor() as cursor:
+                        cursor.execute(f'VACUUM FULL ANALYZE "{table}"')
+
+        report = {table: self.measure(table) for table in tables if self.table_exists(table)}
+
+        previous = {}
+        if options['compare']:
+            try:
+                with open(options['compare'], encoding='utf-8') as report_file:
+                    previous = json.load(report_file)
+            except (OSError, ValueError) as exc:
+                raise CommandError(f"Не удалось прочитать отчёт {options['compare']}: {exc}")
+
+        for table, sizes in report.items():
+            self.stdout.write(self.style.MIGRATE_LABEL(table))
+            for key, title in (('rows', "строк (оценка)"), ('table', "таблица"), ('indexes', "индексы"),
+                               ('total', "всего"), ('bytes_per_row', "байт на строку")):
+                value = sizes[key]
+                line = f"  {title}: {value if key in ('rows', 'bytes_per_row') else format_size(value)}"
+                if table in previous:
+                    before = previous[table][key]
+                    line += f" (было {before if key in ('rows', 'bytes_per_row') else format_size(before)})"
+                self.stdout.write(line)
+
+        total = sum(sizes['total'] for sizes in report.values())
+        line = f"Итого: {format_size(total)}"
+        if previous:
+            before = sum(sizes['total'] for sizes in previous.values())
+            line += f" (было {format_size(before)}, разница {format_size(total - before)})"
+        self.stdout.write(self.style.SUCCESS(line))
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as report_file:
+                json.dump(report, report_file, indent=2)
+
+    def table_exists(self, table):
+        return table in connection.introspection.table_names()
+
+    def measure(self, table):
+        with connection.cursor() as cursor:
+            cursor.execute(SIZES_SQL, {'table': table})
+            rows, table_size, indexes_size = cursor.fetchone()
+        total = table_size + indexes_size
+        return {
+            'rows': rows,
+            'table': table_size,
+            'indexes': indexes_size,
+            'total': total,
+            'bytes_per_row': round(total / rows) if rows else 0,
+        }
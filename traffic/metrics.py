@@ -0,0 +1,288 @@
+import atexit
+import json
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_METRICS_SETTINGS = {
+    'ENABLED': True,
+    # Заголовок Server-Timing в ответах представлений traffic
+    'SERVER_TIMING': True,
+    # Хранилище гистограмм, общее для процессов сервера: в памяти процесса или в Redis
+    'BACKEND': 'traffic.metrics.MemoryMetricsBackend',
+    'OPTIONS': {},
+    # Процесс копит наблюдения локально и передаёт их в хранилище не чаще раза в FLUSH_INTERVAL секунд
+    'FLUSH_INTERVAL': 15,
+    # Если задан, /metrics отвечает только на запросы с заголовком Authorization: Bearer <TOKEN>,
+    # иначе - только сотрудникам (is_staff), остальным 404
+    'TOKEN': None,
+}
+
+TIME_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 200)
+
+# Имя гистограммы: (описание, границы корзин, имя метки)
+HISTOGRAMS = {
+    'traffic_request_duration_seconds': ("Время обработки запроса к представлению traffic", TIME_BUCKETS, 'view'),
+    'traffic_request_db_queries': ("Число SQL-запросов на запрос", COUNT_BUCKETS, 'view'),
+    'traffic_request_db_seconds': ("Суммарное время SQL-запросов на запрос", TIME_BUCKETS, 'view'),
+    'traffic_request_slowest_query_seconds': ("Время самого долгого SQL-запроса", TIME_BUCKETS, 'view'),
+    'traffic_request_render_seconds': ("Время сериализации ответа в JSON или HTML", TIME_BUCKETS, 'view'),
+    'traffic_track_seconds': ("Время записи хита middleware", TIME_BUCKETS, 'write_path'),
+}
+
+
+def get_metrics_settings():
+    return {**DEFAULT_METRICS_SETTINGS, **getattr(settings, 'TRAFFIC_METRICS', {})}
+
+
+class RequestMetrics:
+    """Замеры одного запроса: SQL-запросы, сериализация ответа и запись хита."""
+
+    __slots__ = ('queries', 'db_time', 'slowest_query', 'render_time', 'render_started', 'track_time')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.slowest_query = 0.0
+        self.render_time = 0.0
+        self.render_started = None
+        self.track_time = None
+
+    def rendered(self, response):
+        """Post-render callback ответа: завершает замер сериализации."""
+        self.render_time = time.perf_counter() - self.render_started
+
+
+# Контекстная, а не потоковая переменная: асинхронные представления выполняют ORM в потоке sync_to_async,
+# куда asgiref копирует контекст запроса
+_request_metrics = ContextVar('traffic_request_metrics', default=None)
+
+
+def current_request_metrics():
+    return _request_metrics.get()
+
+
+def start_request_metrics():
+    """Начинает замеры запроса. Возвращает (замеры, токен для finish_request_metrics)."""
+    request_metrics = RequestMetrics()
+    return request_metrics, _request_metrics.set(request_metrics)
+
+
+def finish_request_metrics(token):
+    _request_metrics.reset(token)
+
+
+def query_timer(execute, sql, params, many, context):
+    """Обёртка выполнения SQL (connection.execute_wrapper): вне замеряемого запроса - только чтение ContextVar."""
+    request_metrics = _request_metrics.get()
+    if request_metrics is None:
+        return execute(sql, params, many, context)
+
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        request_metrics.queries += 1
+        request_metrics.db_time += elapsed
+        request_metrics.slowest_query = max(request_metrics.slowest_query, elapsed)
+
+
+def install_query_timer(connection, **kwargs):
+    """Подключается к сигналу connection_created: обёртка ставится на каждое новое соединение."""
+    if query_timer not in connection.execute_wrappers:
+        connection.execute_wrappers.append(query_timer)
+
+
+def server_timing(request_metrics, total):
+    """Значение заголовка Server-Timing, длительности в миллисекундах."""
+    entries = [
+        f'db;dur={request_metrics.db_time * 1000:.2f};desc="{request_metrics.queries} queries"',
+        f'db-slowest;dur={request_metrics.slowest_query * 1000:.2f}',
+    ]
+    if request_metrics.render_started is not None:
+        entries.append(f'render;dur={request_metrics.render_time * 1000:.2f}')
+    if request_metrics.track_time is not None:
+        entries.append(f'track;dur={request_metrics.track_time * 1000:.2f}')
+    entries.append(f'total;dur={total * 1000:.2f}')
+    return ', '.join(entries)
+
+
+class BaseMetricsBackend:
+    """
+    Хранилище гистограмм. Ряд - (имя гистограммы, значение метки), его значение - список счётчиков
+    по корзинам (не накопительных, последняя - +Inf) и сумма наблюдений последним элементом.
+    """
+
+    def add(self, series):
+        raise NotImplementedError
+
+    def series(self):
+        raise NotImplementedError
+
+
+class MemoryMetricsBackend(BaseMetricsBackend):
+    """Гистограммы в памяти процесса. Под gunicorn с несколькими воркерами каждый отдаёт только свои наблюдения."""
+
+    def __init__(self, **options):
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def add(self, series):
+        with self._lock:
+            for key, values in series.items():
+                current = self._series.setdefault(key, [0] * len(values))
+                for i, value in enumerate(values):
+                    current[i] += value
+
+    def series(self):
+        with self._lock:
+            return {key: list(values) for key, values in self._series.items()}
+
+
+class RedisMetricsBackend(BaseMetricsBackend):
+    """Один хеш Redis на все процессы: приращения передаются одним конвейером HINCRBY/HINCRBYFLOAT."""
+
+    def __init__(self, URL='redis://localhost:6379/0', KEY='traffic:metrics', **options):
+        if redis is None:
+            raise ImproperlyConfigured("Для RedisMetricsBackend необходимо установить пакет redis")
+        timeout = options.get('SOCKET_TIMEOUT', 0.5)
+        self.client = redis.Redis.from_url(URL, socket_timeout=timeout, socket_connect_timeout=timeout)
+        self.key = KEY
+
+    def add(self, series):
+        pipeline = self.client.pipeline(transaction=False)
+        for (name, label), values in series.items():
+            for i, value in enumerate(values[:-1]):
+                if value:
+                    pipeline.hincrby(self.key, json.dumps([name, label, i]), value)
+            pipeline.hincrbyfloat(self.key, json.dumps([name, label, 'sum']), values[-1])
+        pipeline.execute()
+
+    def series(self):
+        series = {}
+        for field, value in self.client.hgetall(self.key).items():
+            name, label, index = json.loads(field)
+            if name not in HISTOGRAMS:
+                continue
+            values = series.setdefault((name, label), [0] * (len(HISTOGRAMS[name][1]) + 2))
+            if index == 'sum':
+                values[-1] = float(value)
+            else:
+                values[index] = int(value)
+        return series
+
+
+class MetricsRegistry:
+    """
+    Гистограммы HISTOGRAMS: наблюдения копятся в памяти процесса (bisect и сложение под блокировкой)
+    и передаются в хранилище при flush() - не чаще раза в flush_interval секунд и перед выдачей /metrics.
+    """
+
+    def __init__(self, backend, flush_interval=15):
+        self.backend = backend
+        self.flush_interval = flush_interval
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+
+    def observe(self, name, label, value):
+        buckets = HISTOGRAMS[name][1]
+        with self._lock:
+            values = self._pending.get((name, label))
+            if values is None:
+                values = self._pending[name, label] = [0] * (len(buckets) + 2)
+            values[bisect_left(buckets, value)] += 1
+            values[-1] += value
+            flush = time.monotonic() - self._last_flush >= self.flush_interval
+        if flush:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.monotonic()
+        if not pending:
+            return
+        try:
+            self.backend.add(pending)
+        except Exception:
+            logger.exception("Не удалось передать метрики в хранилище, накопленные наблюдения потеряны")
+
+    def observe_request(self, view, request_metrics, total):
+        self.observe('traffic_request_duration_seconds', view, total)
+        self.observe('traffic_request_db_queries', view, request_metrics.queries)
+        self.observe('traffic_request_db_seconds', view, request_metrics.db_time)
+        self.observe('traffic_request_slowest_query_seconds', view, request_metrics.slowest_query)
+        if request_metrics.render_started is not None:
+            self.observe('traffic_request_render_seconds', view, request_metrics.render_time)
+
+    def exposition(self):
+        """Все гистограммы в текстовом формате Prometheus (version 0.0.4)."""
+        self.flush()
+        series = self.backend.series()
+        lines = []
+        for name, (documentation, buckets, label_name) in HISTOGRAMS.items():
+            lines += [f'# HELP {name} {documentation}', f'# TYPE {name} histogram']
+            for (series_name, label), values in sorted(series.items()):
+                if series_name != name:
+                    continue
+                label = f'{label_name}="{escape_label(label)}"'
+                cumulative = 0
+                for bound, count in zip((*buckets, '+Inf'), values[:-1]):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{label},le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_sum{{{label}}} {values[-1]}')
+                lines.append(f'{name}_count{{{label}}} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+
+def escape_label(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_metrics_registry():
+    """Реестр метрик процесса или None, если TRAFFIC_METRICS['ENABLED'] выключен."""
+    global _registry
+
+    metrics_settings = get_metrics_settings()
+    if not metrics_settings['ENABLED']:
+        return None
+
+    with _registry_lock:
+        if _registry is None:
+            backend_class = import_string(metrics_settings['BACKEND'])
+            _registry = MetricsRegistry(
+                backend_class(**metrics_settings['OPTIONS']), flush_interval=metrics_settings['FLUSH_INTERVAL']
+            )
+            atexit.register(_registry.flush)
+
+    return _registry
+
+
+@receiver(setting_changed)
+def reset_metrics_registry(setting, **kwargs):
+    global _registry
+
+    if setting == 'TRAFFIC_METRICS':
+        _registry = None
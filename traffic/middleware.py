@@ -1,35 +1,221 @@
+import logging
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.utils import timezone
+from .buffer import get_buffer, OVERFLOW_BLOCK
+from .dictionaries import aresolve_hit, resolve_hit
+from .metrics import (
+    current_request_metrics, finish_request_metrics, get_metrics_registry, get_metrics_settings, server_timing,
+    start_request_metrics,
+)
+from .presence import get_presence_tracker
+from .rules import get_tracking_rules
+from .spool import get_spool
+from .visitors import MODE_SESSION, get_visitor_id_settings, identify_visitor
 from .models import TrafficStat
 from django.contrib.auth.models import AnonymousUser
 
+logger = logging.getLogger(__name__)
+
 
 class TrafficTrackingMiddleware:
+    """
+    Записывает хит на каждый запрос, прошедший правила учёта и выборки (traffic/rules.py).
+    Работает и под WSGI, и под ASGI: в асинхронной цепочке сессия и пользователь читаются асинхронным API,
+    запрос не переключается в поток.
+    """
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        self.spool = get_spool()
+        self.buffer = get_buffer()
+        self.write_path = 'spool' if self.spool is not None else 'buffer' if self.buffer is not None else 'direct'
+        # Правила компилируются при загрузке middleware, ошибка в TRAFFIC_TRACKING видна сразу при старте
+        get_tracking_rules()
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def build_hit(self, request, session_id, user, weight=1):
+        user = user if not isinstance(user, AnonymousUser) else None
+        return {
+            'ip_address': request.META.get('REMOTE_ADDR'),
+            'user_id': user.pk if user else None,
+            'user_agent': request.META.get('HTTP_USER_AGENT', ''),
+            'url': request.path,
+            'session_id': session_id,
+            'created_at': timezone.now(),
+            'weight': weight,
+        }
+
+    def spooled(self, hit):
+        """Дописывает хит в локальный спул. Справочники и БД не затрагиваются: строки переводит в id traffic_ingest."""
+        if self.spool is None:
+            return False
+        try:
+            self.spool.append(hit)
+            return True
+        except OSError:
+            logger.exception("Не удалось записать хит в спул, хит записывается в БД")
+            return False
+
+    def observe_write(self, started):
+        elapsed = time.perf_counter() - started
+        request_metrics = current_request_metrics()
+        if request_metrics is not None:
+            request_metrics.track_time = elapsed
+        registry = get_metrics_registry()
+        if registry is not None:
+            registry.observe('traffic_track_seconds', self.write_path, elapsed)
+
+    def record(self, hit):
+        if self.spooled(hit):
+            return
+
+        hit = resolve_hit(hit)
+        if self.buffer is not None:
+            self.buffer.add(hit)
+        else:
+            TrafficStat.objects.create(**hit)
+
+    async def arecord(self, hit):
+        if self.spooled(hit):
+            return
+
+        hit = await aresolve_hit(hit)
+        # Буфер без политики block не ждёт: хит кладётся в очередь прямо из цикла событий
+        if self.buffer is not None and self.buffer.overflow != OVERFLOW_BLOCK:
+            self.buffer.add(hit)
+        elif self.buffer is not None:
+            await sync_to_async(self.buffer.add, thread_sensitive=False)(hit)
+        else:
+            await TrafficStat.objects.acreate(**hit)
+
+    def touch_presence(self, hit):
+        presence = get_presence_tracker()
+        if presence is not None:
+            try:
+                presence.touch(hit['user_id'], hit['session_id'], hit['created_at'])
+            except Exception:
+                # Цепь трекера разомкнута: до RETRY_INTERVAL следующие запросы не ждут хранилище
+                logger.exception("Не удалось обновить присутствие пользователя")
 
     def __call__(self, request):
-        if request.path.startswith('/static/') or \
-                request.path.startswith('/admin/jsi18n/') or \
-                request.path.startswith('/admin/js/') or \
-                request.path.startswith('/admin/img/') or \
-                request.path.startswith('/admin/css/') or \
-                request.path == '/favicon.ico':
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
 
+        rules = get_tracking_rules()
+        if not rules.is_tracked(request.path):
             return self.get_response(request)
 
-        if not request.session.session_key:
+        visitor_id_settings = get_visitor_id_settings()
+        if visitor_id_settings['MODE'] == MODE_SESSION and not request.session.session_key:
             request.session.create()
 
-        session_id = request.session.session_key
         response = self.get_response(request)
+        session_id = identify_visitor(request, response, visitor_id_settings)
 
-        user = request.user if not isinstance(request.user, AnonymousUser) else None
+        # Присутствие отмечается и для запросов, не попавших в выборку
+        weight = rules.weight(request.path, request.META.get('HTTP_USER_AGENT'))
+        hit = self.build_hit(request, session_id, getattr(request, 'user', None), weight)
+        if weight:
+            started = time.perf_counter()
+            self.record(hit)
+            self.observe_write(started)
 
-        TrafficStat.objects.create(
-            ip_address=request.META.get('REMOTE_ADDR'),
-            user=user,
-            user_agent=request.META.get('HTTP_USER_AGENT', ''),
-            url=request.path,
-            session_id=session_id,
-        )
+        self.touch_presence(hit)
 
         return response
+
+    async def __acall__(self, request):
+        rules = get_tracking_rules()
+        if not rules.is_tracked(request.path):
+            return await self.get_response(request)
+
+        visitor_id_settings = get_visitor_id_settings()
+        if visitor_id_settings['MODE'] == MODE_SESSION and not request.session.session_key:
+            await request.session.acreate()
+
+        response = await self.get_response(request)
+        session_id = identify_visitor(request, response, visitor_id_settings)
+
+        auser = getattr(request, 'auser', None)
+        weight = rules.weight(request.path, request.META.get('HTTP_USER_AGENT'))
+        hit = self.build_hit(request, session_id, await auser() if auser else None, weight)
+        if weight:
+            started = time.perf_counter()
+            await self.arecord(hit)
+            self.observe_write(started)
+
+        if get_presence_tracker() is not None:
+            await sync_to_async(self.touch_presence, thread_sensitive=False)(hit)
+
+        return response
+
+
+class TrafficMetricsMiddleware:
+    """
+    Замеры запросов к представлениям traffic: число и время SQL-запросов, самый долгий запрос, сериализация ответа
+    и запись хита TrafficTrackingMiddleware. Результат - заголовок Server-Timing и гистограммы /metrics.
+    Ставится в MIDDLEWARE перед TrafficTrackingMiddleware, чтобы учитывать и запись хита.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        registry = get_metrics_registry()
+        if registry is None:
+            return self.get_response(request)
+
+        request_metrics, token = start_request_metrics()
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            finish_request_metrics(token)
+        self.finish(registry, request, response, request_metrics, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        registry = get_metrics_registry()
+        if registry is None:
+            return await self.get_response(request)
+
+        request_metrics, token = start_request_metrics()
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            finish_request_metrics(token)
+        self.finish(registry, request, response, request_metrics, time.perf_counter() - started)
+        return response
+
+    def process_template_response(self, request, response):
+        # Вызывается непосредственно перед render(): DRF Response и TemplateResponse сериализуются здесь
+        request_metrics = current_request_metrics()
+        if request_metrics is not None:
+            request_metrics.render_started = time.perf_counter()
+            response.add_post_render_callback(request_metrics.rendered)
+        return response
+
+    def finish(self, registry, request, response, request_metrics, total):
+        # Метка - имя маршрута представления traffic: число рядов ограничено числом маршрутов
+        match = getattr(request, 'resolver_match', None)
+        if match is None:
+            return
+        view = getattr(match.func, 'view_class', match.func)
+        if not view.__module__.startswith('traffic.'):
+            return
+
+        registry.observe_request(match.view_name, request_metrics, total)
+        if get_metrics_settings()['SERVER_TIMING']:
+            response.headers['Server-Timing'] = server_timing(request_metrics, total)
@@ -0,0 +1,42 @@
+# Generated by Django 5.1.6 on 2026-10-18 00:28
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('traffic', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrafficHourlyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField(unique=True)),
+                ('hits', models.PositiveBigIntegerField(default=0)),
+                ('registered_users', django.contrib.postgres.fields.ArrayField(base_field=models.BigIntegerField(), blank=True, default=list, size=None)),
+                ('guest_ips', django.contrib.postgres.fields.ArrayField(base_field=models.GenericIPAddressField(), blank=True, default=list, size=None)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Почасовой агрегат трафика',
+                'verbose_name_plural': 'Почасовые агрегаты трафика',
+            },
+        ),
+        migrations.CreateModel(
+            name='TrafficRollupState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=64, unique=True)),
+                ('last_traffic_stat_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Состояние агрегации трафика',
+                'verbose_name_plural': 'Состояния агрегации трафика',
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.1.6 on 2026-10-18 00:28
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import AddIndexConcurrently, TrigramExtension
+import django.db.models.functions.text
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Индексы строятся CONCURRENTLY, чтобы не блокировать запись в большую таблицу
+    atomic = False
+
+    dependencies = [
+        ('traffic', '0002_hourly_rollups'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        AddIndexConcurrently(
+            model_name='trafficstat',
+            index=django.contrib.postgres.indexes.BrinIndex(fields=['created_at'], name='traffic_stat_created_brin'),
+        ),
+        AddIndexConcurrently(
+            model_name='trafficstat',
+            index=models.Index(fields=['session_id', 'created_at'], name='traffic_stat_session_created'),
+        ),
+        AddIndexConcurrently(
+            model_name='trafficstat',
+            index=models.Index(fields=['user', 'created_at'], name='traffic_stat_user_created'),
+        ),
+        AddIndexConcurrently(
+            model_name='trafficstat',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('url'), name='gin_trgm_ops'), name='traffic_stat_url_trgm'),
+        ),
+    ]
@@ -0,0 +1,101 @@
+from django.conf import settings
+from django.db import migrations
+
+# Превращает traffic_trafficstat в таблицу, секционированную по диапазонам created_at.
+# Существующая таблица без копирования данных подключается секцией traffic_trafficstat_legacy
+# на диапазон (MINVALUE, начало следующего месяца), дальнейшие секции создаёт manage.py traffic_partitions.
+# Строки вне созданных секций попадают в traffic_trafficstat_default и переносятся командой при создании секции.
+# Таблица пользователей берётся из AUTH_USER_MODEL, имя внешнего ключа - из ограничения исходной таблицы.
+PARTITION_TRAFFIC_STAT_SQL = """
+DO $$
+DECLARE
+    boundary timestamptz;
+    max_id bigint;
+    user_fk name;
+    idx record;
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = 'traffic_trafficstat'::regclass) = 'p' THEN
+        RETURN;
+    END IF;
+
+    SELECT date_trunc('month', GREATEST(MAX(created_at), NOW())) + INTERVAL '1 month', COALESCE(MAX(id), 0)
+    INTO boundary, max_id
+    FROM traffic_trafficstat;
+
+    ALTER TABLE traffic_trafficstat RENAME TO traffic_trafficstat_legacy;
+    FOR idx IN SELECT indexname FROM pg_indexes WHERE tablename = 'traffic_trafficstat_legacy' LOOP
+        EXECUTE format('ALTER INDEX %I RENAME TO %I', idx.indexname, left(idx.indexname, 55) || '_old');
+    END LOOP;
+
+    SELECT conname INTO user_fk
+    FROM pg_constraint
+    WHERE conrelid = 'traffic_trafficstat_legacy'::regclass AND contype = 'f'
+      AND conkey = ARRAY[(
+          SELECT attnum FROM pg_attribute
+          WHERE attrelid = 'traffic_trafficstat_legacy'::regclass AND attname = 'user_id'
+      )];
+
+    -- Первичный ключ секционированной таблицы обязан включать ключ секционирования: (id, created_at)
+    EXECUTE (
+        SELECT format('ALTER TABLE traffic_trafficstat_legacy DROP CONSTRAINT %I', conname)
+        FROM pg_constraint
+        WHERE conrelid = 'traffic_trafficstat_legacy'::regclass AND contype = 'p'
+    );
+
+    -- Секционированная таблица в PostgreSQL 15 не поддерживает identity, id берётся из обычной последовательности
+    ALTER TABLE traffic_trafficstat_legacy ALTER COLUMN id DROP IDENTITY;
+
+    CREATE TABLE traffic_trafficstat (LIKE traffic_trafficstat_legacy INCLUDING DEFAULTS)
+        PARTITION BY RANGE (created_at);
+
+    CREATE SEQUENCE traffic_trafficstat_id_seq OWNED BY traffic_trafficstat.id;
+    PERFORM setval('traffic_trafficstat_id_seq', max_id + 1, false);
+    ALTER TABLE traffic_trafficstat ALTER COLUMN id SET DEFAULT nextval('traffic_trafficstat_id_seq');
+
+    ALTER TABLE traffic_trafficstat ADD CONSTRAINT traffic_trafficstat_pkey PRIMARY KEY (id, created_at);
+    EXECUTE format(
+        'ALTER TABLE traffic_trafficstat ADD CONSTRAINT %I '
+        'FOREIGN KEY (user_id) REFERENCES {user_table} ({user_pk}) DEFERRABLE INITIALLY DEFERRED',
+        COALESCE(user_fk, 'traffic_trafficstat_user_id_fk')
+    );
+    CREATE INDEX traffic_trafficstat_user_id_182723b3 ON traffic_trafficstat (user_id);
+    CREATE INDEX traffic_stat_created_brin ON traffic_trafficstat USING brin (created_at);
+    CREATE INDEX traffic_stat_session_created ON traffic_trafficstat (session_id, created_at);
+    CREATE INDEX traffic_stat_user_created ON traffic_trafficstat (user_id, created_at);
+    CREATE INDEX traffic_stat_url_trgm ON traffic_trafficstat USING gin (UPPER(url::text) gin_trgm_ops);
+
+    -- Проверочное ограничение позволяет подключить секцию без повторного сканирования под эксклюзивной блокировкой
+    EXECUTE format(
+        'ALTER TABLE traffic_trafficstat_legacy ADD CONSTRAINT traffic_trafficstat_legacy_bound CHECK (created_at < %L)',
+        boundary
+    );
+    EXECUTE format(
+        'ALTER TABLE traffic_trafficstat ATTACH PARTITION traffic_trafficstat_legacy FOR VALUES FROM (MINVALUE) TO (%L)',
+        boundary
+    );
+    ALTER TABLE traffic_trafficstat_legacy DROP CONSTRAINT traffic_trafficstat_legacy_bound;
+
+    CREATE TABLE traffic_trafficstat_default PARTITION OF traffic_trafficstat DEFAULT;
+END
+$$;
+"""
+
+
+def partition_traffic_stat(apps, schema_editor):
+    user_model = apps.get_model(settings.AUTH_USER_MODEL)
+    schema_editor.execute(PARTITION_TRAFFIC_STAT_SQL.format(
+        user_table=schema_editor.quote_name(user_model._meta.db_table),
+        user_pk=schema_editor.quote_name(user_model._meta.pk.column),
+    ), params=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('traffic', '0003_traffic_stat_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_traffic_stat),
+    ]
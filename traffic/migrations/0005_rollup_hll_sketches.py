@@ -0,0 +1,23 @@
+# Generated by Django 5.1.6 on 2026-10-18 00:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('traffic', '0004_partition_traffic_stat'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='traffichourlyrollup',
+            name='guests_hll',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='traffichourlyrollup',
+            name='registered_users_hll',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,64 @@
+import django.contrib.postgres.indexes
+import django.db.models.deletion
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('traffic', '0005_rollup_hll_sketches'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserAgent',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('value', models.CharField(max_length=255, unique=True)),
+            ],
+            options={
+                'verbose_name': 'User-Agent',
+                'verbose_name_plural': 'User-Agent',
+            },
+        ),
+        migrations.CreateModel(
+            name='UrlPath',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('value', models.CharField(max_length=255, unique=True)),
+            ],
+            options={
+                'verbose_name': 'Путь запроса',
+                'verbose_name_plural': 'Пути запросов',
+                'indexes': [django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('value'), name='gin_trgm_ops'), name='traffic_urlpath_value_trgm')],
+            },
+        ),
+        # Поиск по подстроке URL теперь идёт по справочнику
+        migrations.RemoveIndex(
+            model_name='trafficstat',
+            name='traffic_stat_url_trgm',
+        ),
+        migrations.RenameField(
+            model_name='trafficstat',
+            old_name='user_agent',
+            new_name='user_agent_text',
+        ),
+        migrations.RenameField(
+            model_name='trafficstat',
+            old_name='url',
+            new_name='url_text',
+        ),
+        migrations.AddField(
+            model_name='trafficstat',
+            name='user_agent',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='traffic.useragent'),
+        ),
+        migrations.AddField(
+            model_name='trafficstat',
+            name='url',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='traffic.urlpath'),
+        ),
+        # Ссылки существующих строк заполняются порциями в 0015, старые столбцы удаляются в 0016:
+        # здесь только добавляются пустые столбцы, и блокировка журнала держится недолго
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-18 00:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('traffic', '0006_normalize_user_agent_url'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trafficstat',
+            name='weight',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.6 on 2026-10-18 00:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('traffic', '0007_traffic_stat_weight'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrafficIngestBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('records', models.PositiveIntegerField(default=0)),
+                ('first_created_at', models.DateTimeField(blank=True, null=True)),
+                ('spooled_at', models.DateTimeField()),
+                ('ingested_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Загруженный сегмент спула',
+                'verbose_name_plural': 'Загруженные сегменты спула',
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.6 on 2026-10-18 01:09
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('traffic', '0008_traffic_ingest_batch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserActivitySummary',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='activity_summary', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('visit_count', models.PositiveIntegerField(default=0)),
+                ('total_time_on_site', models.PositiveBigIntegerField(default=0)),
+                ('avg_time_on_site', models.FloatField(default=0)),
+                ('last_visit_at', models.DateTimeField(blank=True, null=True)),
+                ('last_hit_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Активность пользователя',
+                'verbose_name_plural': 'Активность пользователей',
+                'indexes': [models.Index(fields=['visit_count', 'user'], name='traffic_activity_visits'), models.Index(fields=['avg_time_on_site', 'user'], name='traffic_activity_avg_time'), models.Index(fields=['last_visit_at', 'user'], name='traffic_activity_last_visit'), models.Index(fields=['last_hit_at', 'user'], name='traffic_activity_last_hit')],
+            },
+        ),
+    ]
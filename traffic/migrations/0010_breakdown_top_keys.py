@@ -0,0 +1,52 @@
+# Generated by Django 5.1.6 on 2026-10-18 01:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('traffic', '0009_user_activity_summary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrafficTopKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dimension', models.CharField(max_length=16)),
+                ('day', models.DateField()),
+                ('key', models.CharField(max_length=255)),
+                ('hits', models.PositiveBigIntegerField(default=0)),
+                ('error', models.PositiveBigIntegerField(default=0)),
+                ('visitors_hll', models.BinaryField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Частое значение измерения',
+                'verbose_name_plural': 'Частые значения измерений',
+            },
+        ),
+        migrations.AddField(
+            model_name='useragent',
+            name='browser',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='useragent',
+            name='device',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='useragent',
+            name='os',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='useragent',
+            index=models.Index(condition=models.Q(('browser__isnull', True)), fields=['id'], name='traffic_useragent_unparsed'),
+        ),
+        migrations.AddConstraint(
+            model_name='traffictopkey',
+            constraint=models.UniqueConstraint(fields=('dimension', 'day', 'key'), name='traffic_top_key_unique'),
+        ),
+    ]
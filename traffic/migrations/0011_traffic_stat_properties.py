@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-18 01:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('traffic', '0010_breakdown_top_keys'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trafficstat',
+            name='properties',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
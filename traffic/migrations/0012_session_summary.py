@@ -0,0 +1,31 @@
+# Generated by Django 5.1.6 on 2026-10-18 01:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('traffic', '0011_traffic_stat_properties'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrafficSessionSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('kind', models.CharField(max_length=8)),
+                ('key', models.CharField(blank=True, max_length=255)),
+                ('sessions', models.PositiveIntegerField(default=0)),
+                ('bounces', models.PositiveIntegerField(default=0)),
+                ('pageviews', models.PositiveBigIntegerField(default=0)),
+                ('duration', models.FloatField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Сводка сессий',
+                'verbose_name_plural': 'Сводки сессий',
+                'constraints': [models.UniqueConstraint(fields=('day', 'kind', 'key'), name='traffic_session_summary_unique')],
+            },
+        ),
+    ]
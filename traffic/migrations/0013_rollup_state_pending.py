@@ -0,0 +1,23 @@
+# Generated by Django 5.1.6 on 2026-10-18 01:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('traffic', '0012_session_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trafficrollupstate',
+            name='pending_traffic_stat_id',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='trafficrollupstate',
+            name='pending_xids',
+            field=models.TextField(blank=True, default=''),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.1.6 on 2026-10-18 01:48
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('traffic', '0013_rollup_state_pending'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    # Индекс секционированной таблицы нельзя построить CONCURRENTLY; новый создаётся до удаления старого,
+    # чтобы журнал запросов пользователя не остался без индекса
+    operations = [
+        migrations.AddIndex(
+            model_name='trafficstat',
+            index=models.Index(fields=['user', 'created_at', 'id'], name='traffic_stat_user_created_id'),
+        ),
+        migrations.RemoveIndex(
+            model_name='trafficstat',
+            name='traffic_stat_user_created',
+        ),
+    ]
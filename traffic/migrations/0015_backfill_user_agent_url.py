@@ -0,0 +1,80 @@
+from django.db import migrations, transaction
+
+# Строк журнала в одной транзакции заполнения: каждая порция блокирует только свои строки
+BACKFILL_BATCH_SIZE = 50000
+
+TEXT_COLUMNS_SQL = """
+SELECT COUNT(*) FROM information_schema.columns
+WHERE table_schema = current_schema() AND table_name = 'traffic_trafficstat'
+  AND column_name IN ('user_agent_text', 'url_text')
+"""
+
+# Справочники пополняются значениями порции, затем в её строках проставляются ссылки
+BACKFILL_SQL = """
+INSERT INTO traffic_useragent (value)
+SELECT DISTINCT user_agent_text FROM traffic_trafficstat
+WHERE id > %(low)s AND id <= %(high)s AND user_agent_text IS NOT NULL
+ON CONFLICT (value) DO NOTHING;
+
+INSERT INTO traffic_urlpath (value)
+SELECT DISTINCT url_text FROM traffic_trafficstat
+WHERE id > %(low)s AND id <= %(high)s AND url_text IS NOT NULL
+ON CONFLICT (value) DO NOTHING;
+
+UPDATE traffic_trafficstat AS stat
+SET user_agent_id = (SELECT id FROM traffic_useragent WHERE value = stat.user_agent_text),
+    url_id = (SELECT id FROM traffic_urlpath WHERE value = stat.url_text)
+WHERE stat.id > %(low)s AND stat.id <= %(high)s
+  AND (stat.user_agent_text IS NOT NULL OR stat.url_text IS NOT NULL);
+"""
+
+REVERSE_BACKFILL_SQL = """
+UPDATE traffic_trafficstat AS stat
+SET user_agent_text = (SELECT value FROM traffic_useragent WHERE id = stat.user_agent_id),
+    url_text = (SELECT value FROM traffic_urlpath WHERE id = stat.url_id)
+WHERE stat.id > %(low)s AND stat.id <= %(high)s
+  AND (stat.user_agent_id IS NOT NULL OR stat.url_id IS NOT NULL);
+"""
+
+
+def run_in_batches(schema_editor, sql):
+    """
+    Выполняет sql по диапазонам id журнала, каждый диапазон - в своей транзакции.
+    Установки, на которых 0006 уже заполнила ссылки и удалила строковые столбцы, пропускаются.
+    """
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        cursor.execute(TEXT_COLUMNS_SQL)
+        if cursor.fetchone()[0] < 2:
+            return
+        cursor.execute("SELECT COALESCE(MIN(id), 0), COALESCE(MAX(id), 0) FROM traffic_trafficstat")
+        low, last_id = cursor.fetchone()
+    low -= 1
+
+    while low < last_id:
+        high = low + BACKFILL_BATCH_SIZE
+        with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            cursor.execute(sql, {'low': low, 'high': high})
+        low = high
+
+
+def backfill(apps, schema_editor):
+    run_in_batches(schema_editor, BACKFILL_SQL)
+
+
+def reverse_backfill(apps, schema_editor):
+    run_in_batches(schema_editor, REVERSE_BACKFILL_SQL)
+
+
+class Migration(migrations.Migration):
+    # Заполнение ссылок на справочники в существующих строках журнала порциями по id, без одной транзакции
+    # на всю таблицу: запись хитов не ждёт перезаписи всех секций
+    atomic = False
+
+    dependencies = [
+        ('traffic', '0014_traffic_stat_user_created_id'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill, reverse_backfill),
+    ]
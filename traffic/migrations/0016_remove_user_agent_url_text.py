@@ -0,0 +1,35 @@
+from django.db import migrations
+
+# IF EXISTS: на установках, где 0006 ещё удаляла столбцы сама, их уже нет
+DROP_TEXT_COLUMNS_SQL = """
+ALTER TABLE traffic_trafficstat DROP COLUMN IF EXISTS user_agent_text, DROP COLUMN IF EXISTS url_text
+"""
+
+ADD_TEXT_COLUMNS_SQL = """
+ALTER TABLE traffic_trafficstat
+    ADD COLUMN IF NOT EXISTS user_agent_text varchar(255) NULL,
+    ADD COLUMN IF NOT EXISTS url_text varchar(255) NULL
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('traffic', '0015_backfill_user_agent_url'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[migrations.RunSQL(DROP_TEXT_COLUMNS_SQL, ADD_TEXT_COLUMNS_SQL)],
+            state_operations=[
+                migrations.RemoveField(
+                    model_name='trafficstat',
+                    name='user_agent_text',
+                ),
+                migrations.RemoveField(
+                    model_name='trafficstat',
+                    name='url_text',
+                ),
+            ],
+        ),
+    ]
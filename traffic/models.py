@@ -1,8 +1,51 @@
 from django.conf import settings
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import BrinIndex, GinIndex, OpClass
 from django.db import models
+from django.db.models.functions import Upper
 from django.utils import timezone
 
 
+class UserAgent(models.Model):
+    """
+    Справочник строк User-Agent, TrafficStat хранит только ссылку на запись.
+    Семейства браузера, ОС и устройства заполняются при вставке (traffic/useragents.py);
+    записи, вставленные в обход справочника, разбирает traffic_rollup.
+    """
+    id = models.AutoField(primary_key=True)
+    value = models.CharField(max_length=255, unique=True)
+    browser = models.CharField(max_length=64, null=True, blank=True)
+    os = models.CharField(max_length=64, null=True, blank=True)
+    device = models.CharField(max_length=64, null=True, blank=True)
+
+    def __str__(self):
+        return self.value
+
+    class Meta:
+        verbose_name = 'User-Agent'
+        verbose_name_plural = 'User-Agent'
+        indexes = [
+            models.Index(fields=['id'], condition=models.Q(browser__isnull=True), name='traffic_useragent_unparsed'),
+        ]
+
+
+class UrlPath(models.Model):
+    """Справочник путей запросов, TrafficStat хранит только ссылку на запись."""
+    id = models.AutoField(primary_key=True)
+    value = models.CharField(max_length=255, unique=True)
+
+    def __str__(self):
+        return self.value
+
+    class Meta:
+        verbose_name = 'Путь запроса'
+        verbose_name_plural = 'Пути запросов'
+        indexes = [
+            # url__value__icontains сравнивает UPPER(value), поэтому индекс строится по тому же выражению
+            GinIndex(OpClass(Upper('value'), name='gin_trgm_ops'), name='traffic_urlpath_value_trgm'),
+        ]
+
+
 class TrafficStat(models.Model):
     ip_address = models.GenericIPAddressField()
     user = models.ForeignKey(
@@ -12,11 +55,19 @@ class TrafficStat(models.Model):
         blank=True,
         related_name='traffic_stats'
     )
-    user_agent = models.CharField(max_length=255, blank=True, null=True)
+    # Строки User-Agent и пути повторяются от хита к хиту, поэтому вынесены в справочники
+    # По User-Agent журнал не фильтруется, индекс по ссылке не нужен
+    user_agent = models.ForeignKey(
+        UserAgent, on_delete=models.PROTECT, null=True, blank=True, related_name='+', db_index=False
+    )
     created_at = models.DateTimeField(default=timezone.now)
-    url = models.CharField(max_length=255, blank=True, null=True)
+    url = models.ForeignKey(UrlPath, on_delete=models.PROTECT, null=True, blank=True, related_name='+')
     event = models.CharField(max_length=255, blank=True, null=True)
+    # Свойства клиентского события (traffic/events.py), у хитов middleware - NULL
+    properties = models.JSONField(blank=True, null=True)
     session_id = models.CharField(max_length=255, blank=True, null=True)
+    # Выборочная запись (TRAFFIC_TRACKING['SAMPLING']): хит представляет weight запросов, счётчики суммируют веса
+    weight = models.PositiveIntegerField(default=1)
 
     def __str__(self):
         return f'Трафик с {self.id} в {self.created_at}'
@@ -24,3 +75,151 @@ class TrafficStat(models.Model):
     class Meta:
         verbose_name = 'Трафик сети'
         verbose_name_plural = 'Статистика трафика'
+        indexes = [
+            # Таблица только дополняется, created_at растёт вместе с физическим порядком строк
+            BrinIndex(fields=['created_at'], name='traffic_stat_created_brin'),
+            models.Index(fields=['session_id', 'created_at'], name='traffic_stat_session_created'),
+            # id в конце индекса отдаёт порядок журнала (-created_at, -id) без сортировки
+            models.Index(fields=['user', 'created_at', 'id'], name='traffic_stat_user_created_id'),
+        ]
+
+
+class TrafficHourlyRollup(models.Model):
+    """
+    Почасовой агрегат TrafficStat.
+    Хранит число хитов и множества уникальных пользователей и IP гостей за час,
+    поэтому уникальные значения за любой период получаются объединением множеств.
+    Рядом хранятся скетчи HyperLogLog тех же множеств (traffic/hll.py) для приблизительного подсчёта.
+    """
+    hour = models.DateTimeField(unique=True)
+    hits = models.PositiveBigIntegerField(default=0)
+    registered_users = ArrayField(models.BigIntegerField(), default=list, blank=True)
+    guest_ips = ArrayField(models.GenericIPAddressField(), default=list, blank=True)
+    registered_users_hll = models.BinaryField(null=True, blank=True)
+    guests_hll = models.BinaryField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'Агрегат трафика за {self.hour}'
+
+    class Meta:
+        verbose_name = 'Почасовой агрегат трафика'
+        verbose_name_plural = 'Почасовые агрегаты трафика'
+
+
+class TrafficRollupState(models.Model):
+    """Отметка последнего TrafficStat.id, учтённого в почасовых агрегатах."""
+    name = models.CharField(max_length=64, unique=True)
+    last_traffic_stat_id = models.BigIntegerField(default=0)
+    # Кандидат в отметку: значение последовательности id и транзакции, записывавшие в момент его чтения
+    pending_traffic_stat_id = models.BigIntegerField(default=0)
+    pending_xids = models.TextField(blank=True, default='')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.name}: {self.last_traffic_stat_id}'
+
+    class Meta:
+        verbose_name = 'Состояние агрегации трафика'
+        verbose_name_plural = 'Состояния агрегации трафика'
+
+
+class TrafficTopKey(models.Model):
+    """
+    Частые значения измерения TrafficStat (url, user_agent, ip, event, семейства User-Agent) за сутки UTC.
+    Сводка Space-Saving: на (измерение, день) хранится не больше TOP_KEYS_CAPACITY ключей, hits - оценка сверху,
+    hits - error - оценка снизу. Рядом - скетч HyperLogLog уникальных посетителей ключа (traffic/breakdown.py).
+    """
+    dimension = models.CharField(max_length=16)
+    day = models.DateField()
+    key = models.CharField(max_length=255)
+    hits = models.PositiveBigIntegerField(default=0)
+    error = models.PositiveBigIntegerField(default=0)
+    visitors_hll = models.BinaryField(null=True, blank=True)
+
+    def __str__(self):
+        return f'{self.dimension} {self.day}: {self.key}'
+
+    class Meta:
+        verbose_name = 'Частое значение измерения'
+        verbose_name_plural = 'Частые значения измерений'
+        constraints = [
+            models.UniqueConstraint(fields=['dimension', 'day', 'key'], name='traffic_top_key_unique'),
+        ]
+
+
+class TrafficSessionSummary(models.Model):
+    """
+    Сводка сессий за закрытые сутки UTC (traffic/sessions.py): строка kind=total - итоги дня,
+    entry, exit и path - страницы входа, выхода и начальные пути сессий (key - id UrlPath или их цепочка),
+    не больше TRAFFIC_SESSION_SUMMARY_KEYS самых частых ключей каждого вида за день.
+    """
+    day = models.DateField()
+    kind = models.CharField(max_length=8)
+    key = models.CharField(max_length=255, blank=True)
+    sessions = models.PositiveIntegerField(default=0)
+    bounces = models.PositiveIntegerField(default=0)
+    pageviews = models.PositiveBigIntegerField(default=0)
+    # Суммарная длительность сессий, секунды
+    duration = models.FloatField(default=0)
+
+    def __str__(self):
+        return f'{self.kind} {self.day}: {self.key}'
+
+    class Meta:
+        verbose_name = 'Сводка сессий'
+        verbose_name_plural = 'Сводки сессий'
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'kind', 'key'], name='traffic_session_summary_unique'),
+        ]
+
+
+class TrafficIngestBatch(models.Model):
+    """
+    Сегмент спула, загруженный командой traffic_ingest.
+    Запись создаётся в одной транзакции с COPY строк сегмента, поэтому повторная загрузка того же сегмента
+    (после сбоя между фиксацией и удалением файла) пропускается.
+    """
+    name = models.CharField(max_length=255, unique=True)
+    records = models.PositiveIntegerField(default=0)
+    first_created_at = models.DateTimeField(null=True, blank=True)
+    spooled_at = models.DateTimeField()
+    ingested_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.name}: {self.records}'
+
+    class Meta:
+        verbose_name = 'Загруженный сегмент спула'
+        verbose_name_plural = 'Загруженные сегменты спула'
+
+
+class UserActivitySummary(models.Model):
+    """
+    Показатели пользователя для таблицы зарегистрированных пользователей, одна строка на пользователя.
+    Визиты и время на сайте считаются за скользящее окно USER_STATS_WINDOW на момент последнего обновления.
+    Обновляется инкрементально вместе с почасовыми агрегатами (traffic/activity.py).
+    """
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True, related_name='activity_summary'
+    )
+    visit_count = models.PositiveIntegerField(default=0)
+    total_time_on_site = models.PositiveBigIntegerField(default=0)
+    avg_time_on_site = models.FloatField(default=0)
+    last_visit_at = models.DateTimeField(null=True, blank=True)
+    last_hit_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.user_id}: {self.visit_count}'
+
+    class Meta:
+        verbose_name = 'Активность пользователя'
+        verbose_name_plural = 'Активность пользователей'
+        # Сортировки таблицы пользователей читают страницу по индексу, id - второй ключ для стабильного порядка
+        indexes = [
+            models.Index(fields=['visit_count', 'user'], name='traffic_activity_visits'),
+            models.Index(fields=['avg_time_on_site', 'user'], name='traffic_activity_avg_time'),
+            models.Index(fields=['last_visit_at', 'user'], name='traffic_activity_last_visit'),
+            models.Index(fields=['last_hit_at', 'user'], name='traffic_activity_last_hit'),
+        ]
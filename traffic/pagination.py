@@ -0,0 +1,137 @@
+import base64
+import json
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param, remove_query_param
+
+# Точный подсчёт ведётся до этого числа строк, дальше возвращается оценка планировщика
+COUNT_CAP = getattr(settings, 'TRAFFIC_LOG_COUNT_CAP', 10000)
+
+
+def encode_cursor(created_at, pk, reverse=False):
+    payload = json.dumps([created_at.isoformat(), pk, int(reverse)], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Возвращает (created_at, pk, reverse) или ValidationError для повреждённого курсора."""
+    try:
+        payload = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        created_at, pk, reverse = json.loads(payload)
+        created_at = parse_datetime(created_at)
+        if created_at is None:
+            raise ValueError
+        return created_at, int(pk), bool(reverse)
+    except (ValueError, TypeError):
+        raise ValidationError({"error": "Некорректный курсор"})
+
+
+class KeysetPage:
+    """
+    Страница журнала в порядке (-created_at, -id), выбранная по ключу последней строки вместо OFFSET.
+    Стоимость любой страницы одинакова: индексный поиск до ключа и чтение page_size + 1 строк.
+    Условие по created_at без OR повторяет ключ, чтобы стать границей сканирования индекса (user, created_at, id),
+    условие с OR отсекает только строки с тем же created_at.
+    """
+
+    def __init__(self, queryset, cursor=None, page_size=25):
+        self.page_size = page_size
+        reverse = False
+
+        if cursor:
+            created_at, pk, reverse = decode_cursor(cursor)
+            if reverse:
+                queryset = queryset.filter(
+                    Q(created_at__gt=created_at) | Q(created_at=created_at, pk__gt=pk), created_at__gte=created_at
+                )
+            else:
+                queryset = queryset.filter(
+                    Q(created_at__lt=created_at) | Q(created_at=created_at, pk__lt=pk), created_at__lte=created_at
+                )
+
+        ordering = ('created_at', 'pk') if reverse else ('-created_at', '-pk')
+        rows = list(queryset.order_by(*ordering)[:page_size + 1])
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+
+        if reverse:
+            rows.reverse()
+            self.has_previous, self.has_next = has_more, True
+        else:
+            self.has_previous, self.has_next = bool(cursor), has_more
+
+        self.object_list = rows
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    @property
+    def next_cursor(self):
+        if self.has_next and self.object_list:
+            last = self.object_list[-1]
+            return encode_cursor(last.created_at, last.pk)
+        return None
+
+    @property
+    def previous_cursor(self):
+        if self.has_previous and self.object_list:
+            first = self.object_list[0]
+            return encode_cursor(first.created_at, first.pk, reverse=True)
+        return None
+
+
+def estimate_count(queryset, cap=COUNT_CAP):
+    """
+    Число строк без полного COUNT(*): точный подсчёт с LIMIT cap, а если строк не меньше cap -
+    оценка планировщика (по статистике pg_class / pg_statistic). Возвращает (count, is_estimate).
+    """
+    queryset = queryset.order_by()
+    count = queryset[:cap].count()
+    if count < cap:
+        return count, False
+
+    plan = json.loads(queryset.explain(format='json'))
+    return max(cap, int(plan[0]['Plan']['Plan Rows'])), True
+
+
+class KeysetPagination(BasePagination):
+    """Курсорная пагинация журнала запросов по (created_at, id) с непрозрачными курсорами."""
+    cursor_query_param = 'cursor'
+    page_size = 25
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            raise ValidationError({"error": "Некорректный page_size"})
+        return max(1, min(page_size, self.max_page_size))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page = KeysetPage(
+            queryset, request.query_params.get(self.cursor_query_param), self.get_page_size(request)
+        )
+        return self.page.object_list
+
+    def get_link(self, cursor):
+        if cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(remove_query_param(url, 'page'), self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data, count=None):
+        response_data = OrderedDict()
+        if count is not None:
+            response_data["count"], response_data["count_is_estimate"] = count
+        response_data["next"] = self.get_link(self.page.next_cursor)
+        response_data["previous"] = self.get_link(self.page.previous_cursor)
+        response_data["results"] = data
+        return Response(response_data)
@@ -0,0 +1,179 @@
+import re
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .caching import invalidate_period_cache
+from .models import TrafficStat
+
+PARTITION_INTERVALS = ('day', 'month')
+
+DEFAULT_PARTITIONING_SETTINGS = {
+    'INTERVAL': 'month',
+    'PREMAKE': 2,
+    'RETENTION_DAYS': None,
+}
+
+BOUND_RE = re.compile(r"FROM \((MINVALUE|'[^']+')\) TO \((MAXVALUE|'[^']+')\)")
+
+
+def get_partitioning_settings():
+    return {**DEFAULT_PARTITIONING_SETTINGS, **getattr(settings, 'TRAFFIC_PARTITIONING', {})}
+
+
+def parent_table():
+    return TrafficStat._meta.db_table
+
+
+def default_partition():
+    return f'{parent_table()}_default'
+
+
+def interval_start(moment, interval):
+    """Начало интервала секционирования, содержащего moment, в текущей временной зоне."""
+    local = timezone.localtime(moment)
+    if interval == 'day':
+        start = datetime(local.year, local.month, local.day)
+    elif interval == 'month':
+        start = datetime(local.year, local.month, 1)
+    else:
+        raise ValueError(f"Неизвестный интервал секционирования: {interval}")
+    return timezone.make_aware(start)
+
+
+def next_interval_start(moment, interval):
+    start = interval_start(moment, interval)
+    if interval == 'day':
+        following = start.date() + timedelta(days=1)
+    else:
+        following = (start.replace(day=28) + timedelta(days=4)).date().replace(day=1)
+    return timezone.make_aware(datetime.combine(following, datetime.min.time()))
+
+
+def partition_name(start, interval):
+    local = timezone.localtime(start)
+    suffix = local.strftime('%Y%m%d' if interval == 'day' else '%Y%m')
+    return f'{parent_table()}_p{suffix}'
+
+
+def _parse_bound(value):
+    if value in ('MINVALUE', 'MAXVALUE'):
+        return None
+    return parse_datetime(value.strip("'"))
+
+
+def list_partitions():
+    """Возвращает секции TrafficStat в порядке диапазонов: [(имя, начало или None, конец или None)], без DEFAULT."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT child.relname, pg_get_expr(child.relpartbound, child.oid)
+            FROM pg_inherits
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE pg_inherits.inhparent = %s::regclass
+            """,
+            [parent_table()],
+        )
+        rows = cursor.fetchall()
+
+    partitions = []
+    for name, bound in rows:
+        match = BOUND_RE.search(bound)
+        if match:
+            partitions.append((name, _parse_bound(match.group(1)), _parse_bound(match.group(2))))
+
+    return sorted(partitions, key=lambda partition: partition[2] or timezone.make_aware(datetime.max - timedelta(days=1)))
+
+
+def is_partitioned():
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT relkind FROM pg_class WHERE oid = %s::regclass", [parent_table()])
+        return cursor.fetchone()[0] == 'p'
+
+
+def create_partition(start, end, name):
+    """
+    Создаёт секцию [start, end). Строки этого диапазона, успевшие попасть в DEFAULT-секцию,
+    переносятся в новую секцию в той же транзакции.
+    """
+    parent = connection.ops.quote_name(parent_table())
+    default = connection.ops.quote_name(default_partition())
+    moved_table = connection.ops.quote_name(f'{name}_moved')
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            CREATE TEMPORARY TABLE {moved_table} ON COMMIT DROP AS
+            WITH moved AS (
+                DELETE FROM {default} WHERE created_at >= %s AND created_at < %s RETURNING *
+            )
+            SELECT * FROM moved
+            """,
+            [start, end],
+        )
+        cursor.execute(
+            f"CREATE TABLE {connection.ops.quote_name(name)} PARTITION OF {parent} FOR VALUES FROM (%s) TO (%s)",
+            [start, end],
+        )
+        cursor.execute(f"INSERT INTO {parent} SELECT * FROM {moved_table}")
+        return cursor.rowcount
+
+
+def ensure_partitions(interval, premake, now=None):
+    """
+    Создаёт секции от конца последней существующей до интервала, содержащего now, плюс premake интервалов вперёд.
+    Возвращает список созданных секций [(имя, начало, конец, перенесено строк из DEFAULT)].
+    """
+    now = now or timezone.now()
+    horizon = interval_start(now, interval)
+    for _ in range(premake + 1):
+        horizon = next_interval_start(horizon, interval)
+
+    partitions = list_partitions()
+    bounded = [end for _, _, end in partitions if end is not None]
+    start = max(bounded) if bounded else interval_start(now, interval)
+
+    created = []
+    while start < horizon:
+        end = next_interval_start(start, interval)
+        name = partition_name(start, interval)
+        moved = create_partition(start, end, name)
+        created.append((name, start, end, moved))
+        start = end
+
+    return created
+
+
+def expire_partitions(retention_days, drop=True, now=None):
+    """
+    Отключает секции, целиком лежащие раньше now - retention_days, и при drop=True удаляет их.
+    Удаление секции - это DROP TABLE без DELETE и последующего разрастания таблицы.
+    """
+    now = now or timezone.now()
+    cutoff = now - timedelta(days=retention_days)
+    parent = connection.ops.quote_name(parent_table())
+
+    expired = []
+    for name, start, end in list_partitions():
+        if end is None or end > cutoff:
+            continue
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f"ALTER TABLE {parent} DETACH PARTITION {connection.ops.quote_name(name)}")
+            if drop:
+                cursor.execute(f"DROP TABLE {connection.ops.quote_name(name)}")
+        expired.append((name, start, end))
+
+    if expired:
+        invalidate_period_cache()
+
+    return expired
+
+
+def default_partition_rows():
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT COUNT(*) FROM {connection.ops.quote_name(default_partition())}")
+        return cursor.fetchone()[0]
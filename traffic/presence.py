@@ -0,0 +1,254 @@
+import logging
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+USERS = 'users'
+GUESTS = 'guests'
+
+DEFAULT_PRESENCE_SETTINGS = {
+    'BACKEND': None,
+    'OPTIONS': {},
+    'WINDOW': 300,
+    'SWEEP_INTERVAL': 60,
+    # После ошибки хранилища отметки пропускаются столько секунд, не добавляя таймаут к каждому ответу
+    'RETRY_INTERVAL': 30,
+}
+
+
+def get_presence_settings():
+    return {**DEFAULT_PRESENCE_SETTINGS, **getattr(settings, 'TRAFFIC_PRESENCE', {})}
+
+
+class BasePresenceBackend:
+    """
+    Хранилище присутствия: для каждой группы (USERS, GUESTS) - отображение участник -> время последнего запроса
+    (unix timestamp). Наследники реализуют отметку, подсчёт и выборку начиная с момента since и удаление старых записей.
+    """
+
+    def touch(self, group, member, timestamp):
+        raise NotImplementedError
+
+    def count(self, group, since):
+        raise NotImplementedError
+
+    def members(self, group, since):
+        raise NotImplementedError
+
+    def sweep(self, group, before):
+        raise NotImplementedError
+
+
+class MemoryPresenceBackend(BasePresenceBackend):
+    """Словарь в памяти процесса. Подходит для тестов и запуска в одном процессе."""
+
+    def __init__(self, **options):
+        self._groups = defaultdict(dict)
+        self._lock = threading.Lock()
+
+    def touch(self, group, member, timestamp):
+        with self._lock:
+            members = self._groups[group]
+            members[member] = max(timestamp, members.get(member, timestamp))
+
+    def count(self, group, since):
+        return len(self.members(group, since))
+
+    def members(self, group, since):
+        with self._lock:
+            return {member: seen for member, seen in self._groups[group].items() if seen >= since}
+
+    def sweep(self, group, before):
+        with self._lock:
+            members = self._groups[group]
+            stale = [member for member, seen in members.items() if seen < before]
+            for member in stale:
+                del members[member]
+        return len(stale)
+
+
+class CachePresenceBackend(BasePresenceBackend):
+    """
+    Хранит словарь группы в кеше Django (CACHE_ALIAS, по умолчанию default).
+    Запись не атомарна, при одновременных запросах возможна потеря отдельной отметки до следующего запроса.
+    """
+
+    def __init__(self, CACHE_ALIAS='default', KEY_PREFIX='traffic:presence', **options):
+        self.cache = caches[CACHE_ALIAS]
+        self.key_prefix = KEY_PREFIX
+
+    def _key(self, group):
+        return f'{self.key_prefix}:{group}'
+
+    def touch(self, group, member, timestamp):
+        members = self.cache.get(self._key(group), {})
+        members[member] = max(timestamp, members.get(member, timestamp))
+        self.cache.set(self._key(group), members, None)
+
+    def count(self, group, since):
+        return len(self.members(group, since))
+
+    def members(self, group, since):
+        members = self.cache.get(self._key(group), {})
+        return {member: seen for member, seen in members.items() if seen >= since}
+
+    def sweep(self, group, before):
+        members = self.cache.get(self._key(group), {})
+        fresh = {member: seen for member, seen in members.items() if seen >= before}
+        self.cache.set(self._key(group), fresh, None)
+        return len(members) - len(fresh)
+
+
+class RedisPresenceBackend(BasePresenceBackend):
+    """Отсортированное множество Redis на группу: ZADD при запросе, ZCOUNT/ZRANGEBYSCORE для выборки - O(log n)."""
+
+    def __init__(self, URL='redis://localhost:6379/0', KEY_PREFIX='traffic:presence', KEY_TTL=86400, **options):
+        if redis is None:
+            raise ImproperlyConfigured("Для RedisPresenceBackend необходимо установить пакет redis")
+        timeout = options.get('SOCKET_TIMEOUT', 0.5)
+        self.client = redis.Redis.from_url(URL, socket_timeout=timeout, socket_connect_timeout=timeout)
+        self.key_prefix = KEY_PREFIX
+        self.key_ttl = KEY_TTL
+
+    def _key(self, group):
+        return f'{self.key_prefix}:{group}'
+
+    def touch(self, group, member, timestamp):
+        pipeline = self.client.pipeline(transaction=False)
+        pipeline.zadd(self._key(group), {member: timestamp}, gt=True)
+        pipeline.expire(self._key(group), self.key_ttl)
+        pipeline.execute()
+
+    def count(self, group, since):
+        return self.client.zcount(self._key(group), since, '+inf')
+
+    def members(self, group, since):
+        return {
+            member.decode(): seen
+            for member, seen in self.client.zrangebyscore(self._key(group), since, '+inf', withscores=True)
+        }
+
+    def sweep(self, group, before):
+        return self.client.zremrangebyscore(self._key(group), '-inf', f'({before}')
+
+
+class PresenceTracker:
+    """
+    Онлайн-присутствие пользователей и гостей без запросов к БД.
+    Пользователь онлайн, если с его сессии был запрос за последние window секунд.
+    Записи старше window удаляются не чаще раза в sweep_interval секунд при очередной отметке.
+    Ошибка хранилища размыкает цепь: следующие retry_interval секунд отметки пропускаются, а чтения возвращают None
+    без обращения к нему, чтобы вызывающий сразу перешёл к подсчёту по БД.
+    """
+
+    def __init__(self, backend, window=300, sweep_interval=60, retry_interval=30):
+        self.backend = backend
+        self.window = window
+        self.sweep_interval = sweep_interval
+        self.retry_interval = retry_interval
+        self._last_sweep = 0
+        self._suspended_until = 0
+
+    def available(self):
+        """Цепь замкнута: с последней ошибки хранилища прошло не меньше retry_interval секунд."""
+        return time.monotonic() >= self._suspended_until
+
+    def _suspend(self):
+        self._suspended_until = time.monotonic() + self.retry_interval
+
+    def touch(self, user_id, session_id, timestamp=None):
+        """Отмечает запрос. Возвращает False, если отметка пропущена из-за недавней ошибки хранилища."""
+        if not self.available():
+            return False
+
+        timestamp = timestamp.timestamp() if timestamp else time.time()
+        try:
+            if user_id is not None:
+                self.backend.touch(USERS, str(user_id), timestamp)
+            elif session_id:
+                self.backend.touch(GUESTS, session_id, timestamp)
+
+            if timestamp - self._last_sweep >= self.sweep_interval:
+                self._last_sweep = timestamp
+                self.sweep()
+        except Exception:
+            self._suspend()
+            raise
+        return True
+
+    def _since(self):
+        return time.time() - self.window
+
+    def _read(self, operation, group):
+        if not self.available():
+            return None
+        try:
+            return operation(group, self._since())
+        except Exception:
+            self._suspend()
+            raise
+
+    def online_user_ids(self):
+        """Возвращает {id пользователя: время последнего запроса (aware datetime)} или None, пока цепь разомкнута."""
+        members = self._read(self.backend.members, USERS)
+        if members is None:
+            return None
+        return {int(member): datetime.fromtimestamp(seen, tz=dt_timezone.utc) for member, seen in members.items()}
+
+    def online_users_count(self):
+        return self._read(self.backend.count, USERS)
+
+    def online_guests_count(self):
+        return self._read(self.backend.count, GUESTS)
+
+    def sweep(self):
+        before = self._since()
+        return sum(self.backend.sweep(group, before) for group in (USERS, GUESTS))
+
+
+_tracker = None
+_tracker_lock = threading.Lock()
+
+
+def get_presence_tracker():
+    """Трекер присутствия процесса или None, если TRAFFIC_PRESENCE['BACKEND'] не задан."""
+    global _tracker
+
+    presence_settings = get_presence_settings()
+    if not presence_settings['BACKEND']:
+        return None
+
+    with _tracker_lock:
+        if _tracker is None:
+            backend_class = import_string(presence_settings['BACKEND'])
+            _tracker = PresenceTracker(
+                backend_class(**presence_settings['OPTIONS']),
+                window=presence_settings['WINDOW'],
+                sweep_interval=presence_settings['SWEEP_INTERVAL'],
+                retry_interval=presence_settings['RETRY_INTERVAL'],
+            )
+
+    return _tracker
+
+
+@receiver(setting_changed)
+def reset_presence_tracker(setting, **kwargs):
+    global _tracker
+
+    if setting == 'TRAFFIC_PRESENCE':
+        _tracker = None
@@ -0,0 +1,117 @@
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+from tracking.models import Visitor
+
+from .models import TrafficHourlyRollup, TrafficRollupState, TrafficStat
+from .rollups import HOURLY_ROLLUP_STATE
+
+RETENTION_GRANULARITIES = ('week', 'month')
+DEFAULT_RETENTION_PERIODS = 12
+MAX_RETENTION_PERIODS = 104
+
+# Пользователь активен в периоде, если в нём начался его визит (Visitor) или есть его хит. Закрытые часы
+# берутся из множеств пользователей почасовых агрегатов, хвост выше отметки - из TrafficStat. Visitor хранится
+# дольше секций TrafficStat (TRAFFIC_PARTITIONING['RETENTION_DAYS']), поэтому по нему же определяется первый визит.
+RETENTION_SQL = f"""
+WITH mark AS (
+    SELECT COALESCE(MAX(last_traffic_stat_id), 0) AS last_id
+    FROM {TrafficRollupState._meta.db_table} WHERE name = %(state)s
+),
+moments AS (
+    SELECT user_id, start_time AS moment FROM {Visitor._meta.db_table}
+    WHERE user_id IS NOT NULL AND start_time < %(end)s
+    UNION ALL
+    SELECT unnest(registered_users), hour FROM {TrafficHourlyRollup._meta.db_table}
+    WHERE %(use_rollups)s AND hour < %(end)s
+    UNION ALL
+    SELECT user_id, created_at FROM {TrafficStat._meta.db_table}
+    WHERE user_id IS NOT NULL AND created_at < %(end)s AND (NOT %(use_rollups)s OR id > (SELECT last_id FROM mark))
+),
+activity AS (
+    SELECT DISTINCT user_id, date_trunc(%(granularity)s, moment AT TIME ZONE %(tz)s) AS period FROM moments
+),
+cohorts AS (
+    SELECT user_id, MIN(period) AS cohort FROM activity GROUP BY user_id
+)
+SELECT cohorts.cohort, activity.period, COUNT(*)
+FROM cohorts
+JOIN activity ON activity.user_id = cohorts.user_id
+WHERE cohorts.cohort >= date_trunc(%(granularity)s, %(start)s AT TIME ZONE %(tz)s)
+GROUP BY 1, 2
+"""
+
+
+def period_start(day, granularity):
+    if granularity == 'week':
+        return day - timedelta(days=day.weekday())
+    return day.replace(day=1)
+
+
+def next_period(period, granularity):
+    if granularity == 'week':
+        return period + timedelta(weeks=1)
+    return (period.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def previous_period(period, granularity):
+    if granularity == 'week':
+        return period - timedelta(weeks=1)
+    return (period - timedelta(days=1)).replace(day=1)
+
+
+def default_retention_range(granularity, periods=DEFAULT_RETENTION_PERIODS):
+    """Последние periods периодов в текущей зоне, включая текущий: (start, end)."""
+    current = period_start(timezone.localdate(), granularity)
+    first = current
+    for _ in range(periods - 1):
+        first = previous_period(first, granularity)
+    return (
+        timezone.make_aware(datetime.combine(first, datetime.min.time())),
+        timezone.make_aware(datetime.combine(next_period(current, granularity), datetime.min.time())),
+    )
+
+
+def retention_matrix(start, end, granularity='week', tz=None):
+    """
+    Когорты пользователей по периоду первого визита (неделя или месяц в зоне tz), начиная с периода start,
+    и число активных пользователей когорты в каждом следующем периоде до end. Считается одним запросом:
+    первый период каждого пользователя (CTE cohorts) соединяется с его периодами активности.
+    Агрегаты почасовые, поэтому в зонах со смещением не в целое число часов граница периода точна до часа.
+    """
+    if granularity not in RETENTION_GRANULARITIES:
+        raise ValueError(f"Неизвестная гранулярность: {granularity}")
+
+    tz = tz or timezone.get_current_timezone_name()
+    with connection.cursor() as cursor:
+        cursor.execute(RETENTION_SQL, {
+            'state': HOURLY_ROLLUP_STATE,
+            'use_rollups': getattr(settings, 'TRAFFIC_USE_ROLLUPS', True),
+            'start': start,
+            'end': end,
+            'granularity': granularity,
+            'tz': tz,
+        })
+        active = {(cohort.date(), period.date()): count for cohort, period, count in cursor.fetchall()}
+
+    zone = ZoneInfo(tz)
+    last = period_start((end - timedelta(microseconds=1)).astimezone(zone).date(), granularity)
+    period = period_start(start.astimezone(zone).date(), granularity)
+
+    cohorts = []
+    while period <= last:
+        periods = [period]
+        while periods[-1] < last:
+            periods.append(next_period(periods[-1], granularity))
+        counts = [active.get((period, following), 0) for following in periods]
+        cohorts.append({
+            'period': period.isoformat(),
+            'users': counts[0],
+            'active': counts,
+            'retention': [count / counts[0] if counts[0] else 0.0 for count in counts],
+        })
+        period = next_period(period, granularity)
+    return cohorts
@@ -0,0 +1,353 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .caching import invalidate_late_hits, invalidate_period_cache
+from .hll import HyperLogLog
+from .models import TrafficStat, TrafficHourlyRollup, TrafficRollupState
+
+HOURLY_ROLLUP_STATE = 'hourly'
+
+# Строки моложе этого возраста не агрегируются, чтобы текущие минуты не пересчитывались каждым запуском.
+# Полноту отметки обеспечивает committed_high_id, а не возраст строк: время хитов из спула, буфера
+# и клиентских событий может быть намного старше их id.
+ROLLUP_SETTLE_SECONDS = getattr(settings, 'TRAFFIC_ROLLUP_SETTLE_SECONDS', 60)
+
+GRANULARITIES = ('hour', 'day', 'week', 'month', 'year')
+
+
+def get_high_water_mark():
+    state = TrafficRollupState.objects.filter(name=HOURLY_ROLLUP_STATE).only('last_traffic_stat_id').first()
+    return state.last_traffic_stat_id if state else 0
+
+
+# Транзакции, получившие xid (то есть писавшие), держат блокировку своего transactionid до завершения.
+# pg_locks общий для кластера, а у блокировок transactionid поле database пустое, поэтому транзакции
+# текущей базы отбираются по процессам из pg_stat_activity. Строки журнала пишут только клиентские процессы:
+# xid автоочистки не задерживает отметку
+ACTIVE_XIDS_SQL = """
+SELECT COALESCE(string_agg(transactionid::text, ','), '') FROM pg_locks
+WHERE locktype = 'transactionid' AND mode = 'ExclusiveLock' AND granted AND pid <> pg_backend_pid()
+  AND pid IN (
+      SELECT pid FROM pg_stat_activity
+      WHERE datid = (SELECT oid FROM pg_database WHERE datname = current_database())
+        AND backend_type = 'client backend'
+  )
+"""
+
+XIDS_FINISHED_SQL = """
+SELECT NOT EXISTS (
+    SELECT 1 FROM pg_locks WHERE locktype = 'transactionid' AND transactionid::text = ANY(string_to_array(%s, ','))
+)
+"""
+
+
+def committed_high_id(name):
+    """
+    Наибольший id TrafficStat, до которого отметка name может сдвинуться без пропусков: каждая транзакция,
+    получившая id не выше него, завершена. Id выдаются последовательностью до фиксации, поэтому медленная
+    транзакция может зафиксировать меньший id позже большего. Кандидат - значение последовательности вместе
+    со списком пишущих в этот момент транзакций; он принимается, когда все они завершились. Непринятый кандидат
+    сохраняется в состоянии и проверяется следующими запусками, пока не завершится долгая транзакция.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT COALESCE(pg_sequence_last_value(pg_get_serial_sequence(%s, 'id')), 0)",
+            [TrafficStat._meta.db_table],
+        )
+        sequence_id = cursor.fetchone()[0]
+        # pg_stat_activity читается один раз за транзакцию, внутри открытой транзакции снимок нужно сбросить
+        cursor.execute("SELECT pg_stat_clear_snapshot()")
+        cursor.execute(ACTIVE_XIDS_SQL)
+        xids = cursor.fetchone()[0]
+        if not xids:
+            TrafficRollupState.objects.filter(name=name).update(pending_traffic_stat_id=0, pending_xids='')
+            return sequence_id
+
+        # Состояние создаётся до первого кандидата: иначе на новой установке под нагрузкой
+        # кандидат не сохраняется ни одним запуском и отметка не сдвигается никогда
+        state, _ = TrafficRollupState.objects.get_or_create(name=name)
+        if not state.pending_xids:
+            accepted = state.last_traffic_stat_id
+        else:
+            cursor.execute(XIDS_FINISHED_SQL, [state.pending_xids])
+            if not cursor.fetchone()[0]:
+                return state.last_traffic_stat_id
+            accepted = state.pending_traffic_stat_id
+
+    TrafficRollupState.objects.filter(name=name).update(pending_traffic_stat_id=sequence_id, pending_xids=xids)
+    return accepted
+
+
+def settled_high_id(name, settle_seconds=ROLLUP_SETTLE_SECONDS):
+    """Граница порции для отметки name: зафиксированные id (committed_high_id) без строк моложе settle_seconds."""
+    settled_before = timezone.now() - timedelta(seconds=settle_seconds)
+    settled_id = (
+        TrafficStat.objects.filter(created_at__lte=settled_before)
+        .order_by('-id').values_list('id', flat=True).first()
+    ) or 0
+    return min(settled_id, committed_high_id(name))
+
+
+def update_sketch(data, values):
+    sketch = HyperLogLog.from_bytes(data) if data is not None else HyperLogLog()
+    return sketch.update(values)
+
+
+def update_hourly_rollups(batch_size=100000, settle_seconds=ROLLUP_SETTLE_SECONDS):
+    """
+    Инкрементально переносит новые строки TrafficStat (id выше отметки) в TrafficHourlyRollup.
+    Каждая порция обрабатывается в одной транзакции вместе со сдвигом отметки.
+    Возвращает количество обработанных строк.
+    """
+    target_id = settled_high_id(HOURLY_ROLLUP_STATE, settle_seconds)
+    if not target_id:
+        return 0
+
+    stat_table = TrafficStat._meta.db_table
+    rollup_table = TrafficHourlyRollup._meta.db_table
+    processed, oldest = 0, None
+
+    while True:
+        with transaction.atomic():
+            state, _ = TrafficRollupState.objects.select_for_update().get_or_create(name=HOURLY_ROLLUP_STATE)
+            low_id = state.last_traffic_stat_id
+            if low_id >= target_id:
+                break
+            high_id = min(low_id + batch_size, target_id)
+
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"""
+                    WITH batch AS (
+                        SELECT date_trunc('hour', created_at) AS hour,
+                               MIN(created_at) AS oldest,
+                               COUNT(*) AS rows,
+                               SUM(weight) AS hits,
+                               COALESCE(ARRAY_AGG(DISTINCT user_id) FILTER (WHERE user_id IS NOT NULL), '{{}}')
+                                   AS registered_users,
+                               COALESCE(ARRAY_AGG(DISTINCT ip_address) FILTER (WHERE user_id IS NULL), '{{}}')
+                                   AS guest_ips
+                        FROM {stat_table}
+                        WHERE id > %s AND id <= %s
+                        GROUP BY 1
+                    ),
+                    upsert AS (
+                        INSERT INTO {rollup_table} AS rollup (hour, hits, registered_users, guest_ips, updated_at)
+                        SELECT hour, hits, registered_users, guest_ips, NOW() FROM batch
+                        ON CONFLICT (hour) DO UPDATE SET
+                            hits = rollup.hits + EXCLUDED.hits,
+                            registered_users = ARRAY(
+                                SELECT DISTINCT unnest(rollup.registered_users || EXCLUDED.registered_users)
+                            ),
+                            guest_ips = ARRAY(SELECT DISTINCT unnest(rollup.guest_ips || EXCLUDED.guest_ips)),
+                            updated_at = EXCLUDED.updated_at
+                        RETURNING rollup.id, rollup.hour, rollup.registered_users_hll, rollup.guests_hll,
+                                  rollup.registered_users, rollup.guest_ips
+                    )
+                    -- Скетч дополняется значениями порции; если скетча ещё нет, он строится по всему множеству часа
+                    SELECT batch.oldest, batch.rows, upsert.id, upsert.registered_users_hll, upsert.guests_hll,
+                           CASE WHEN upsert.registered_users_hll IS NULL
+                                THEN upsert.registered_users ELSE batch.registered_users END,
+                           CASE WHEN upsert.guests_hll IS NULL THEN upsert.guest_ips ELSE batch.guest_ips END
+                    FROM batch JOIN upsert ON upsert.hour = batch.hour
+                    """,
+                    [low_id, high_id],
+                )
+                rows = cursor.fetchall()
+                processed += sum(row[1] for row in rows)
+                oldest = min(filter(None, [oldest, *(row[0] for row in rows)]), default=None)
+
+                cursor.executemany(
+                    f"UPDATE {rollup_table} SET registered_users_hll = %s, guests_hll = %s WHERE id = %s",
+                    [
+                        (
+                            update_sketch(users_hll, users).to_bytes(),
+                            update_sketch(guests_hll, guests).to_bytes(),
+                            rollup_id,
+                        )
+                        for _, _, rollup_id, users_hll, guests_hll, users, guests in rows
+                    ],
+                )
+
+            state.last_traffic_stat_id = high_id
+            state.save(update_fields=['last_traffic_stat_id', 'updated_at'])
+
+    # Опоздавшие строки закрытых периодов меняют уже закешированные ответы
+    invalidate_late_hits(oldest)
+    return processed
+
+
+def rebuild_hourly_rollups(batch_size=100000, settle_seconds=ROLLUP_SETTLE_SECONDS):
+    with transaction.atomic():
+        TrafficHourlyRollup.objects.all().delete()
+        TrafficRollupState.objects.filter(name=HOURLY_ROLLUP_STATE).delete()
+    processed = update_hourly_rollups(batch_size=batch_size, settle_seconds=settle_seconds)
+    invalidate_period_cache()
+    return processed
+
+
+# Все корзины [start, end) в локальном времени зоны: пустые корзины попадают в ответ того же запроса с нулями
+BUCKETS_CTE = """
+buckets AS (
+    SELECT generate_series(
+        date_trunc(%(granularity)s, %(start)s AT TIME ZONE %(tz)s),
+        date_trunc(%(granularity)s, (%(end)s - INTERVAL '1 microsecond') AT TIME ZONE %(tz)s),
+        ('1 ' || %(granularity)s)::interval
+    ) AS bucket
+)"""
+
+# Итог запроса статистики: CTE stats(bucket, hits, registered_users, guests), дополненный пустыми корзинами
+SERIES_SELECT = """
+SELECT buckets.bucket,
+       COALESCE(stats.hits, 0),
+       COALESCE(stats.registered_users, 0),
+       COALESCE(stats.guests, 0)
+FROM buckets
+LEFT JOIN stats ON stats.bucket = buckets.bucket
+ORDER BY buckets.bucket
+"""
+
+
+def series_params(start, end, granularity, tz):
+    return {
+        'start': start,
+        'end': end,
+        'granularity': granularity,
+        'tz': tz or timezone.get_current_timezone_name(),
+    }
+
+
+def fetch_series(sql, params):
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+
+    return {
+        bucket: {
+            "count": int(count),
+            "unique_registered_users": unique_registered_users,
+            "unique_guests": unique_guests,
+        }
+        for bucket, count, unique_registered_users, unique_guests in rows
+    }
+
+
+def period_stats(start, end, granularity, tz=None):
+    """
+    Статистика за полуинтервал [start, end) с разбивкой по granularity в зоне tz (по умолчанию - текущей).
+    Закрытые часы читаются из TrafficHourlyRollup, ещё не агрегированный хвост (текущий час) - из TrafficStat.
+    Возвращает упорядоченный словарь {начало корзины (naive, локальное время): {"count", "unique_registered_users",
+    "unique_guests"}} со всеми корзинами интервала, включая пустые.
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"Неизвестная гранулярность: {granularity}")
+
+    stat_table = TrafficStat._meta.db_table
+    rollup_table = TrafficHourlyRollup._meta.db_table
+    state_table = TrafficRollupState._meta.db_table
+
+    return fetch_series(
+        f"""
+        WITH mark AS (
+            SELECT COALESCE(MAX(last_traffic_stat_id), 0) AS last_id FROM {state_table} WHERE name = %(state)s
+        ),
+        rollup AS (
+            SELECT hour, hits, registered_users, guest_ips FROM {rollup_table}
+            WHERE hour >= %(start)s AND hour < %(end)s
+        ),
+        facts AS (
+            SELECT hour, hits, NULL::bigint AS user_id, NULL::inet AS guest_ip FROM rollup
+            UNION ALL
+            SELECT hour, 0, unnest(registered_users), NULL FROM rollup
+            UNION ALL
+            SELECT hour, 0, NULL, unnest(guest_ips) FROM rollup
+            UNION ALL
+            SELECT created_at, weight, user_id, CASE WHEN user_id IS NULL THEN ip_address END
+            FROM {stat_table}
+            WHERE id > (SELECT last_id FROM mark) AND created_at >= %(start)s AND created_at < %(end)s
+        ),
+        stats AS (
+            SELECT date_trunc(%(granularity)s, hour AT TIME ZONE %(tz)s) AS bucket,
+                   SUM(hits) AS hits,
+                   COUNT(DISTINCT user_id) AS registered_users,
+                   COUNT(DISTINCT guest_ip) AS guests
+            FROM facts
+            GROUP BY bucket
+        ),
+        {BUCKETS_CTE}
+        {SERIES_SELECT}
+        """,
+        {'state': HOURLY_ROLLUP_STATE, **series_params(start, end, granularity, tz)},
+    )
+
+
+def approximate_period_stats(start, end, granularity, tz=None):
+    """
+    То же, что period_stats, но уникальные значения оцениваются объединением почасовых скетчей HyperLogLog
+    (стандартная ошибка hll.relative_error()). Из БД читаются только скетчи и хвост TrafficStat,
+    свёрнутый по часам, без разворачивания множеств. Число хитов точное.
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"Неизвестная гранулярность: {granularity}")
+
+    stat_table = TrafficStat._meta.db_table
+    rollup_table = TrafficHourlyRollup._meta.db_table
+    state_table = TrafficRollupState._meta.db_table
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            WITH mark AS (
+                SELECT COALESCE(MAX(last_traffic_stat_id), 0) AS last_id FROM {state_table} WHERE name = %(state)s
+            ),
+            hours AS (
+                -- Для агрегатов, созданных до появления скетчей, вместо скетча возвращается множество
+                SELECT hour, hits, registered_users_hll, guests_hll,
+                       CASE WHEN registered_users_hll IS NULL THEN registered_users END AS registered_users,
+                       CASE WHEN guests_hll IS NULL THEN guest_ips END AS guest_ips
+                FROM {rollup_table}
+                WHERE hour >= %(start)s AND hour < %(end)s
+                UNION ALL
+                SELECT date_trunc('hour', created_at), SUM(weight), NULL, NULL,
+                       ARRAY_AGG(DISTINCT user_id) FILTER (WHERE user_id IS NOT NULL),
+                       ARRAY_AGG(DISTINCT ip_address) FILTER (WHERE user_id IS NULL)
+                FROM {stat_table}
+                WHERE id > (SELECT last_id FROM mark) AND created_at >= %(start)s AND created_at < %(end)s
+                GROUP BY 1
+            ),
+            {BUCKETS_CTE}
+            SELECT buckets.bucket, hours.hits, hours.registered_users_hll, hours.guests_hll,
+                   hours.registered_users, hours.guest_ips
+            FROM buckets
+            LEFT JOIN hours ON date_trunc(%(granularity)s, hours.hour AT TIME ZONE %(tz)s) = buckets.bucket
+            ORDER BY buckets.bucket
+            """,
+            {'state': HOURLY_ROLLUP_STATE, **series_params(start, end, granularity, tz)},
+        )
+        rows = cursor.fetchall()
+
+    # Пустая корзина - None. Скетчи часов копятся по корзинам и объединяются одним HyperLogLog.union на корзину:
+    # попарный merge на каждый час за год - это 2 * 8760 проходов по регистрам в Python
+    buckets = {}
+    for bucket, hits, users_hll, guests_hll, users, guests in rows:
+        values = buckets.get(bucket)
+        if hits is None:
+            buckets[bucket] = values
+            continue
+        if values is None:
+            values = buckets[bucket] = [0, [], []]
+        values[0] += hits
+        values[1].append(update_sketch(users_hll, users or []))
+        values[2].append(update_sketch(guests_hll, guests or []))
+
+    return {
+        bucket: {
+            "count": int(values[0]) if values else 0,
+            "unique_registered_users": HyperLogLog.union(values[1]).cardinality() if values else 0,
+            "unique_guests": HyperLogLog.union(values[2]).cardinality() if values else 0,
+        }
+        for bucket, values in buckets.items()
+    }
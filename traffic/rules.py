@@ -0,0 +1,121 @@
+import random
+import re
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+DEFAULT_TRACKING_SETTINGS = {
+    # Регулярные выражения, сопоставляемые с началом пути. Пустой INCLUDE - учитываются все пути
+    'INCLUDE': [],
+    'EXCLUDE': [
+        r'/static/',
+        r'/admin/(?:jsi18n|js|img|css)/',
+        r'/favicon\.ico$',
+        # Подключение к живой ленте - не просмотр страницы, переподключения раздували бы счётчик
+        r'/api/traffic/live/$',
+        # Пачки клиентских событий записываются самим эндпоинтом, сам запрос маяка - не просмотр страницы
+        r'/api/traffic/events/$',
+        # Опрос метрик сборщиком Prometheus
+        r'/metrics$',
+    ],
+    # Выборочная запись: {'PATH': регулярное выражение начала пути, 'RATE': доля} или
+    # {'USER_AGENT': регулярное выражение, найденное в любом месте строки без учёта регистра, 'RATE': доля}.
+    # Записанный хит получает вес round(1 / RATE), счётчики хитов суммируют веса.
+    'SAMPLING': [],
+}
+
+
+def get_tracking_settings():
+    return {**DEFAULT_TRACKING_SETTINGS, **getattr(settings, 'TRAFFIC_TRACKING', {})}
+
+
+def compile_patterns(patterns, flags=0):
+    """Одно регулярное выражение-альтернатива вместо цепочки проверок; None для пустого списка."""
+    if not patterns:
+        return None
+    return re.compile('|'.join(f'(?:{pattern})' for pattern in patterns), flags)
+
+
+def compile_sampling(rules, flags=0):
+    """Правила выборки одним выражением: имя сработавшей группы указывает на вес правила."""
+    if not rules:
+        return None, {}
+    pattern = re.compile('|'.join(f'(?P<rule{i}>{pattern})' for i, (pattern, _) in enumerate(rules)), flags)
+    return pattern, {f'rule{i}': weight for i, (_, weight) in enumerate(rules)}
+
+
+class TrackingRules:
+    """
+    Правила учёта запросов middleware, скомпилированные один раз при загрузке настроек.
+    weight(path, user_agent) возвращает вес хита или 0, если запрос не записывается.
+    """
+
+    def __init__(self, include=(), exclude=(), sampling=()):
+        self.include = compile_patterns(include)
+        self.exclude = compile_patterns(exclude)
+
+        path_rules, user_agent_rules = [], []
+        for rule in sampling:
+            rate = rule.get('RATE')
+            if not isinstance(rate, (int, float)) or not 0 < rate <= 1:
+                raise ImproperlyConfigured(f"RATE правила выборки должен быть в интервале (0, 1]: {rule}")
+            if ('PATH' in rule) == ('USER_AGENT' in rule):
+                raise ImproperlyConfigured(f"Правило выборки задаёт ровно одно из PATH или USER_AGENT: {rule}")
+
+            weight = max(1, round(1 / rate))
+            if 'PATH' in rule:
+                path_rules.append((rule['PATH'], weight))
+            else:
+                user_agent_rules.append((rule['USER_AGENT'], weight))
+
+        self.path_sampling, self.path_weights = compile_sampling(path_rules)
+        self.user_agent_sampling, self.user_agent_weights = compile_sampling(user_agent_rules, re.IGNORECASE)
+
+    def is_tracked(self, path):
+        if self.include is not None and not self.include.match(path):
+            return False
+        return self.exclude is None or not self.exclude.match(path)
+
+    def sample_weight(self, path, user_agent):
+        """
+        Вес выборки запроса: 1 - записывается каждый запрос.
+        Если подходят и правило пути, и правило User-Agent, применяется более редкая выборка.
+        """
+        weight = 1
+        if self.path_sampling is not None:
+            match = self.path_sampling.match(path)
+            if match:
+                weight = self.path_weights[match.lastgroup]
+        if self.user_agent_sampling is not None and user_agent:
+            match = self.user_agent_sampling.search(user_agent)
+            if match:
+                weight = max(weight, self.user_agent_weights[match.lastgroup])
+        return weight
+
+    def weight(self, path, user_agent):
+        weight = self.sample_weight(path, user_agent)
+        if weight > 1 and random.random() * weight >= 1:
+            return 0
+        return weight
+
+
+_rules = None
+
+
+def get_tracking_rules():
+    global _rules
+
+    if _rules is None:
+        tracking = get_tracking_settings()
+        _rules = TrackingRules(tracking['INCLUDE'], tracking['EXCLUDE'], tracking['SAMPLING'])
+    return _rules
+
+
+@receiver(setting_changed)
+def reset_tracking_rules(setting, **kwargs):
+    global _rules
+
+    if setting == 'TRAFFIC_TRACKING':
+        _rules = None
@@ -4,6 +4,9 @@ from .models import TrafficStat
 
 class TrafficStatSerializer(serializers.ModelSerializer):
     created_at = serializers.DateTimeField(format='%Y-%m-%d %H:%M:%S')
+    # В таблице хранятся ссылки на справочники, в API по-прежнему отдаются строки
+    user_agent = serializers.SlugRelatedField(slug_field='value', read_only=True)
+    url = serializers.SlugRelatedField(slug_field='value', read_only=True)
 
     class Meta:
         model = TrafficStat
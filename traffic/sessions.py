@@ -0,0 +1,249 @@
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .breakdown import utc_midnight
+from .models import TrafficRollupState, TrafficSessionSummary, TrafficStat, UrlPath
+from .rollups import ROLLUP_SETTLE_SECONDS, settled_high_id
+
+SESSIONS_STATE = 'sessions'
+
+# Сессия - хиты одного session_id без перерыва дольше TRAFFIC_SESSION_TIMEOUT секунд в пределах суток UTC
+SESSION_TIMEOUT = getattr(settings, 'TRAFFIC_SESSION_TIMEOUT', 30 * 60)
+# Ключей каждого вида (вход, выход, путь) в сводке за день
+SESSION_SUMMARY_KEYS = getattr(settings, 'TRAFFIC_SESSION_SUMMARY_KEYS', 200)
+# Страниц в начальном пути сессии
+SESSION_PATH_LENGTH = 5
+PATH_SEPARATOR = '>'
+MAX_SESSIONS_LIMIT = 50
+
+# Сессии строятся оконными функциями: перерыв до предыдущего хита того же session_id (LAG), номер сессии -
+# нарастающее число перерывов дольше таймаута. Сессия делится на границе суток UTC, поэтому сутки считаются
+# независимо и закрытые сутки не меняются от новых хитов. Просмотры страниц - хиты без event.
+SESSIONS_CTE = f"""
+hits AS (
+    SELECT stat.id, stat.session_id, stat.created_at, stat.url_id, stat.event IS NULL AS pageview,
+           (stat.created_at AT TIME ZONE 'UTC')::date AS day,
+           stat.created_at - LAG(stat.created_at) OVER (
+               PARTITION BY stat.session_id, (stat.created_at AT TIME ZONE 'UTC')::date
+               ORDER BY stat.created_at, stat.id
+           ) AS gap
+    FROM {TrafficStat._meta.db_table} AS stat
+    WHERE stat.session_id IS NOT NULL AND ({{ranges}})
+),
+numbered AS (
+    SELECT hits.*, COUNT(*) FILTER (WHERE gap IS NULL OR gap > %(timeout)s) OVER (
+        PARTITION BY session_id, day ORDER BY created_at, id
+    ) AS number
+    FROM hits
+),
+sessions AS (
+    SELECT day,
+           ARRAY_AGG(COALESCE(url_id, 0) ORDER BY created_at, id) FILTER (WHERE pageview) AS pages,
+           COUNT(*) AS hits,
+           COUNT(*) FILTER (WHERE pageview) AS pageviews,
+           EXTRACT(EPOCH FROM MAX(created_at) - MIN(created_at)) AS duration
+    FROM numbered
+    GROUP BY session_id, day, number
+    HAVING COUNT(*) FILTER (WHERE pageview) > 0
+)
+"""
+
+# Отказ - сессия из одного просмотра без событий
+SUMMARY_SQL = f"""
+WITH {SESSIONS_CTE}
+SELECT day, kind, key, sessions, bounces, pageviews, duration FROM (
+    SELECT grouped.*, ROW_NUMBER() OVER (PARTITION BY day, kind ORDER BY sessions DESC, key) AS rank
+    FROM (
+        SELECT day, 'total' AS kind, '' AS key, COUNT(*) AS sessions, COUNT(*) FILTER (WHERE hits = 1) AS bounces,
+               SUM(pageviews)::bigint AS pageviews, SUM(duration)::float8 AS duration
+        FROM sessions GROUP BY day
+        UNION ALL
+        SELECT day, 'entry', pages[1]::text, COUNT(*), COUNT(*) FILTER (WHERE hits = 1),
+               SUM(pageviews)::bigint, SUM(duration)::float8
+        FROM sessions GROUP BY day, pages[1]
+        UNION ALL
+        SELECT day, 'exit', pages[array_length(pages, 1)]::text, COUNT(*), COUNT(*) FILTER (WHERE hits = 1),
+               SUM(pageviews)::bigint, SUM(duration)::float8
+        FROM sessions GROUP BY day, pages[array_length(pages, 1)]
+        UNION ALL
+        SELECT day, 'path', array_to_string(pages[1:%(path_length)s], '{PATH_SEPARATOR}'), COUNT(*),
+               COUNT(*) FILTER (WHERE hits = 1), SUM(pageviews)::bigint, SUM(duration)::float8
+        FROM sessions GROUP BY day, pages[1:%(path_length)s]
+    ) AS grouped
+) AS ranked
+WHERE kind = 'total' OR rank <= %(keys)s
+"""
+
+SUMMARY_FIELDS = ('day', 'kind', 'key', 'sessions', 'bounces', 'pageviews', 'duration')
+
+
+def summary_rows(ranges, keys=SESSION_SUMMARY_KEYS):
+    """
+    Строки сводки сессий (SUMMARY_FIELDS) по хитам интервалов ranges [(start, end)].
+    Сессии делятся на границах суток UTC и обрезаются на краях интервалов.
+    """
+    if not ranges:
+        return []
+
+    params = {'timeout': timedelta(seconds=SESSION_TIMEOUT), 'path_length': SESSION_PATH_LENGTH, 'keys': keys}
+    conditions = []
+    for number, (start, end) in enumerate(ranges):
+        conditions.append(f"(stat.created_at >= %(start{number})s AND stat.created_at < %(end{number})s)")
+        params[f'start{number}'], params[f'end{number}'] = start, end
+
+    with connection.cursor() as cursor:
+        cursor.execute(SUMMARY_SQL.format(ranges=' OR '.join(conditions)), params)
+        return cursor.fetchall()
+
+
+def day_ranges(days):
+    """Смежные сутки UTC одним интервалом: [(начало первых суток, конец последних)]."""
+    ranges = []
+    for day in sorted(days):
+        start = datetime.combine(day, datetime.min.time(), tzinfo=dt_timezone.utc)
+        if ranges and ranges[-1][1] == start:
+            ranges[-1] = (ranges[-1][0], start + timedelta(days=1))
+        else:
+            ranges.append((start, start + timedelta(days=1)))
+    return ranges
+
+
+def summarize_days(days):
+    """Пересчитывает сводку сессий за сутки days в одной транзакции. Сутки без сессий получают нулевые итоги."""
+    with transaction.atomic():
+        TrafficSessionSummary.objects.filter(day__in=days).delete()
+        rows = [TrafficSessionSummary(**dict(zip(SUMMARY_FIELDS, row))) for row in summary_rows(day_ranges(days))]
+        summarized = {row.day for row in rows}
+        rows += [TrafficSessionSummary(day=day, kind='total') for day in days if day not in summarized]
+        TrafficSessionSummary.objects.bulk_create(rows)
+
+
+def update_session_summaries(settle_seconds=ROLLUP_SETTLE_SECONDS, chunk_days=7):
+    """
+    Сводит сессии закрытых суток UTC: новых (после последних сведённых) и тех, куда с прошлого запуска дописаны
+    хиты (id выше отметки sessions: спул или буфер догрузил хвост). Сутки пересчитываются целиком порциями
+    по chunk_days, отметка сдвигается после всех порций. Возвращает количество пересчитанных суток.
+    """
+    settled_before = timezone.now() - timedelta(seconds=settle_seconds)
+    closed_until = utc_midnight(settled_before)
+    high_id = settled_high_id(SESSIONS_STATE, settle_seconds)
+
+    state, _ = TrafficRollupState.objects.get_or_create(name=SESSIONS_STATE)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            SELECT DISTINCT (created_at AT TIME ZONE 'UTC')::date FROM {TrafficStat._meta.db_table}
+            WHERE id > %s AND id <= %s AND created_at < %s
+            """,
+            [state.last_traffic_stat_id, high_id, closed_until],
+        )
+        days = {day for day, in cursor.fetchall()}
+
+    last_day = (
+        TrafficSessionSummary.objects.filter(kind='total').order_by('-day').values_list('day', flat=True).first()
+    )
+    if last_day is not None:
+        day = last_day + timedelta(days=1)
+        while day < closed_until.date():
+            days.add(day)
+            day += timedelta(days=1)
+
+    days = sorted(days)
+    for first in range(0, len(days), chunk_days):
+        summarize_days(days[first:first + chunk_days])
+
+    TrafficRollupState.objects.filter(name=SESSIONS_STATE).update(
+        last_traffic_stat_id=high_id, updated_at=timezone.now()
+    )
+    return len(days)
+
+
+def rebuild_session_summaries(settle_seconds=ROLLUP_SETTLE_SECONDS):
+    with transaction.atomic():
+        TrafficSessionSummary.objects.all().delete()
+        TrafficRollupState.objects.filter(name=SESSIONS_STATE).delete()
+    return update_session_summaries(settle_seconds=settle_seconds)
+
+
+def describe_path(key, urls):
+    return [urls.get(int(url_id)) for url_id in key.split(PATH_SEPARATOR)]
+
+
+def session_stats(start, end, limit=10):
+    """
+    Сессии за [start, end): число, доля отказов, средняя длительность (секунды), просмотров на сессию,
+    частые страницы входа и выхода с долей отказов, частые начальные пути и итоги по суткам UTC.
+    Сведённые сутки читаются из TrafficSessionSummary, края интервала и ещё не сведённые сутки
+    (текущие, до запуска traffic_rollup) строятся по TrafficStat тем же запросом.
+    """
+    full_start, full_end = utc_midnight(start, ceil=True), utc_midnight(end)
+    if not getattr(settings, 'TRAFFIC_USE_ROLLUPS', True) or full_start >= full_end:
+        full_start = full_end = end
+
+    rows = [
+        tuple(row) for row in TrafficSessionSummary.objects
+        .filter(day__gte=full_start.date(), day__lt=full_end.date())
+        .values_list(*SUMMARY_FIELDS)
+    ]
+    summarized = {row[0] for row in rows if row[1] == 'total'}
+    missing = set()
+    day = full_start.date()
+    while day < full_end.date():
+        if day not in summarized:
+            missing.add(day)
+        day += timedelta(days=1)
+
+    raw_ranges = [(start, full_start)] if start < full_start else []
+    raw_ranges += day_ranges(missing)
+    if full_end < end:
+        raw_ranges.append((full_end, end))
+    rows += summary_rows(raw_ranges)
+
+    totals = defaultdict(lambda: [0, 0, 0, 0.0])
+    keyed = defaultdict(lambda: defaultdict(lambda: [0, 0]))
+    for day, kind, key, sessions, bounces, pageviews, duration in rows:
+        if kind == 'total':
+            values = totals[day]
+            values[0] += sessions
+            values[1] += bounces
+            values[2] += pageviews
+            values[3] += duration
+        else:
+            keyed[kind][key][0] += sessions
+            keyed[kind][key][1] += bounces
+
+    top = {
+        kind: sorted(counts.items(), key=lambda item: (-item[1][0], item[0]))[:limit]
+        for kind, counts in keyed.items()
+    }
+    url_ids = {
+        int(url_id) for items in top.values() for key, _ in items for url_id in key.split(PATH_SEPARATOR)
+    }
+    urls = dict(UrlPath.objects.filter(pk__in=url_ids).values_list('pk', 'value'))
+
+    def rates(sessions, bounces, pageviews, duration):
+        return {
+            'sessions': sessions,
+            'bounce_rate': bounces / sessions if sessions else 0.0,
+            'avg_duration': duration / sessions if sessions else 0.0,
+            'pageviews_per_session': pageviews / sessions if sessions else 0.0,
+        }
+
+    return {
+        **rates(*(sum(values[i] for values in totals.values()) for i in range(4))),
+        'entry_pages': [
+            {'url': urls.get(int(key)), 'sessions': sessions, 'bounce_rate': bounces / sessions}
+            for key, (sessions, bounces) in top.get('entry', [])
+        ],
+        'exit_pages': [
+            {'url': urls.get(int(key)), 'sessions': sessions} for key, (sessions, _) in top.get('exit', [])
+        ],
+        'paths': [
+            {'pages': describe_path(key, urls), 'sessions': sessions} for key, (sessions, _) in top.get('path', [])
+        ],
+        'days': [{'day': day.isoformat(), **rates(*values)} for day, values in sorted(totals.items()) if values[0]],
+    }
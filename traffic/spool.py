@@ -0,0 +1,331 @@
+import atexit
+import glob
+import io
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .caching import invalidate_late_hits
+from .dictionaries import get_dictionary_cache
+from .models import TrafficIngestBatch, TrafficStat, UrlPath, UserAgent
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SPOOL_SETTINGS = {
+    'ENABLED': False,
+    'DIR': None,
+    # Открытый сегмент закрывается и передаётся воркеру по истечении SEGMENT_SECONDS или при достижении SEGMENT_BYTES
+    'SEGMENT_SECONDS': 1.0,
+    'SEGMENT_BYTES': 4 * 1024 * 1024,
+    # Сколько хранить записи о загруженных сегментах для дедупликации повторной загрузки
+    'DEDUP_RETENTION_DAYS': 7,
+}
+
+ACTIVE = 'active'
+READY = 'ready'
+SEGMENT_SUFFIX = '.seg'
+
+# Порядок полей записи в сегменте: запись - JSON-массив, без повторения имён полей в каждой строке.
+# Новые поля добавляются только в конец: в записях старых сегментов их просто нет
+RECORD_FIELDS = (
+    'created_at', 'ip_address', 'user_id', 'session_id', 'weight', 'url', 'user_agent', 'event', 'properties',
+)
+COPY_COLUMNS = (
+    'created_at', 'ip_address', 'user_id', 'session_id', 'weight', 'url_id', 'user_agent_id', 'event', 'properties',
+)
+
+
+def get_spool_settings():
+    return {**DEFAULT_SPOOL_SETTINGS, **getattr(settings, 'TRAFFIC_SPOOL', {})}
+
+
+def encode_record(hit):
+    values = [hit.get(field) for field in RECORD_FIELDS]
+    values[0] = hit['created_at'].timestamp()
+    return (json.dumps(values, ensure_ascii=False, separators=(',', ':')) + '\n').encode()
+
+
+def decode_record(line):
+    hit = dict(zip(RECORD_FIELDS, json.loads(line)))
+    hit['created_at'] = datetime.fromtimestamp(hit['created_at'], tz=dt_timezone.utc)
+    return hit
+
+
+class SpoolWriter:
+    """
+    Локальный спул хитов: запись добавляется в конец открытого сегмента процесса одним write(O_APPEND),
+    без обращения к БД. Готовые сегменты атомарно переносятся из active/ в ready/, откуда их забирает
+    один воркер traffic_ingest на хост. Фоновый поток закрывает сегмент по времени, чтобы хиты
+    не задерживались в простаивающем воркере.
+    """
+
+    def __init__(self, directory, segment_seconds=1.0, segment_bytes=4 * 1024 * 1024):
+        self.directory = directory
+        self.segment_seconds = segment_seconds
+        self.segment_bytes = segment_bytes
+
+        self._lock = threading.Lock()
+        self._fd = None
+        self._name = None
+        self._size = 0
+        self._opened_at = 0.0
+        self._thread = None
+        self._pid = None
+
+    def _ensure_started(self):
+        # После fork дескриптор и поток родителя принадлежат другому процессу
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._fd = None
+            os.makedirs(os.path.join(self.directory, ACTIVE), exist_ok=True)
+            os.makedirs(os.path.join(self.directory, READY), exist_ok=True)
+            self._thread = threading.Thread(target=self._run, name='traffic-spool-rotator', daemon=True)
+            self._thread.start()
+
+    def append(self, hit):
+        self.extend([hit])
+
+    def extend(self, hits):
+        """Дописывает пачку хитов одним write: записи пачки не перемежаются с записями других потоков."""
+        record = b''.join(encode_record(hit) for hit in hits)
+        with self._lock:
+            self._ensure_started()
+            if self._fd is None:
+                self._open()
+            os.write(self._fd, record)
+            self._size += len(record)
+            if self._size >= self.segment_bytes:
+                self._seal()
+
+    def _open(self):
+        # Имя сегмента уникально и служит ключом дедупликации при загрузке
+        self._name = f'{socket.gethostname()}-{os.getpid()}-{time.time_ns()}{SEGMENT_SUFFIX}'
+        self._fd = os.open(
+            os.path.join(self.directory, ACTIVE, self._name), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644
+        )
+        self._size = 0
+        self._opened_at = time.monotonic()
+
+    def _seal(self):
+        os.close(self._fd)
+        self._fd = None
+        os.rename(os.path.join(self.directory, ACTIVE, self._name), os.path.join(self.directory, READY, self._name))
+
+    def _run(self):
+        pid = os.getpid()
+        while self._pid == pid:
+            time.sleep(self.segment_seconds / 2)
+            with self._lock:
+                if self._fd is not None and time.monotonic() - self._opened_at >= self.segment_seconds:
+                    try:
+                        self._seal()
+                    except OSError:
+                        logger.exception("Не удалось закрыть сегмент спула %s", self._name)
+
+    def close(self):
+        """Передаёт открытый сегмент воркеру. Вызывается при завершении процесса."""
+        with self._lock:
+            if self._fd is not None and self._pid == os.getpid():
+                self._seal()
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_spool():
+    """Возвращает спул текущего процесса или None, если спул выключен в TRAFFIC_SPOOL."""
+    global _writer
+
+    spool_settings = get_spool_settings()
+    if not spool_settings['ENABLED']:
+        return None
+
+    with _writer_lock:
+        if _writer is None:
+            _writer = SpoolWriter(
+                spool_settings['DIR'],
+                segment_seconds=spool_settings['SEGMENT_SECONDS'],
+                segment_bytes=spool_settings['SEGMENT_BYTES'],
+            )
+            atexit.register(_writer.close)
+
+    return _writer
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def recover_orphaned_segments(directory):
+    """Переносит в ready/ открытые сегменты процессов этого хоста, завершившихся без close()."""
+    hostname = socket.gethostname()
+    for path in glob.glob(os.path.join(directory, ACTIVE, f'*{SEGMENT_SUFFIX}')):
+        name = os.path.basename(path)
+        host, pid, _ = name[:-len(SEGMENT_SUFFIX)].rsplit('-', 2)
+        if host == hostname and not pid_alive(int(pid)):
+            try:
+                os.rename(path, os.path.join(directory, READY, name))
+            except OSError:
+                continue
+            logger.warning("Сегмент спула %s завершившегося процесса передан на загрузку", name)
+
+
+def ready_segments(directory):
+    paths = glob.glob(os.path.join(directory, READY, f'*{SEGMENT_SUFFIX}'))
+    return sorted(paths, key=os.path.getmtime)
+
+
+def read_segment(path):
+    hits = []
+    with open(path, 'rb') as segment:
+        for number, line in enumerate(segment, 1):
+            try:
+                hits.append(decode_record(line))
+            except (ValueError, TypeError):
+                # Обрезанная последняя строка при аварийном завершении писателя
+                logger.warning("Пропущена повреждённая запись %s:%s", path, number)
+    return hits
+
+
+def copy_value(value):
+    """Значение поля в формате CSV для COPY: NULL - пустое поле без кавычек, строки всегда в кавычках."""
+    if value is None:
+        return ''
+    if isinstance(value, int):
+        return str(value)
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    elif isinstance(value, (dict, list)):
+        value = json.dumps(value, ensure_ascii=False)
+    return '"' + str(value).replace('\x00', '').replace('"', '""') + '"'
+
+
+def copy_hits(hits):
+    """Загружает хиты одним COPY. Строки User-Agent и пути переводятся в id справочников пакетно."""
+    url_ids = get_dictionary_cache(UrlPath).get_ids(hit['url'] for hit in hits)
+    user_agent_ids = get_dictionary_cache(UserAgent).get_ids(hit['user_agent'] for hit in hits)
+
+    data = io.StringIO()
+    for hit in hits:
+        row = {**hit, 'url_id': url_ids.get(hit['url']), 'user_agent_id': user_agent_ids.get(hit['user_agent'])}
+        data.write(','.join(copy_value(row.get(column)) for column in COPY_COLUMNS) + '\n')
+    data.seek(0)
+
+    with connection.cursor() as cursor:
+        cursor.copy_expert(
+            f"COPY {TrafficStat._meta.db_table} ({', '.join(COPY_COLUMNS)}) FROM STDIN WITH (FORMAT csv)", data
+        )
+
+
+def ingest_segments(paths):
+    """
+    Загружает сегменты одним COPY в одной транзакции и удаляет файлы.
+    Возвращает (число загруженных хитов, число пропущенных сегментов).
+    Доставка не реже одного раза: файлы удаляются только после фиксации транзакции,
+    а повторная загрузка после сбоя отсекается уникальным именем сегмента в TrafficIngestBatch.
+    """
+    segments = {}
+    for path in paths:
+        spooled_at = datetime.fromtimestamp(os.path.getmtime(path), tz=dt_timezone.utc)
+        segments[os.path.basename(path)] = (path, spooled_at, read_segment(path))
+
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO {TrafficIngestBatch._meta.db_table}
+                    (name, records, first_created_at, spooled_at, ingested_at)
+                SELECT segment.*, NOW()
+                FROM UNNEST(%s::varchar[], %s::integer[], %s::timestamptz[], %s::timestamptz[]) AS segment
+                ON CONFLICT (name) DO NOTHING
+                RETURNING name
+                """,
+                [
+                    list(segments),
+                    [len(hits) for _, _, hits in segments.values()],
+                    [min((hit['created_at'] for hit in hits), default=None) for _, _, hits in segments.values()],
+                    [spooled_at for _, spooled_at, _ in segments.values()],
+                ],
+            )
+            inserted = {name for name, in cursor.fetchall()}
+        hits = [hit for name in inserted for hit in segments[name][2]]
+        if hits:
+            copy_hits(hits)
+            transaction.on_commit(lambda: invalidate_late_hits(min(hit['created_at'] for hit in hits)))
+
+    for path, _, _ in segments.values():
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    skipped = len(segments) - len(inserted)
+    if skipped:
+        logger.info("Пропущено уже загруженных сегментов спула: %s", skipped)
+    return len(hits), skipped
+
+
+def ingest_ready(directory, max_records=50000):
+    """Загружает все готовые сегменты пакетами примерно по max_records хитов. Возвращает число загруженных хитов."""
+    recover_orphaned_segments(directory)
+
+    ingested, batch, batch_size = 0, [], 0
+    for path in ready_segments(directory):
+        batch.append(path)
+        # Оценка числа записей по размеру файла, без чтения сегмента
+        batch_size += max(1, os.path.getsize(path) // 200)
+        if batch_size >= max_records:
+            ingested += ingest_segments(batch)[0]
+            batch, batch_size = [], 0
+    if batch:
+        ingested += ingest_segments(batch)[0]
+    return ingested
+
+
+def expire_ingest_batches(retention_days):
+    expired_before = timezone.now() - timedelta(days=retention_days)
+    return TrafficIngestBatch.objects.filter(ingested_at__lt=expired_before).delete()[0]
+
+
+def spool_status(directory):
+    """
+    Метрики отставания загрузки: число и объём ожидающих сегментов, возраст самого старого из них (секунды),
+    время последней загрузки и задержка самого старого хита последнего сегмента от записи до загрузки.
+    """
+    paths = ready_segments(directory) + glob.glob(os.path.join(directory, ACTIVE, f'*{SEGMENT_SUFFIX}'))
+    now = time.time()
+    sizes, ages = [], []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        sizes.append(stat.st_size)
+        ages.append(now - stat.st_mtime)
+
+    last_batch = TrafficIngestBatch.objects.order_by('-ingested_at', '-id').first()
+    return {
+        'pending_segments': len(sizes),
+        'pending_bytes': sum(sizes),
+        'oldest_pending_age': max(ages, default=0.0),
+        'last_ingested_at': last_batch.ingested_at if last_batch else None,
+        'last_batch_lag': (
+            (last_batch.ingested_at - last_batch.first_created_at).total_seconds()
+            if last_batch and last_batch.first_created_at else None
+        ),
+    }
@@ -0,0 +1,76 @@
+// Маяк клиентских событий: trafficEvents.track("signup", {plan: "pro"}).
+// События копятся в очереди и уходят пачкой в POST /api/traffic/events/ по достижении maxBatch,
+// раз в flushInterval миллисекунд и при уходе со страницы (pagehide, скрытие вкладки).
+// Настройки - data-атрибуты тега script: data-endpoint, data-max-batch, data-flush-interval.
+(function () {
+    const script = document.currentScript;
+    const options = {
+        endpoint: (script && script.dataset.endpoint) || "/api/traffic/events/",
+        maxBatch: Number(script && script.dataset.maxBatch) || 20,
+        flushInterval: Number(script && script.dataset.flushInterval) || 5000,
+    };
+    // Ограничение браузера на объём данных sendBeacon в полёте - 64 КБ
+    const MAX_PAYLOAD_BYTES = 60000;
+
+    let queue = [];
+    let timer = null;
+
+    function send(events) {
+        const sentAt = Date.now();
+        const body = JSON.stringify({
+            events: events.map(event => ({
+                name: event.name,
+                url: event.url,
+                properties: event.properties,
+                age_ms: sentAt - event.time,
+            })),
+        });
+
+        if (events.length > 1 && new Blob([body]).size > MAX_PAYLOAD_BYTES) {
+            const half = Math.ceil(events.length / 2);
+            send(events.slice(0, half));
+            send(events.slice(half));
+            return;
+        }
+
+        // text/plain не требует предварительного CORS-запроса, сервер разбирает тело как JSON
+        const blob = new Blob([body], {type: "text/plain;charset=UTF-8"});
+        if (navigator.sendBeacon && navigator.sendBeacon(options.endpoint, blob)) {
+            return;
+        }
+        fetch(options.endpoint, {method: "POST", body: blob, keepalive: true, credentials: "same-origin"})
+            .catch(() => {});
+    }
+
+    function flush() {
+        clearTimeout(timer);
+        timer = null;
+        if (!queue.length) {
+            return;
+        }
+        const events = queue;
+        queue = [];
+        for (let i = 0; i < events.length; i += options.maxBatch) {
+            send(events.slice(i, i + options.maxBatch));
+        }
+    }
+
+    function track(name, properties) {
+        queue.push({name: name, url: window.location.pathname, properties: properties || null, time: Date.now()});
+        if (queue.length >= options.maxBatch) {
+            flush();
+        } else if (timer === null) {
+            timer = setTimeout(flush, options.flushInterval);
+        }
+    }
+
+    // pagehide срабатывает и при переходе в bfcache, где unload не вызывается
+    window.addEventListener("pagehide", flush);
+    document.addEventListener("visibilitychange", () => {
+        if (document.visibilityState === "hidden") {
+            flush();
+        }
+    });
+
+    window.trafficEvents = {track: track, flush: flush};
+})();
@@ -1,6 +1,9 @@
 document.addEventListener("DOMContentLoaded", function () {
     const ctx = document.getElementById("trafficChart").getContext("2d");
     let trafficChart;
+    // Отображаемый период и ряды графика: живая лента обновляет их на месте, без повторного запроса периода
+    let displayed = null;
+    let chartSeries = null;
     const periodSelect = document.getElementById("timePeriod");
     const dateInput = document.getElementById("dateInput");
     const showStatsBtn = document.getElementById("showStatsBtn");
@@ -115,11 +118,14 @@ document.addEventListener("DOMContentLoaded", function () {
             return;
         }
 
+        displayed = {period: period, selectedDate: selectedDate || formatDate(period)};
+
         const url = getApiUrl(period, selectedDate);
         fetch(url)
             .then(response => response.json())
             .then(data => {
                 if (data.error) {
+                    chartSeries = null;
                     showError(data.error);
                     return;
                 }
@@ -247,6 +253,8 @@ document.addEventListener("DOMContentLoaded", function () {
             trafficChart.destroy();
         }
 
+        chartSeries = {totalRequests, uniqueUsers, uniqueRegisteredUsers, uniqueGuests};
+
         trafficChart = new Chart(ctx, {
             type: "line",
             data: {
@@ -318,6 +326,74 @@ document.addEventListener("DOMContentLoaded", function () {
         }
     }
 
+    function getLiveBucket(period, selectedDate, buckets) {
+        if (period === "day") {
+            const bucket = buckets.hour;
+            if (bucket.start.slice(0, 10) === selectedDate) {
+                return {index: parseInt(bucket.start.slice(11, 13), 10), bucket};
+            }
+        } else if (period === "week") {
+            const bucket = buckets.day;
+            const [year, month, day] = bucket.start.slice(0, 10).split("-").map(Number);
+            const date = new Date(year, month - 1, day);
+            const isoWeek = getISOWeek(date);
+            const [selectedYear, selectedWeek] = selectedDate.split("-").map(Number);
+            if (isoWeek.year === selectedYear && isoWeek.week === selectedWeek) {
+                return {index: (date.getDay() + 6) % 7, bucket};
+            }
+        } else if (period === "month") {
+            const bucket = buckets.day;
+            if (bucket.start.slice(0, 7) === selectedDate) {
+                return {index: parseInt(bucket.start.slice(8, 10), 10) - 1, bucket};
+            }
+        } else if (period === "year") {
+            const bucket = buckets.month;
+            if (bucket.start.slice(0, 4) === selectedDate) {
+                return {index: parseInt(bucket.start.slice(5, 7), 10) - 1, bucket};
+            }
+        }
+        return null;
+    }
+
+    function applyLiveHits(buckets) {
+        if (!displayed) {
+            return;
+        }
+
+        const live = getLiveBucket(displayed.period, displayed.selectedDate, buckets);
+        if (!live) {
+            return;
+        }
+
+        const {index, bucket} = live;
+        if (!trafficChart || !chartSeries) {
+            // Графика ещё нет (за период не было данных): первый хит - повод запросить период целиком
+            if (bucket.count > 0) {
+                fetchData(displayed.period, displayed.selectedDate);
+            }
+            return;
+        }
+
+        chartSeries.totalRequests[index] = bucket.count;
+        chartSeries.uniqueRegisteredUsers[index] = bucket.unique_registered_users;
+        chartSeries.uniqueGuests[index] = bucket.unique_guests;
+        chartSeries.uniqueUsers[index] = bucket.unique_registered_users + bucket.unique_guests;
+        trafficChart.update("none");
+    }
+
+    // Живая лента (SSE) есть только под ASGI, под WSGI текущий период перезапрашивается раз в pollInterval
+    const chartCanvas = document.getElementById("trafficChart");
+    if (chartCanvas.dataset.liveStream === "true" && window.EventSource) {
+        const liveSource = new EventSource("/api/traffic/live/");
+        liveSource.addEventListener("hits", event => applyLiveHits(JSON.parse(event.data)));
+    } else {
+        setInterval(() => {
+            if (displayed && !document.hidden && displayed.selectedDate === formatDate(displayed.period)) {
+                fetchData(displayed.period, displayed.selectedDate);
+            }
+        }, Number(chartCanvas.dataset.pollInterval) || 30000);
+    }
+
     const defaultPeriod = "day";
     periodSelect.value = defaultPeriod;
     updateDateInput(defaultPeriod);
@@ -0,0 +1,69 @@
+document.addEventListener("DOMContentLoaded", function () {
+    const onlineCount = document.getElementById("onlineUsersCount");
+
+    if (!onlineCount) {
+        return;
+    }
+
+    function setOnline(userId, isOnline) {
+        const row = document.querySelector(`tr[data-user-id="${userId}"]`);
+        if (!row) {
+            return;
+        }
+
+        const status = row.querySelector(".online-status");
+        status.innerHTML = isOnline
+            ? '<span style="color: green;">✔</span>'
+            : '<span style="color: red;">✘</span>';
+
+        if (!isOnline) {
+            status.nextElementSibling.textContent = "-";
+        }
+    }
+
+    // Живая лента (SSE) есть только под ASGI, под WSGI таблица опрашивает active-users раз в pollInterval
+    if (onlineCount.dataset.liveStream !== "true" || !window.EventSource) {
+        setInterval(() => {
+            if (document.hidden) {
+                return;
+            }
+            fetch("/api/traffic/active-users/" + window.location.search)
+                .then(response => response.json())
+                .then(data => {
+                    if (data.error) {
+                        return;
+                    }
+                    onlineCount.textContent = data.online_users_count;
+                    data.registered_users.forEach(user => setOnline(user.id, user.is_online));
+                })
+                .catch(() => {});
+        }, Number(onlineCount.dataset.pollInterval) || 30000);
+        return;
+    }
+
+    const liveSource = new EventSource("/api/traffic/live/");
+
+    liveSource.addEventListener("online", event => {
+        onlineCount.textContent = JSON.parse(event.data).count;
+    });
+
+    // Первое событие presence после подключения содержит полный список онлайн, следующие - только изменения
+    let fullSnapshot = true;
+    liveSource.addEventListener("open", () => {
+        fullSnapshot = true;
+    });
+
+    liveSource.addEventListener("presence", event => {
+        const data = JSON.parse(event.data);
+        if (fullSnapshot) {
+            const online = new Set(data.online.map(String));
+            document.querySelectorAll("tr[data-user-id]").forEach(row => {
+                setOnline(row.dataset.userId, online.has(row.dataset.userId));
+            });
+            fullSnapshot = false;
+            return;
+        }
+        data.online.forEach(userId => setOnline(userId, true));
+        data.offline.forEach(userId => setOnline(userId, false));
+    });
+});
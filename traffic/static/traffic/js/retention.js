@@ -0,0 +1,84 @@
+// Таблица удержания на главной: матрица когорт из GET /api/traffic/retention/, строка - когорта,
+// столбец - номер периода после первого визита, в ячейке - доля вернувшихся пользователей.
+document.addEventListener("DOMContentLoaded", function () {
+    const table = document.getElementById("retentionTable");
+    const granularity = document.getElementById("retentionGranularity");
+    const statusLine = document.getElementById("retentionStatus");
+
+    if (!table || !granularity) {
+        return;
+    }
+
+    const periodLabels = {week: "Неделя", month: "Месяц"};
+    let request = null;
+
+    function cell(tag, text) {
+        const element = document.createElement(tag);
+        element.textContent = text;
+        return element;
+    }
+
+    function render(data) {
+        const head = table.tHead;
+        const body = table.tBodies[0];
+        head.replaceChildren();
+        body.replaceChildren();
+
+        const cohorts = data.cohorts;
+        if (!cohorts.some(cohort => cohort.users)) {
+            statusLine.textContent = "Нет данных о зарегистрированных пользователях";
+            statusLine.hidden = false;
+            return;
+        }
+        statusLine.hidden = true;
+
+        const headRow = head.insertRow();
+        headRow.append(cell("th", "Когорта"), cell("th", "Пользователей"));
+        for (let i = 0; i < cohorts[0].active.length; i++) {
+            headRow.append(cell("th", `${periodLabels[data.granularity]} ${i}`));
+        }
+
+        cohorts.forEach(cohort => {
+            const row = body.insertRow();
+            row.append(cell("td", cohort.period), cell("td", cohort.users));
+            cohort.retention.forEach((rate, i) => {
+                const td = cell("td", cohort.users ? `${(rate * 100).toFixed(1)}%` : "");
+                td.title = `${cohort.active[i]} из ${cohort.users}`;
+                if (cohort.users) {
+                    td.style.backgroundColor = `rgba(13, 110, 253, ${(0.1 + rate * 0.9).toFixed(2)})`;
+                }
+                row.append(td);
+            });
+        });
+    }
+
+    function load() {
+        if (request) {
+            request.abort();
+        }
+        request = new AbortController();
+        statusLine.textContent = "Загрузка...";
+        statusLine.hidden = false;
+
+        fetch(`/api/traffic/retention/?granularity=${granularity.value}`, {
+            credentials: "same-origin",
+            signal: request.signal,
+        })
+            .then(response => {
+                if (!response.ok) {
+                    throw new Error(response.statusText);
+                }
+                return response.json();
+            })
+            .then(render)
+            .catch(error => {
+                if (error.name !== "AbortError") {
+                    statusLine.textContent = "Не удалось загрузить удержание";
+                    statusLine.hidden = false;
+                }
+            });
+    }
+
+    granularity.addEventListener("change", load);
+    load();
+});
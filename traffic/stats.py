@@ -0,0 +1,112 @@
+from datetime import timedelta
+from zoneinfo import ZoneInfo
+
+from django.conf import settings
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import Trunc
+from django.utils import timezone
+
+from .models import TrafficStat
+from .rollups import (
+    period_stats, approximate_period_stats, fetch_series, series_params, BUCKETS_CTE, GRANULARITIES, SERIES_SELECT,
+)
+
+# Гранулярности по TrafficStat: минутные корзины почасовыми агрегатами не покрываются
+RAW_GRANULARITIES = ('minute', *GRANULARITIES)
+
+# Гранулярности эндпоинта временного ряда
+SERIES_GRANULARITIES = ('minute', 'hour', 'day', 'week', 'month')
+
+# Наименьшая длительность корзины - для оценки числа корзин до запроса
+MIN_BUCKET_DURATION = {
+    'minute': timedelta(minutes=1),
+    'hour': timedelta(hours=1),
+    'day': timedelta(days=1),
+    'week': timedelta(weeks=1),
+    'month': timedelta(days=28),
+    'year': timedelta(days=365),
+}
+
+
+def empty_period_stats():
+    return {"count": 0, "unique_registered_users": 0, "unique_guests": 0}
+
+
+def max_bucket_count(start, end, granularity):
+    """Верхняя оценка числа корзин в [start, end), с учётом неполных корзин на краях."""
+    return (end - start) // MIN_BUCKET_DURATION[granularity] + 2
+
+
+def raw_period_queryset(start, end, granularity, tz=None):
+    """
+    Агрегация raw_period_stats в виде QuerySet (без заполнения пустых корзин) - для планов traffic_explain:
+    число хитов с учётом весов выборочной записи, уникальные пользователи и уникальные IP гостей по каждой корзине.
+    """
+    if granularity not in RAW_GRANULARITIES:
+        raise ValueError(f"Неизвестная гранулярность: {granularity}")
+
+    return (
+        TrafficStat.objects
+        .filter(created_at__gte=start, created_at__lt=end)
+        .annotate(bucket=Trunc('created_at', granularity, tzinfo=ZoneInfo(tz) if tz else None))
+        .values('bucket')
+        .annotate(
+            count=Sum('weight'),
+            unique_registered_users=Count('user', distinct=True),
+            unique_guests=Count('ip_address', distinct=True, filter=Q(user__isnull=True)),
+        )
+        .order_by('bucket')
+    )
+
+
+def raw_period_stats(start, end, granularity, tz=None):
+    """Статистика за [start, end) напрямую по TrafficStat одним запросом, в формате rollups.period_stats."""
+    if granularity not in RAW_GRANULARITIES:
+        raise ValueError(f"Неизвестная гранулярность: {granularity}")
+
+    return fetch_series(
+        f"""
+        WITH stats AS (
+            SELECT date_trunc(%(granularity)s, created_at AT TIME ZONE %(tz)s) AS bucket,
+                   SUM(weight) AS hits,
+                   COUNT(DISTINCT user_id) AS registered_users,
+                   COUNT(DISTINCT ip_address) FILTER (WHERE user_id IS NULL) AS guests
+            FROM {TrafficStat._meta.db_table}
+            WHERE created_at >= %(start)s AND created_at < %(end)s
+            GROUP BY bucket
+        ),
+        {BUCKETS_CTE}
+        {SERIES_SELECT}
+        """,
+        series_params(start, end, granularity, tz),
+    )
+
+
+def rollups_cover(start, end, granularity, tz=None):
+    """
+    Почасовые агрегаты дают точный ответ, только если корзины складываются из целых часов UTC:
+    гранулярность не мельче часа, start и end - границы часа, смещение зоны от UTC - целое число часов.
+    """
+    if granularity not in GRANULARITIES:
+        return False
+
+    zone = ZoneInfo(tz) if tz else timezone.get_current_timezone()
+    return all(
+        not moment.timestamp() % 3600 and not moment.astimezone(zone).utcoffset() % timedelta(hours=1)
+        for moment in (start, end)
+    )
+
+
+def get_period_stats(start, end, granularity, tz=None, approximate=False):
+    """
+    Единая точка расчёта статистики за период для всех эндпоинтов: упорядоченный словарь со всеми корзинами
+    [start, end) в зоне tz, пустые корзины заполнены нулями в том же запросе.
+    approximate=True - уникальные значения по скетчам HyperLogLog почасовых агрегатов.
+    При TRAFFIC_USE_ROLLUPS = False (агрегатор traffic_rollup не запущен) и интервалах, которые агрегаты не покрывают
+    (rollups_cover), считает напрямую по TrafficStat, уникальные значения в этом случае всегда точные.
+    """
+    if getattr(settings, 'TRAFFIC_USE_ROLLUPS', True) and rollups_cover(start, end, granularity, tz):
+        if approximate:
+            return approximate_period_stats(start, end, granularity, tz)
+        return period_stats(start, end, granularity, tz)
+    return raw_period_stats(start, end, granularity, tz)
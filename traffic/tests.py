@@ -1,3 +1,1290 @@
-from django.test import TestCase
+import asyncio
+import csv
+import importlib
+import io
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from datetime import datetime, timedelta, timezone as dt_timezone
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.models import Session
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+from tracking.models import Visitor
+
+from .activity import update_user_activity
+from .benchmark import run_benchmark, seed
+from .breakdown import merge_top_keys, update_top_keys
+from .buffer import TrafficBuffer, get_buffer
+from .caching import invalidate_period_cache
+from .dictionaries import get_dictionary_cache, resolve_hit
+from .export import pyarrow
+from .hll import HyperLogLog, relative_error
+from .live import LiveFeed
+from .models import TrafficRollupState, TrafficStat, UrlPath, UserActivitySummary, UserAgent
+from .pagination import encode_cursor
+from .partitions import (
+    default_partition_rows, ensure_partitions, expire_partitions, list_partitions, next_interval_start, partition_name,
+)
+from .presence import MemoryPresenceBackend, PresenceTracker, get_presence_tracker
+from .rollups import HOURLY_ROLLUP_STATE, update_hourly_rollups
+from .rules import get_tracking_rules
+from .sessions import update_session_summaries
+from .spool import SpoolWriter, ingest_ready, ready_segments, spool_status
+from .useragents import parse_user_agent
+from .views import (
+    TrafficSeriesView, TrafficBreakdownView, TrafficSessionsView, TrafficFunnelView, TrafficRetentionView,
+    DailyTrafficStats, WeeklyTrafficStats, MonthlyTrafficStats, YearlyTrafficStats, ActiveUsersView,
+    UserRequestLogView, TrafficExportView,
+)
+
+User = get_user_model()
+
+
+@override_settings(TRAFFIC_STATS_CACHE={'ENABLED': False})
+class PeriodTrafficStatsQueriesTest(TestCase):
+    """Каждый эндпоинт статистики за период выполняет ровно один запрос независимо от числа корзин."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='tester', password='tester')
+        cls.other_user = User.objects.create_user(username='other', password='other')
+
+        start = timezone.make_aware(datetime(2025, 3, 1))
+        cls.root, about = UrlPath.objects.create(value='/'), UrlPath.objects.create(value='/about/')
+        hits = []
+        for day in range(31):
+            for hour in range(0, 24, 3):
+                created_at = start + timedelta(days=day, hours=hour)
+                hits += [
+                    TrafficStat(ip_address='10.0.0.1', user=cls.user, url=cls.root, created_at=created_at),
+                    TrafficStat(ip_address='10.0.0.2', user=cls.other_user, url=cls.root, created_at=created_at),
+                    TrafficStat(ip_address='10.0.0.3', url=cls.root, created_at=created_at),
+                    TrafficStat(ip_address='10.0.0.4', url=cls.root, created_at=created_at),
+                    TrafficStat(ip_address='10.0.0.4', url=about, created_at=created_at),
+                ]
+        TrafficStat.objects.bulk_create(hits)
+
+    def get(self, view_class, **params):
+        request = APIRequestFactory().get('/', params)
+        force_authenticate(request, user=self.user)
+        return async_to_sync(view_class.as_view())(request)
+
+    def assert_period_views(self):
+        cases = [
+            (DailyTrafficStats, {'date': '2025-03-10'}, 24),
+            (WeeklyTrafficStats, {'week': '2025-11'}, 7),
+            (MonthlyTrafficStats, {'month': '2025-03'}, 31),
+            (YearlyTrafficStats, {'year': '2025'}, 12),
+        ]
+        for view_class, params, buckets in cases:
+            with self.subTest(view=view_class.__name__):
+                with self.assertNumQueries(1):
+                    response = self.get(view_class, **params)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.data), buckets)
+
+    def test_rollup_source(self):
+        update_hourly_rollups(settle_seconds=0)
+        self.assert_period_views()
+
+    @override_settings(TRAFFIC_USE_ROLLUPS=False)
+    def test_raw_source(self):
+        self.assert_period_views()
+
+    def test_unique_counts(self):
+        update_hourly_rollups(settle_seconds=0)
+        TrafficStat.objects.create(
+            ip_address='10.0.0.5', url=self.root, created_at=timezone.make_aware(datetime(2025, 3, 10, 3, 30))
+        )
+
+        for use_rollups in (True, False):
+            with self.subTest(use_rollups=use_rollups), self.settings(TRAFFIC_USE_ROLLUPS=use_rollups):
+                hour = self.get(DailyTrafficStats, date='2025-03-10').data[3]
+                self.assertEqual(hour['count'], 6)
+                self.assertEqual(hour['unique_registered_users'], 2)
+                self.assertEqual(hour['unique_guests'], 3)
+
+                month = self.get(YearlyTrafficStats, year='2025').data[2]
+                self.assertEqual(month['count'], 31 * 8 * 5 + 1)
+                self.assertEqual(month['unique_registered_users'], 2)
+                self.assertEqual(month['unique_guests'], 3)
+
+    def test_approximate_uniques(self):
+        update_hourly_rollups(settle_seconds=0)
+        TrafficStat.objects.create(
+            ip_address='10.0.0.5', url=self.root, created_at=timezone.make_aware(datetime(2025, 3, 10, 3, 30))
+        )
+
+        with self.assertNumQueries(1):
+            month = self.get(YearlyTrafficStats, year='2025', uniques='approximate').data[2]
+        self.assertEqual(month['count'], 31 * 8 * 5 + 1)
+        self.assertEqual(month['unique_registered_users'], 2)
+        self.assertEqual(month['unique_guests'], 3)
+
+        response = self.get(YearlyTrafficStats, year='2025', uniques='fast')
+        self.assertEqual(response.status_code, 400)
+
+    def test_weighted_counts(self):
+        update_hourly_rollups(settle_seconds=0)
+        TrafficStat.objects.create(
+            ip_address='10.0.0.5', weight=100, created_at=timezone.make_aware(datetime(2025, 3, 10, 3, 30))
+        )
+
+        for use_rollups in (True, False):
+            with self.subTest(use_rollups=use_rollups), self.settings(TRAFFIC_USE_ROLLUPS=use_rollups):
+                self.assertEqual(self.get(DailyTrafficStats, date='2025-03-10').data[3]['count'], 5 + 100)
+        update_hourly_rollups(settle_seconds=0)
+        self.assertEqual(self.get(DailyTrafficStats, date='2025-03-10').data[3]['count'], 5 + 100)
+
+    def test_out_of_order_commit(self):
+        update_hourly_rollups(settle_seconds=0)
+        created_at = timezone.make_aware(datetime(2025, 3, 10, 3, 30))
+
+        # Отдельная транзакция получает меньший id и фиксируется после строки с большим id
+        other = connection.copy()
+        self.addCleanup(other.close)
+        other.set_autocommit(False)
+        with other.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {TrafficStat._meta.db_table} (ip_address, created_at, weight) VALUES (%s, %s, 1) "
+                f"RETURNING id",
+                ['10.0.0.6', created_at],
+            )
+            other_id = cursor.fetchone()[0]
+        TrafficStat.objects.create(ip_address='10.0.0.5', created_at=created_at)
+
+        self.assertEqual(update_hourly_rollups(settle_seconds=0), 0)
+        other.commit()
+
+        def delete_committed():
+            with other.cursor() as cursor:
+                cursor.execute(f"DELETE FROM {TrafficStat._meta.db_table} WHERE id = %s", [other_id])
+            other.commit()
+
+        self.addCleanup(delete_committed)
+        self.assertEqual(update_hourly_rollups(settle_seconds=0), 2)
+        self.assertEqual(self.get(DailyTrafficStats, date='2025-03-10').data[3]['count'], 5 + 2)
+
+    def test_fresh_install_under_load(self):
+        # Пишущие транзакции не прекращаются: каждый запуск застаёт новую, но отметка всё равно сдвигается
+        total = TrafficStat.objects.count()
+        processed = []
+        for _ in range(3):
+            other = connection.copy()
+            other.set_autocommit(False)
+            with other.cursor() as cursor:
+                cursor.execute("SELECT pg_current_xact_id()")
+            processed.append(update_hourly_rollups(settle_seconds=0))
+            other.rollback()
+            other.close()
+
+        self.assertEqual(processed[0], 0)
+        self.assertTrue(TrafficRollupState.objects.filter(name=HOURLY_ROLLUP_STATE).exists())
+        self.assertEqual(sum(processed), total)
+
+    def test_no_data(self):
+        response = self.get(DailyTrafficStats, date='2024-01-01')
+        self.assertEqual(response.status_code, 404)
+
+    def test_invalid_period(self):
+        response = self.get(MonthlyTrafficStats, month='2025-13')
+        self.assertEqual(response.status_code, 400)
+
+    def test_series(self):
+        update_hourly_rollups(settle_seconds=0)
+
+        for use_rollups in (True, False):
+            with self.subTest(use_rollups=use_rollups), self.settings(TRAFFIC_USE_ROLLUPS=use_rollups):
+                with self.assertNumQueries(1):
+                    hours = self.get(
+                        TrafficSeriesView, start='2025-03-10', end='2025-03-11', granularity='hour', tz='UTC'
+                    ).data['series']
+                self.assertEqual(len(hours), 24)
+                # Хиты пишутся каждые 3 часа по Asia/Tomsk (UTC+7)
+                self.assertEqual(hours[2]['bucket'], '2025-03-10T02:00:00+00:00')
+                self.assertEqual([hour['count'] for hour in hours[2:6]], [5, 0, 0, 5])
+
+                # Смещение +05:30 агрегаты не покрывают, ряд считается по TrafficStat; неделя начинается 24 февраля
+                weeks = self.get(
+                    TrafficSeriesView, start='2025-03-01', end='2025-04-01', granularity='week', tz='Asia/Kolkata'
+                ).data['series']
+                self.assertEqual([week['bucket'][:10] for week in weeks],
+                                 ['2025-02-24', '2025-03-03', '2025-03-10', '2025-03-17', '2025-03-24', '2025-03-31'])
+                self.assertEqual(sum(week['count'] for week in weeks), (31 * 8 - 1) * 5)
+
+                minutes = self.get(
+                    TrafficSeriesView, start='2025-03-10T03:00', end='2025-03-10T03:05', granularity='minute'
+                ).data['series']
+                self.assertEqual([minute['count'] for minute in minutes], [5, 0, 0, 0, 0])
+
+    def test_invalid_series(self):
+        cases = [
+            {'end': '2025-03-02'},
+            {'start': '2025-03-01', 'end': '2025-03-02', 'granularity': 'second'},
+            {'start': '2025-03-01', 'end': '2025-03-02', 'tz': 'Mars/Olympus'},
+            {'start': '2025-03-02', 'end': '2025-03-01'},
+            {'start': '01.03.2025', 'end': '2025-03-02'},
+            {'start': '2025-01-01', 'end': '2026-01-01', 'granularity': 'minute'},
+        ]
+        for params in cases:
+            with self.subTest(**params):
+                self.assertEqual(self.get(TrafficSeriesView, **params).status_code, 400)
+
+
+class PeriodTrafficStatsCacheTest(TestCase):
+    """Закрытый период вычисляется один раз, повторный запрос с ETag получает 304."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='tester', password='tester')
+        TrafficStat.objects.create(ip_address='10.0.0.1', created_at=timezone.make_aware(datetime(2025, 3, 10, 12)))
+
+    def setUp(self):
+        invalidate_period_cache()
+
+    def get(self, view_class, headers=None, **params):
+        request = APIRequestFactory().get('/', params, headers=headers)
+        force_authenticate(request, user=self.user)
+        return async_to_sync(view_class.as_view())(request)
+
+    def test_closed_period_cached(self):
+        with self.assertNumQueries(1):
+            first = self.get(MonthlyTrafficStats, month='2025-03')
+        with self.assertNumQueries(0):
+            second = self.get(MonthlyTrafficStats, month='2025-03')
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(first['ETag'], second['ETag'])
+        self.assertEqual(self.get(MonthlyTrafficStats, month='2025-03', uniques='approximate').status_code, 200)
+
+        not_modified = self.get(MonthlyTrafficStats, headers={'If-None-Match': first['ETag']}, month='2025-03')
+        self.assertEqual(not_modified.status_code, 304)
+
+        invalidate_period_cache()
+        with self.assertNumQueries(1):
+            self.get(MonthlyTrafficStats, month='2025-03')
+
+    def test_late_hits_invalidate(self):
+        update_hourly_rollups(settle_seconds=0)
+        cached = self.get(MonthlyTrafficStats, month='2025-03').data[9]['count']
+
+        # Свежий хит закрытые периоды не затрагивает
+        TrafficStat.objects.create(ip_address='10.0.0.1', created_at=timezone.now())
+        update_hourly_rollups(settle_seconds=0)
+        with self.assertNumQueries(0):
+            self.get(MonthlyTrafficStats, month='2025-03')
+
+        # Хит из спула после простоя попадает в закрытый месяц
+        TrafficStat.objects.create(ip_address='10.0.0.2', created_at=timezone.make_aware(datetime(2025, 3, 10, 13)))
+        update_hourly_rollups(settle_seconds=0)
+        self.assertEqual(self.get(MonthlyTrafficStats, month='2025-03').data[9]['count'], cached + 1)
+
+
+@override_settings(TRAFFIC_STATS_CACHE={'ENABLED': False})
+class TrafficBreakdownTest(TestCase):
+    """Топ по суточным сводкам совпадает с точным подсчётом по TrafficStat, включая края интервала и хвост."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='tester', password='tester')
+        user_agents = get_dictionary_cache(UserAgent)
+        chrome = user_agents.get_id('Mozilla/5.0 (Windows NT 10.0; Win64; x64) Chrome/120.0 Safari/537.36')
+        firefox = user_agents.get_id('Mozilla/5.0 (X11; Linux x86_64; rv:120.0) Gecko/20100101 Firefox/120.0')
+        cls.root, cls.about = UrlPath.objects.create(value='/'), UrlPath.objects.create(value='/about/')
+
+        hits = []
+        for day in range(5):
+            created_at = datetime(2025, 3, 1 + day, 6, tzinfo=dt_timezone.utc)
+            hits += [
+                TrafficStat(ip_address='10.0.0.1', user=cls.user, url=cls.root, user_agent_id=chrome,
+                            created_at=created_at),
+                TrafficStat(ip_address='10.0.0.2', url=cls.about, user_agent_id=firefox, created_at=created_at),
+                TrafficStat(ip_address='10.0.0.3', url=cls.about, user_agent_id=firefox, event='signup',
+                            created_at=created_at + timedelta(hours=12)),
+            ]
+        TrafficStat.objects.bulk_create(hits)
+
+    def get(self, **params):
+        request = APIRequestFactory().get('/', params)
+        force_authenticate(request, user=self.user)
+        return async_to_sync(TrafficBreakdownView.as_view())(request)
+
+    def breakdown(self, dimension):
+        # Сутки 1-3 марта - из сводок, 4 марта до 12:00 - край интервала
+        response = self.get(dimension=dimension, start='2025-03-01', end='2025-03-04T12:00', tz='UTC')
+        self.assertEqual(response.status_code, 200)
+        return [(item['value'], item['hits'], item['visitors']) for item in response.data['items']]
+
+    def test_matches_raw(self):
+        update_top_keys(settle_seconds=0)
+        TrafficStat.objects.create(
+            ip_address='10.0.0.4', url=self.about, created_at=datetime(2025, 3, 2, 9, tzinfo=dt_timezone.utc)
+        )
+
+        expected = {
+            'url': [('/about/', 8, 3), ('/', 4, 1)],
+            'browser': [('Firefox', 7, 2), ('Chrome', 4, 1)],
+            'device': [('Desktop', 11, 3)],
+            'event': [('signup', 3, 1)],
+        }
+        for use_rollups in (True, False):
+            with self.subTest(use_rollups=use_rollups), self.settings(TRAFFIC_USE_ROLLUPS=use_rollups):
+                for dimension, items in expected.items():
+                    self.assertEqual(self.breakdown(dimension), items, dimension)
+        self.assertTrue(self.get(dimension='url', start='2025-03-01', end='2025-03-04').data['approximate'])
+        self.assertEqual(self.get(dimension='url', start='2025-03-01', end='2025-03-04', limit=0).status_code, 400)
+        self.assertEqual(self.get(dimension='referrer', start='2025-03-01', end='2025-03-04').status_code, 400)
+
+    def test_space_saving_merge(self):
+        merged = merge_top_keys({'a': (5, 0), 'b': (3, 0)}, {'a': 1, 'c': 4}, capacity=2)
+        # c мог встречаться до 3 раз, пока не попал в сводку: оценка сверху 3 + 4, погрешность 3
+        self.assertEqual(merged, {'a': (6, 0), 'c': (7, 3)})
+
+    def test_parse_user_agent(self):
+        self.assertEqual(
+            parse_user_agent('Mozilla/5.0 (iPhone; CPU iPhone OS 17_4 like Mac OS X) AppleWebKit/605.1.15 '
+                             '(KHTML, like Gecko) Version/17.4 Mobile/15E148 Safari/604.1'),
+            ('Safari', 'iOS', 'Mobile'),
+        )
+        self.assertEqual(
+            parse_user_agent('Mozilla/5.0 (Linux; Android 14; Pixel 8) AppleWebKit/537.36 (KHTML, like Gecko) '
+                             'Chrome/120.0 Mobile Safari/537.36 EdgA/120.0'),
+            ('Edge', 'Android', 'Mobile'),
+        )
+        self.assertEqual(UserAgent.objects.filter(browser='Firefox', os='Linux', device='Desktop').count(), 1)
+
+
+@override_settings(TRAFFIC_STATS_CACHE={'ENABLED': False})
+class TrafficSessionsTest(TestCase):
+    """Сессии по сводкам совпадают с расчётом по TrafficStat, воронка учитывает порядок шагов и окно."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='tester', password='tester')
+        urls = {value: UrlPath.objects.create(value=value) for value in ('/', '/cart/', '/checkout/')}
+        base = datetime(2025, 3, 1, 10, tzinfo=dt_timezone.utc)
+        visits = [
+            # Две сессии a: перерыв больше TRAFFIC_SESSION_TIMEOUT, вторая - отказ
+            ('a', '/', 0, None), ('a', '/cart/', 5, None), ('a', '/checkout/', 10, None), ('a', '/', 130, None),
+            # Событие на странице входа - не отказ
+            ('b', '/', 0, None), ('b', '/', 1, 'signup'),
+            ('c', '/cart/', 0, None), ('c', '/', 20, None), ('c', '/cart/', 90, None),
+        ]
+        TrafficStat.objects.bulk_create([
+            TrafficStat(ip_address='10.0.0.1', session_id=session_id, url=urls[url], event=event,
+                        created_at=base + timedelta(minutes=minutes))
+            for session_id, url, minutes, event in visits
+        ])
+
+    def get(self, view, **params):
+        request = APIRequestFactory().get('/', {'start': '2025-03-01', 'end': '2025-03-02', 'tz': 'UTC', **params})
+        force_authenticate(request, user=self.user)
+        response = async_to_sync(view.as_view())(request)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_sessions(self):
+        self.assertEqual(update_session_summaries(settle_seconds=0), 1)
+        for use_rollups in (True, False):
+            with self.subTest(use_rollups=use_rollups), self.settings(TRAFFIC_USE_ROLLUPS=use_rollups):
+                data = self.get(TrafficSessionsView)
+                self.assertEqual(data['sessions'], 5)
+                self.assertEqual(data['bounce_rate'], 2 / 5)
+                self.assertEqual(data['avg_duration'], (600 + 60 + 1200) / 5)
+                self.assertEqual(data['pageviews_per_session'], 8 / 5)
+                self.assertEqual(
+                    [(page['url'], page['sessions'], page['bounce_rate']) for page in data['entry_pages']],
+                    [('/', 3, 1 / 3), ('/cart/', 2, 1 / 2)],
+                )
+                self.assertEqual(data['paths'][0], {'pages': ['/'], 'sessions': 2})
+
+    def test_funnel(self):
+        steps = ['/', '/cart/', '/checkout/']
+        for window, expected in ((60, [3, 1, 1]), (120, [3, 2, 1])):
+            data = self.get(TrafficFunnelView, step=steps, window=window)
+            self.assertEqual([step['visitors'] for step in data['steps']], expected)
+        data = self.get(TrafficFunnelView, step=['/', 'signup'])
+        self.assertEqual([step['visitors'] for step in data['steps']], [3, 1])
+
+
+class TrafficRetentionTest(TestCase):
+    """Когорты по первому визиту одинаковы по почасовым агрегатам с хвостом и по TrafficStat."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='tester', password='tester')
+        first, second, third, earlier = (
+            User.objects.create_user(username=name, password=name) for name in ('first', 'second', 'third', 'earlier')
+        )
+        # Недели с понедельника: 3, 10 и 17 марта 2025
+        def moment(day):
+            return datetime(2025, 3, day, 12, tzinfo=dt_timezone.utc)
+
+        # Первый визит first известен только по Visitor
+        Visitor.objects.create(session_key='first', user=first, ip_address='10.0.0.1', start_time=moment(4))
+        TrafficStat.objects.bulk_create([
+            TrafficStat(ip_address='10.0.0.1', user=user, created_at=created_at)
+            for user, created_at in (
+                (first, moment(11)), (first, moment(12)),
+                (second, moment(5)),
+                (third, moment(12)), (third, moment(18)),
+                # Первый визит до начала интервала: пользователь не входит в когорты
+                (earlier, datetime(2025, 2, 25, tzinfo=dt_timezone.utc)), (earlier, moment(11)),
+            )
+        ])
+
+    def get(self, **params):
+        request = APIRequestFactory().get('/', {'start': '2025-03-03', 'end': '2025-03-24', 'tz': 'UTC', **params})
+        force_authenticate(request, user=self.user)
+        return async_to_sync(TrafficRetentionView.as_view())(request)
+
+    def test_weekly_cohorts(self):
+        update_hourly_rollups(settle_seconds=0)
+        # Хит после агрегации читается из хвоста
+        TrafficStat.objects.create(
+            ip_address='10.0.0.1', user=User.objects.get(username='second'),
+            created_at=datetime(2025, 3, 20, tzinfo=dt_timezone.utc),
+        )
+        for use_rollups in (True, False):
+            with self.subTest(use_rollups=use_rollups), self.settings(TRAFFIC_USE_ROLLUPS=use_rollups):
+                response = self.get()
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(
+                    [(cohort['period'], cohort['active']) for cohort in response.data['cohorts']],
+                    [('2025-03-03', [2, 1, 1]), ('2025-03-10', [1, 1]), ('2025-03-17', [0])],
+                )
+                self.assertEqual(response.data['cohorts'][0]['retention'], [1.0, 0.5, 0.5])
+
+    def test_invalid_granularity(self):
+        self.assertEqual(self.get(granularity='day').status_code, 400)
+
+
+class UserRequestLogCursorTest(TestCase):
+    """Курсорная пагинация проходит весь журнал без пропусков и повторов, в том числе при совпадающем created_at."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='tester', password='tester')
+        created_at = timezone.make_aware(datetime(2025, 3, 10, 12))
+        TrafficStat.objects.bulk_create([
+            TrafficStat(
+                ip_address='10.0.0.1', user=cls.user, url=UrlPath.objects.create(value=f'/{i}/'),
+                created_at=created_at + timedelta(minutes=i // 3),
+            )
+            for i in range(12)
+        ])
+        cls.expected = list(TrafficStat.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+
+    def get(self, url):
+        request = APIRequestFactory().get(url)
+        force_authenticate(request, user=self.user)
+        return UserRequestLogView.as_view()(request, user_id=self.user.id)
+
+    def test_walk_forward_and_back(self):
+        response = self.get('/?pagination=cursor&page_size=5&with_count=true')
+        self.assertEqual(response.data['count'], 12)
+        self.assertFalse(response.data['count_is_estimate'])
+        self.assertIsNone(response.data['previous'])
+
+        pages = [[row['id'] for row in response.data['results']]]
+        while response.data['next']:
+            # пользователь, страница по ключу и ограниченный подсчёт
+            with self.assertNumQueries(3):
+                response = self.get(response.data['next'])
+            pages.append([row['id'] for row in response.data['results']])
+        self.assertEqual(sum(pages, []), self.expected)
+
+        response = self.get(response.data['previous'])
+        self.assertEqual([row['id'] for row in response.data['results']], pages[-2])
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.get('/?pagination=cursor&cursor=broken').status_code, 400)
+
+    def test_deep_cursor_plan(self):
+        cursor = encode_cursor(timezone.make_aware(datetime(2025, 3, 10, 12, 1)), self.expected[-4])
+        with CaptureQueriesContext(connection) as queries:
+            self.get(f'/?pagination=cursor&page_size=2&cursor={cursor}')
+        page_sql = next(query['sql'] for query in queries if 'ORDER BY' in query['sql'])
+
+        def plan_nodes(plan):
+            yield plan
+            for child in plan.get('Plans', []):
+                yield from plan_nodes(child)
+
+        # На таблице из десятка строк планировщик выбрал бы чтение целиком, поэтому оно запрещено
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+            cursor.execute("SET LOCAL enable_bitmapscan = off")
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {page_sql}")
+            nodes = list(plan_nodes(cursor.fetchone()[0][0]['Plan']))
+        self.assertNotIn('Sort', [node['Node Type'] for node in nodes])
+        # Ключ курсора - граница сканирования индекса (user, created_at, id), а не фильтр по всему журналу
+        scan = next(node for node in nodes if node.get('Index Name', '').endswith('user_id_created_at_id_idx'))
+        self.assertEqual(scan['Node Type'], 'Index Scan')
+        self.assertIn('created_at <=', scan['Index Cond'])
+
+
+class TrafficExportTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='tester', password='tester')
+        created_at = timezone.make_aware(datetime(2025, 3, 10, 12))
+        TrafficStat.objects.bulk_create([
+            TrafficStat(
+                ip_address='10.0.0.1', user=cls.user if i % 2 else None, url=UrlPath.objects.create(value=f'/{i}/'),
+                created_at=created_at,
+            )
+            for i in range(10)
+        ])
+
+    def export(self, **params):
+        request = APIRequestFactory().get('/', params)
+        force_authenticate(request, user=self.user)
+        response = TrafficExportView.as_view()(request)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content)
+
+    def test_csv(self):
+        rows = list(csv.DictReader(io.StringIO(self.export(url='/1').decode())))
+        self.assertEqual([row['url'] for row in rows], ['/1/'])
+        self.assertEqual(rows[0]['user_id'], str(self.user.id))
+
+    def test_ndjson(self):
+        rows = [json.loads(line) for line in self.export(export_format='ndjson', user_id=self.user.id).splitlines()]
+        self.assertEqual(len(rows), 5)
+        self.assertTrue(all(row['user_id'] == self.user.id for row in rows))
+
+    @unittest.skipIf(pyarrow is None, "pyarrow не установлен")
+    def test_parquet(self):
+        table = pyarrow.parquet.read_table(pyarrow.BufferReader(self.export(export_format='parquet')))
+        self.assertEqual(table.num_rows, 10)
+        self.assertEqual(sorted(table.column('url').to_pylist()), sorted(f'/{i}/' for i in range(10)))
+
+
+class DictionaryStorageTest(TestCase):
+    """Строки User-Agent и пути хранятся в справочниках, повторная строка берётся из кэша процесса без запроса."""
+
+    def setUp(self):
+        # id справочников из откатываемых тестовых транзакций не должны оставаться в кэше процесса
+        for model in (UserAgent, UrlPath):
+            get_dictionary_cache(model).clear()
+            self.addCleanup(get_dictionary_cache(model).clear)
+
+    def test_resolve_hit(self):
+        long_path = '/page' * 100
+        with self.captureOnCommitCallbacks(execute=True):
+            first = resolve_hit({'user_agent': 'Mozilla/5.0', 'url': long_path})
+
+        with self.assertNumQueries(0):
+            second = resolve_hit({'user_agent': 'Mozilla/5.0', 'url': long_path})
+        self.assertEqual(first, second)
+        self.assertEqual(UserAgent.objects.get(pk=first['user_agent_id']).value, 'Mozilla/5.0')
+        self.assertEqual(UrlPath.objects.get(pk=first['url_id']).value, long_path[:255])
+
+    def test_resolve_hit_deduplicates(self):
+        # Промах кэша по уже сохранённой строке находит существующую запись, а не создаёт вторую
+        first = resolve_hit({'user_agent': 'Mozilla/5.0', 'url': '/a/'})
+        get_dictionary_cache(UserAgent).clear()
+        get_dictionary_cache(UrlPath).clear()
+        second = resolve_hit({'user_agent': 'Mozilla/5.0', 'url': '/a/'})
+        self.assertEqual(first, second)
+        self.assertEqual((UserAgent.objects.count(), UrlPath.objects.count()), (1, 1))
+
+    def test_log_and_export_queries(self):
+        user = User.objects.create_user(username='tester', password='tester')
+        TrafficStat.objects.bulk_create([
+            TrafficStat(ip_address='10.0.0.1', user=user, **resolve_hit({'user_agent': f'agent {i}', 'url': f'/{i}/'}))
+            for i in range(10)
+        ])
+
+        # Строки справочников читаются тем же запросом, что и страница: число запросов не зависит от числа строк
+        request = APIRequestFactory().get('/')
+        force_authenticate(request, user=user)
+        with self.assertNumQueries(3):
+            rows = UserRequestLogView.as_view()(request, user_id=user.id).data['results']
+        self.assertEqual({row['user_agent'] for row in rows}, {f'agent {i}' for i in range(10)})
+
+        request = APIRequestFactory().get('/', {'export_format': 'ndjson'})
+        force_authenticate(request, user=user)
+        with self.assertNumQueries(1):
+            lines = b''.join(TrafficExportView.as_view()(request).streaming_content).splitlines()
+        self.assertEqual({json.loads(line)['url'] for line in lines}, {f'/{i}/' for i in range(10)})
+
+    def test_request_log_presents_strings(self):
+        user = User.objects.create_user(username='tester', password='tester')
+        TrafficStat.objects.create(ip_address='10.0.0.1', user=user, **resolve_hit({'user_agent': 'curl', 'url': '/a/'}))
+
+        request = APIRequestFactory().get('/', {'url': 'A/'})
+        force_authenticate(request, user=user)
+        row = UserRequestLogView.as_view()(request, user_id=user.id).data['results'][0]
+        self.assertEqual((row['url'], row['user_agent']), ('/a/', 'curl'))
+
+
+class DictionaryBackfillMigrationTest(TransactionTestCase):
+    """
+    Миграции 0006, 0015 и 0016 переносят строки User-Agent и путей существующих хитов в справочники без дублей:
+    0006 добавляет столбцы ссылок, 0015 заполняет их порциями по id, 0016 удаляет строковые столбцы.
+    """
+    before = [('traffic', '0005_rollup_hll_sketches')]
+    after = [('traffic', '0016_remove_user_agent_url_text')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+        for model in (UserAgent, UrlPath):
+            get_dictionary_cache(model).clear()
+
+    def test_backfill(self):
+        apps = self.migrate(self.before)
+        created_at = timezone.make_aware(datetime(2025, 3, 10, 12))
+        apps.get_model('traffic', 'TrafficStat').objects.bulk_create([
+            apps.get_model('traffic', 'TrafficStat')(
+                ip_address='10.0.0.1', user_agent=user_agent, url=url, created_at=created_at
+            )
+            for user_agent, url in (('curl', '/a/'), ('curl', '/b/'), ('Mozilla/5.0', '/a/'), (None, None))
+        ])
+
+        # Порция в одну строку: каждая строка заполняется в своей транзакции
+        backfill = importlib.import_module('traffic.migrations.0015_backfill_user_agent_url')
+        with mock.patch.object(backfill, 'BACKFILL_BATCH_SIZE', 1):
+            apps = self.migrate(self.after)
+        stats = apps.get_model('traffic', 'TrafficStat').objects.order_by('id')
+        self.assertEqual(
+            list(stats.values_list('user_agent__value', 'url__value')),
+            [('curl', '/a/'), ('curl', '/b/'), ('Mozilla/5.0', '/a/'), (None, None)],
+        )
+        self.assertEqual(apps.get_model('traffic', 'UserAgent').objects.count(), 2)
+        self.assertEqual(apps.get_model('traffic', 'UrlPath').objects.count(), 2)
+
+
+class VisitorIdentificationTest(TestCase):
+    """Анонимный запрос получает стабильный псевдоидентификатор сессии без записи в django_session."""
+
+    def setUp(self):
+        # TRACK_ANONYMOUS_USERS django-tracking2 читает при импорте, а в настройках он включён только для режима session
+        patcher = mock.patch('tracking.middleware.TRACK_ANONYMOUS_USERS', False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def hit(self, **headers):
+        self.client.get('/api/traffic/daily/', headers=headers)
+        return TrafficStat.objects.latest('id').session_id
+
+    @override_settings(TRAFFIC_VISITOR_ID={'MODE': 'cookie'})
+    def test_cookie(self):
+        first = self.hit(user_agent='Mozilla/5.0')
+        self.assertEqual(len(first), 32)
+        self.assertIn('traffic_vid', self.client.cookies)
+        # Cookie сохраняет идентификатор и при смене User-Agent
+        self.assertEqual(self.hit(user_agent='Mozilla/5.0 (changed)'), first)
+        self.assertFalse(Session.objects.exists())
+
+    @override_settings(TRAFFIC_VISITOR_ID={'MODE': 'cookie'})
+    def test_cookie_same_fingerprint(self):
+        # Два браузера за одним NAT с одинаковым User-Agent в один день получают разные идентификаторы
+        first = self.hit(user_agent='Mozilla/5.0')
+        self.client.cookies.clear()
+        self.assertNotEqual(self.hit(user_agent='Mozilla/5.0'), first)
+
+    @override_settings(TRAFFIC_VISITOR_ID={'MODE': 'fingerprint'})
+    def test_fingerprint(self):
+        first = self.hit(user_agent='Mozilla/5.0')
+        self.assertNotIn('traffic_vid', self.client.cookies)
+        self.assertEqual(self.hit(user_agent='Mozilla/5.0'), first)
+        self.assertNotEqual(self.hit(user_agent='curl/8.0'), first)
+        self.assertFalse(Session.objects.exists())
+
+    @override_settings(TRAFFIC_VISITOR_ID={'MODE': 'session'})
+    def test_session(self):
+        self.assertEqual(self.hit(), Session.objects.get().session_key)
+
+
+class CollectingBuffer(TrafficBuffer):
+    """Буфер, собирающий пакеты в память вместо БД: фоновый поток работает без соединения теста."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.written = []
+        self.written_event = threading.Event()
+
+    def _write(self, hits):
+        self.written.extend(hits)
+        self.written_event.set()
+        return len(hits)
+
+
+def buffer_hit(number=0):
+    return {
+        'ip_address': '10.0.0.1', 'user_id': None, 'user_agent': 'Mozilla/5.0', 'url': f'/{number}/',
+        'session_id': 'guest', 'created_at': timezone.make_aware(datetime(2025, 3, 10, 12)), 'weight': 1,
+    }
+
+
+class TrafficBufferTest(SimpleTestCase):
+    """Сброс буфера по размеру, по времени и при остановке, политики переполнения drop, block и spill."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def buffer(self, **kwargs):
+        buffer = CollectingBuffer(**{'batch_size': 100, 'flush_interval': 60, **kwargs})
+        self.addCleanup(buffer.shutdown)
+        return buffer
+
+    def test_flush_by_size_and_time(self):
+        buffer = self.buffer(batch_size=2)
+        buffer.add(buffer_hit(1))
+        buffer.add(buffer_hit(2))
+        self.assertTrue(buffer.written_event.wait(5))
+        self.assertEqual(len(buffer.written), 2)
+
+        buffer = self.buffer(flush_interval=0.05)
+        buffer.add(buffer_hit())
+        self.assertTrue(buffer.written_event.wait(5))
+
+    def test_shutdown_flush(self):
+        buffer = self.buffer()
+        for i in range(3):
+            buffer.add(buffer_hit(i))
+        buffer.shutdown()
+        self.assertEqual(len(buffer.written), 3)
+
+    def test_overflow(self):
+        buffer = self.buffer(max_size=1, overflow='drop')
+        buffer.add(buffer_hit(1))
+        buffer.add(buffer_hit(2))
+        self.assertEqual(buffer.dropped, 1)
+
+        # Переполнение будит поток сброса, ожидающий хит попадает в освободившийся буфер
+        buffer = self.buffer(max_size=1, overflow='block', block_timeout=5)
+        buffer.add(buffer_hit(1))
+        buffer.add(buffer_hit(2))
+        buffer.shutdown()
+        self.assertEqual((buffer.dropped, len(buffer.written)), (0, 2))
+
+        # Выгруженный на диск хит загружается при следующем сбросе
+        buffer = self.buffer(max_size=1, overflow='spill', spill_dir=self.directory)
+        buffer.add(buffer_hit(1))
+        buffer.add(buffer_hit(2))
+        buffer.shutdown()
+        self.assertEqual(buffer.dropped, 0)
+        self.assertEqual(sorted(hit['url'] for hit in buffer.written), ['/1/', '/2/'])
+        self.assertEqual(os.listdir(self.directory), [])
+
+
+@override_settings(TRAFFIC_BUFFER={'ENABLED': True, 'FLUSH_INTERVAL': 60})
+class TrafficBufferMiddlewareTest(TestCase):
+    """С включённым буфером middleware не пишет хит в ответе на запрос, хит появляется после сброса буфера."""
+
+    def setUp(self):
+        # Отдельный буфер процесса на тест, без регистрации сброса при выходе интерпретатора
+        for target, value in (('traffic.buffer._buffer', None), ('traffic.buffer.atexit.register', mock.Mock())):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        for model in (UserAgent, UrlPath):
+            self.addCleanup(get_dictionary_cache(model).clear)
+
+    def test_flush(self):
+        buffer = get_buffer()
+        self.addCleanup(buffer.shutdown)
+
+        self.client.get('/api/traffic/daily/', headers={'user-agent': 'Mozilla/5.0'})
+        self.assertFalse(TrafficStat.objects.exists())
+
+        self.assertEqual(buffer.flush(), 1)
+        hit = TrafficStat.objects.select_related('url', 'user_agent').get()
+        self.assertEqual((hit.url.value, hit.user_agent.value), ('/api/traffic/daily/', 'Mozilla/5.0'))
+
+
+class TrafficBufferReplayTest(TestCase):
+    """Загружаются выгрузки своего и завершившихся процессов, файлы живых воркеров и битые строки пропускаются."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        for model in (UserAgent, UrlPath):
+            self.addCleanup(get_dictionary_cache(model).clear)
+
+    def spill(self, name, *urls, tail=''):
+        with open(os.path.join(self.directory, name), 'w', encoding='utf-8') as spill_file:
+            for url in urls:
+                hit = buffer_hit()
+                spill_file.write(json.dumps({**hit, 'url': url, 'created_at': hit['created_at'].isoformat()}) + '\n')
+            spill_file.write(tail)
+
+    def test_replay(self):
+        process = subprocess.Popen([sys.executable, '-c', ''])
+        process.wait()
+        dead, live = process.pid, os.getppid()
+
+        self.spill(f'traffic-spill-{os.getpid()}.jsonl', '/own/')
+        # Последняя строка оборвана при аварийном завершении
+        self.spill(f'traffic-spill-{dead}.jsonl', '/dead/', tail='{"url": "/cut')
+        # Загрузка, прерванная завершением процесса
+        self.spill(f'traffic-spill-{live}.jsonl.{dead}.replay', '/claimed/')
+        self.spill(f'traffic-spill-{live}.jsonl', '/live/')
+
+        buffer = TrafficBuffer(spill_dir=self.directory)
+        self.assertEqual(buffer.flush(), 3)
+        self.assertEqual(
+            sorted(TrafficStat.objects.values_list('url__value', flat=True)), ['/claimed/', '/dead/', '/own/']
+        )
+        self.assertEqual(os.listdir(self.directory), [f'traffic-spill-{live}.jsonl'])
+
+
+class PartitionTest(TestCase):
+    """Новая секция забирает строки своего диапазона из DEFAULT, устаревшие секции отключаются и удаляются."""
+
+    def partition_rows(self, name):
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT COUNT(*) FROM {connection.ops.quote_name(name)}")
+            return cursor.fetchone()[0]
+
+    def test_partitions(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT confrelid::regclass::text FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'f'",
+                [TrafficStat._meta.db_table],
+            )
+            self.assertIn((User._meta.db_table,), cursor.fetchall())
+
+        # Строки после последней секции лежат в DEFAULT
+        moment = list_partitions()[-1][2] + timedelta(days=40)
+        TrafficStat.objects.bulk_create([TrafficStat(ip_address='10.0.0.1', created_at=moment) for _ in range(3)])
+        TrafficStat.objects.create(ip_address='10.0.0.1', created_at=moment - timedelta(days=400))
+        self.assertEqual(default_partition_rows(), 3)
+
+        created = ensure_partitions('month', premake=1, now=moment)
+        name, following = partition_name(moment, 'month'), next_interval_start(moment, 'month')
+        self.assertEqual([(start, moved) for _, start, _, moved in created][-2:], [(
+            next_interval_start(moment - timedelta(days=31), 'month'), 3), (following, 0)
+        ])
+        self.assertEqual((default_partition_rows(), self.partition_rows(name)), (0, 3))
+        self.assertEqual(TrafficStat.objects.count(), 4)
+
+        # Истекают все секции, закончившиеся к началу следующего месяца, включая исходную. Отложенные проверки
+        # внешних ключей выполняются сразу: таблицу с ожидающими триггерами в транзакции теста удалить нельзя
+        with connection.cursor() as cursor:
+            cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+        expired = expire_partitions(retention_days=0, now=following)
+        self.assertIn(name, [expired_name for expired_name, _, _ in expired])
+        self.assertEqual([start for _, start, _ in list_partitions()], [following])
+        self.assertEqual(TrafficStat.objects.count(), 0)
+
+
+class SpoolIngestTest(TestCase):
+    """Хиты из спула загружаются через COPY один раз, повторная загрузка сегмента пропускается."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        for model in (UserAgent, UrlPath):
+            self.addCleanup(get_dictionary_cache(model).clear)
+
+    def test_ingest(self):
+        writer = SpoolWriter(self.directory, segment_seconds=60)
+        created_at = timezone.make_aware(datetime(2025, 3, 10, 12))
+        for i in range(3):
+            writer.append({
+                'ip_address': '10.0.0.1', 'user_id': None, 'user_agent': 'Mozilla/5.0 "quoted"', 'url': f'/{i}/',
+                'session_id': 'guest', 'created_at': created_at, 'weight': 1 + i,
+            })
+        writer.close()
+        segment = ready_segments(self.directory)[0]
+        shutil.copy(segment, f'{segment}.copy')
+
+        self.assertEqual(ingest_ready(self.directory), 3)
+        self.assertFalse(ready_segments(self.directory))
+        hit = TrafficStat.objects.select_related('url', 'user_agent').get(weight=3)
+        self.assertEqual((hit.url.value, hit.user_agent.value), ('/2/', 'Mozilla/5.0 "quoted"'))
+        self.assertEqual(hit.created_at, created_at)
+
+        # Сбой между фиксацией и удалением файла: сегмент снова в спуле
+        os.rename(f'{segment}.copy', segment)
+        self.assertEqual(ingest_ready(self.directory), 0)
+        self.assertEqual(TrafficStat.objects.count(), 3)
+        self.assertEqual(spool_status(self.directory)['pending_segments'], 0)
+
+
+class TrafficEventsTest(TestCase):
+    """Пачка событий записывается одной операцией, ошибочные события отклоняются поштучно."""
+
+    def setUp(self):
+        for model in (UserAgent, UrlPath):
+            self.addCleanup(get_dictionary_cache(model).clear)
+
+    def test_batch(self):
+        user = User.objects.create_user(username='buyer', password='password')
+        self.client.force_login(user)
+        events = [
+            {'name': 'signup', 'url': '/pricing/', 'properties': {'plan': 'pro'}, 'age_ms': 60000},
+            {'name': 'click'},
+            {'name': 'bad name'},
+            {'name': 'big', 'properties': {'data': 'x' * 2000}},
+        ]
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                '/api/traffic/events/', json.dumps({'events': events}), content_type='text/plain;charset=UTF-8',
+                headers={
+                    'referer': 'http://testserver/catalog/?page=2', 'user-agent': 'Mozilla/5.0',
+                    'sec-fetch-site': 'same-origin',
+                },
+            )
+
+        self.assertEqual(response.status_code, 202)
+        # Вся пачка - одна операция записи в журнал
+        self.assertEqual(sum(TrafficStat._meta.db_table in query['sql'] for query in queries), 1)
+        self.assertEqual(response.json()['accepted'], 2)
+        self.assertEqual([item['index'] for item in response.json()['rejected']], [2, 3])
+
+        hits = {hit.event: hit for hit in TrafficStat.objects.select_related('url', 'user_agent')}
+        self.assertEqual(set(hits), {'signup', 'click'})
+        self.assertEqual(hits['signup'].properties, {'plan': 'pro'})
+        self.assertEqual((hits['signup'].url.value, hits['click'].url.value), ('/pricing/', '/catalog/'))
+        self.assertEqual(hits['click'].user_id, user.pk)
+        self.assertEqual(hits['click'].user_agent.value, 'Mozilla/5.0')
+        self.assertAlmostEqual(
+            (hits['click'].created_at - hits['signup'].created_at).total_seconds(), 60, delta=1
+        )
+
+    def test_cross_site_is_anonymous(self):
+        self.client.force_login(User.objects.create_user(username='victim', password='password'))
+        body = json.dumps({'events': [{'name': 'click'}]})
+        for headers in (
+            {'sec-fetch-site': 'cross-site'},
+            {'origin': 'https://evil.example'},
+            {},
+            {'origin': 'http://testserver'},
+        ):
+            response = self.client.post(
+                '/api/traffic/events/', body, content_type='text/plain;charset=UTF-8', headers=headers
+            )
+            self.assertEqual(response.status_code, 202)
+
+        hits = list(TrafficStat.objects.order_by('id').values_list('user_id', 'session_id'))
+        # Сторонний сайт и запрос без Origin не получают ни пользователя, ни сессию
+        self.assertEqual(hits[:3], [(None, None)] * 3)
+        self.assertIsNotNone(hits[3][0])
+        self.assertEqual(hits[3][1], self.client.session.session_key)
+
+    def test_invalid_batch(self):
+        response = self.client.post('/api/traffic/events/', [{'name': 'click'}], content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        with override_settings(TRAFFIC_EVENTS={'MAX_BATCH': 1}):
+            response = self.client.post(
+                '/api/traffic/events/', {'events': [{'name': 'a'}, {'name': 'b'}]}, content_type='application/json'
+            )
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(TrafficStat.objects.exists())
+
+
+class BenchmarkTest(TestCase):
+    """Генератор данных воспроизводим и создаёт Visitor на каждую сессию, сценарии замеров выполняются на его данных."""
+
+    def test_seed_and_run(self):
+        self.assertEqual(seed(400, users=5, days=3, session_length=4, chunk_size=150), (400, 100))
+        self.assertEqual(TrafficStat.objects.values('session_id').distinct().count(), 100)
+        self.assertFalse(TrafficStat.objects.filter(created_at__gt=timezone.now()).exists())
+        registered = TrafficStat.objects.filter(user__isnull=False)
+        self.assertTrue(registered.exists())
+        self.assertEqual(registered.filter(ip_address__startswith='172.16.').count(), registered.count())
+
+        report = run_benchmark(iterations=2, warmup=0, deep_page=2, scenarios=['period_daily', 'middleware'])
+        self.assertEqual(set(report['scenarios']), {'period_daily', 'middleware'})
+        self.assertEqual(report['scenarios']['period_daily']['queries'], 1)
+        self.assertEqual(report['dataset']['visitors'], 100)
+
+
+@override_settings(
+    TRAFFIC_STATS_CACHE={'ENABLED': False},
+    TRAFFIC_METRICS={'BACKEND': 'traffic.metrics.MemoryMetricsBackend', 'FLUSH_INTERVAL': 0},
+)
+class RequestMetricsTest(TestCase):
+    """Запросы к представлениям traffic получают Server-Timing и попадают в гистограммы /metrics."""
+
+    def test_server_timing_and_metrics(self):
+        self.client.force_login(User.objects.create_user(username='tester', password='tester'))
+
+        response = self.client.get('/api/traffic/daily/', {'date': '2025-03-10'})
+        timing = response.headers['Server-Timing']
+        for entry in ('db;dur=', 'db-slowest;dur=', 'render;dur=', 'track;dur=', 'total;dur='):
+            self.assertIn(entry, timing)
+        # Не представления traffic не замеряются
+        self.assertNotIn('Server-Timing', self.client.get('/admin/login/').headers)
+
+        # Без токена метрики видят только сотрудники
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
+        self.client.force_login(User.objects.create_user(username='staff', password='staff', is_staff=True))
+
+        metrics = self.client.get('/metrics').content.decode()
+        self.assertIn('traffic_request_duration_seconds_count{view="daily-traffic-stats"} 1', metrics)
+        self.assertIn('traffic_request_db_queries_bucket{view="daily-traffic-stats",le="+Inf"} 1', metrics)
+        self.assertIn('traffic_track_seconds_count{write_path="direct"} 2', metrics)
+
+        with self.settings(TRAFFIC_METRICS={'TOKEN': 'secret'}):
+            self.assertEqual(self.client.get('/metrics').status_code, 403)
+            self.assertEqual(self.client.get('/metrics', headers={'authorization': 'Bearer secret'}).status_code, 200)
+
+
+class AsyncStackTest(TestCase):
+    """Под ASGI middleware записывает хит асинхронно, а эндпоинт периода обрабатывается асинхронным обработчиком."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='tester', password='tester')
+
+    @override_settings(TRAFFIC_STATS_CACHE={'ENABLED': False})
+    async def test_async_request_records_hit(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get('/api/traffic/daily/', {'date': '2025-03-10'})
+
+        self.assertEqual(response.status_code, 404)
+        hit = await TrafficStat.objects.aget(url__value='/api/traffic/daily/')
+        self.assertEqual(hit.user_id, self.user.id)
+        self.assertTrue(hit.session_id)
+
+    async def test_live_feed_requires_login(self):
+        response = await self.async_client.get('/api/traffic/live/')
+        self.assertEqual(response.status_code, 403)
+
+    async def test_stats_page_uses_live_feed(self):
+        response = await self.async_client.get('/api/traffic/stats/')
+        self.assertIs(response.context['live_stream'], True)
+
+    def test_live_feed_disabled_under_wsgi(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get('/api/traffic/live/').status_code, 404)
+        # Страницы мониторинга под WSGI не подключают ленту, а опрашивают JSON-эндпоинты
+        self.assertIs(self.client.get('/api/traffic/stats/').context['live_stream'], False)
+
+
+class TrackingRulesTest(SimpleTestCase):
+    def test_include_exclude(self):
+        rules = get_tracking_rules()
+        self.assertFalse(rules.is_tracked('/static/traffic/js/chart.js'))
+        self.assertFalse(rules.is_tracked('/admin/js/core.js'))
+        self.assertFalse(rules.is_tracked('/api/traffic/live/'))
+        self.assertTrue(rules.is_tracked('/admin/'))
+
+        with self.settings(TRAFFIC_TRACKING={'INCLUDE': [r'/api/'], 'EXCLUDE': []}):
+            rules = get_tracking_rules()
+            self.assertTrue(rules.is_tracked('/api/traffic/live/'))
+            self.assertFalse(rules.is_tracked('/admin/'))
+
+    @override_settings(TRAFFIC_TRACKING={'SAMPLING': [
+        {'PATH': r'/health/$', 'RATE': 0.01},
+        {'USER_AGENT': r'bot', 'RATE': 0.1},
+    ]})
+    def test_sampling(self):
+        rules = get_tracking_rules()
+        self.assertEqual(rules.sample_weight('/health/', 'curl'), 100)
+        self.assertEqual(rules.sample_weight('/', 'Mozilla/5.0 (compatible; Googlebot/2.1)'), 10)
+        self.assertEqual(rules.sample_weight('/health/', 'Googlebot'), 100)
+        self.assertEqual(rules.sample_weight('/health/x', None), 1)
+
+        # Сумма весов записанных хитов оценивает число запросов без смещения
+        random.seed(1)
+        total = sum(rules.weight('/', 'Googlebot') for _ in range(20000))
+        self.assertAlmostEqual(total / 20000, 1, delta=0.05)
+
+    def test_invalid_rate(self):
+        with self.assertRaises(ImproperlyConfigured), self.settings(
+            TRAFFIC_TRACKING={'SAMPLING': [{'PATH': '/', 'RATE': 0}]}
+        ):
+            get_tracking_rules()
+
+
+@override_settings(TRAFFIC_LIVE={'INTERVAL': 0.05})
+class LiveFeedTest(SimpleTestCase):
+    """Снимок снимается одним потоком на процесс и рассылается всем подписчикам."""
+
+    async def test_fan_out(self):
+        calls = []
+
+        def snapshot():
+            calls.append(1)
+            return {
+                'buckets': {'hour': {'start': '2025-03-10T12:00:00', 'count': len(calls)}},
+                'online_count': 1,
+                'online_user_ids': {1},
+            }
+
+        feed = LiveFeed(snapshot)
+        subscribers = [feed.subscribe() for _ in range(10)]
+
+        for queue in subscribers:
+            events = dict([await asyncio.wait_for(queue.get(), 1) for _ in range(3)])
+            self.assertEqual(events['online'], {'count': 1})
+            self.assertEqual(events['presence'], {'online': [1], 'offline': []})
+            name, hits = await asyncio.wait_for(queue.get(), 1)
+            self.assertEqual(name, 'hits')
+
+        for queue in subscribers:
+            feed.unsubscribe(queue)
+        while feed._thread is not None:
+            await asyncio.sleep(0.05)
+
+        # Один вызов снимка на тик, а не на подписчика
+        self.assertLess(len(calls), hits['hour']['count'] + 3)
+
+
+class HyperLogLogTest(TestCase):
+    def test_estimate_within_error_bound(self):
+        sketch = HyperLogLog().update(range(50000))
+        self.assertAlmostEqual(sketch.cardinality(), 50000, delta=50000 * relative_error() * 3)
+
+    def test_merge_and_serialization(self):
+        left = HyperLogLog().update(range(0, 30000))
+        right = HyperLogLog.from_bytes(HyperLogLog().update(range(20000, 50000)).to_bytes())
+        union = HyperLogLog().update(range(50000))
+        self.assertEqual(left.merge(right).registers, union.registers)
+
+    def test_union(self):
+        sketches = [HyperLogLog().update(range(start, start + 3000)) for start in range(0, 30000, 1000)]
+        merged = HyperLogLog()
+        for sketch in sketches:
+            merged.merge(sketch)
+        self.assertEqual(HyperLogLog.union(sketches).registers, merged.registers)
+        self.assertEqual(HyperLogLog.union([]).registers, HyperLogLog().registers)
+        with self.assertRaises(ValueError):
+            HyperLogLog.union([HyperLogLog(precision=10)])
+
+
+@override_settings(TRAFFIC_PRESENCE={'BACKEND': 'traffic.presence.MemoryPresenceBackend', 'WINDOW': 300})
+class ActiveUsersPresenceTest(TestCase):
+    """Онлайн-статус и число пользователей онлайн берутся из трекера присутствия."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='tester', password='tester')
+        cls.other_user = User.objects.create_user(username='other', password='other')
+
+    def get(self):
+        request = APIRequestFactory().get('/', {'sort': 'username'})
+        force_authenticate(request, user=self.user)
+        return ActiveUsersView.as_view()(request)
+
+    def test_online_from_presence(self):
+        tracker = get_presence_tracker()
+        tracker.touch(self.other_user.id, 'session-1')
+        tracker.touch(self.user.id, 'session-2', timezone.now() - timedelta(minutes=10))
+        tracker.touch(None, 'guest-session')
+
+        response = self.get()
+        self.assertEqual(response.data['online_users_count'], 1)
+        self.assertEqual(
+            {user['username']: user['is_online'] for user in response.data['registered_users']},
+            {'other': True, 'tester': False},
+        )
+        self.assertEqual(tracker.online_guests_count(), 1)
+
+    def test_nobody_online(self):
+        response = self.get()
+        self.assertEqual(response.data['online_users_count'], 0)
+        self.assertFalse(any(user['is_online'] for user in response.data['registered_users']))
+
+
+class PresenceCircuitBreakerTest(SimpleTestCase):
+    """
+    После ошибки хранилища отметки пропускаются, а чтения сразу возвращают None RETRY_INTERVAL секунд,
+    затем хранилище снова используется.
+    """
+
+    def test_retry_interval(self):
+        backend = MemoryPresenceBackend()
+        tracker = PresenceTracker(backend, retry_interval=30)
+        with mock.patch.object(backend, 'touch', side_effect=ConnectionError) as touch, \
+                mock.patch('traffic.presence.time.monotonic', return_value=1000):
+            with self.assertRaises(ConnectionError):
+                tracker.touch(1, 'session')
+            self.assertFalse(tracker.touch(1, 'session'))
+            self.assertEqual(touch.call_count, 1)
+
+        with mock.patch('traffic.presence.time.monotonic', return_value=1031):
+            self.assertTrue(tracker.touch(1, 'session'))
+        self.assertEqual(list(tracker.online_user_ids()), [1])
+
+    def test_reads_skip_open_circuit(self):
+        backend = MemoryPresenceBackend()
+        tracker = PresenceTracker(backend, retry_interval=30)
+        with mock.patch.object(backend, 'members', side_effect=ConnectionError) as members, \
+                mock.patch.object(backend, 'count', side_effect=ConnectionError) as count, \
+                mock.patch('traffic.presence.time.monotonic', return_value=1000):
+            with self.assertRaises(ConnectionError):
+                tracker.online_user_ids()
+            # Цепь разомкнута и для чтений, и для отметок: хранилище больше не опрашивается
+            self.assertIsNone(tracker.online_user_ids())
+            self.assertIsNone(tracker.online_users_count())
+            self.assertFalse(tracker.touch(1, 'session'))
+            self.assertEqual((members.call_count, count.call_count), (1, 0))
+
+        with mock.patch('traffic.presence.time.monotonic', return_value=1031):
+            self.assertEqual(tracker.online_users_count(), 0)
+
+
+@override_settings(TRAFFIC_PRESENCE={'BACKEND': 'traffic.presence.MemoryPresenceBackend'})
+class UserActivitySummaryTest(TestCase):
+    """Сводка активности обновляется только для пользователей с новыми хитами, таблица пользователей читает её."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='tester', password='tester', email='tester@example.com')
+        cls.other_user = User.objects.create_user(username='other', password='other', email='other@example.com')
+
+    def visit(self, user, session_key, start_time, time_on_site):
+        Visitor.objects.create(
+            session_key=session_key, user=user, ip_address='10.0.0.1', start_time=start_time,
+            time_on_site=time_on_site, end_time=start_time + timedelta(seconds=time_on_site),
+        )
+        TrafficStat.objects.create(ip_address='10.0.0.1', user=user, session_id=session_key, created_at=start_time)
+
+    def get(self, **params):
+        request = APIRequestFactory().get('/', params)
+        force_authenticate(request, user=self.user)
+        return ActiveUsersView.as_view()(request)
+
+    def test_incremental_update(self):
+        current_time = timezone.now()
+        self.visit(self.user, 'a', current_time - timedelta(days=1), 100)
+        self.visit(self.user, 'b', current_time - timedelta(days=2), 300)
+        self.visit(self.user, 'old', current_time - timedelta(days=30), 1000)
+
+        self.assertEqual(update_user_activity(settle_seconds=0), 2)
+        summary = UserActivitySummary.objects.get(user=self.user)
+        self.assertEqual((summary.visit_count, summary.total_time_on_site, summary.avg_time_on_site), (2, 400, 200))
+        self.assertEqual(summary.last_hit_at, current_time - timedelta(days=1))
+
+        # Следующее обновление пересчитывает только пользователя с новыми хитами
+        self.visit(self.other_user, 'c', current_time - timedelta(hours=1), 60)
+        self.assertEqual(update_user_activity(settle_seconds=0), 1)
+        self.assertEqual(UserActivitySummary.objects.get(user=self.other_user).visit_count, 1)
+
+        with self.assertNumQueries(2):
+            response = self.get(sort='-visit_count')
+        self.assertEqual([user['username'] for user in response.data['registered_users']], ['tester', 'other'])
+        response = self.get(search='OTHER@')
+        self.assertEqual([user['username'] for user in response.data['registered_users']], ['other'])
@@ -1,14 +1,24 @@
 from django.urls import path
-from .views import DailyTrafficStats, WeeklyTrafficStats, MonthlyTrafficStats, YearlyTrafficStats, ActiveUsersView, \
-    UserRequestLogView, index, StatsView, user_requests
+from .views import TrafficSeriesView, TrafficBreakdownView, TrafficSessionsView, TrafficFunnelView, \
+    TrafficRetentionView, DailyTrafficStats, WeeklyTrafficStats, MonthlyTrafficStats, YearlyTrafficStats, \
+    ActiveUsersView, UserRequestLogView, TrafficExportView, TrafficEventsView, index, StatsView, user_requests, \
+    live_traffic
 
 urlpatterns = [
+    path('series/', TrafficSeriesView.as_view(), name='traffic-series'),
+    path('breakdown/', TrafficBreakdownView.as_view(), name='traffic-breakdown'),
+    path('sessions/', TrafficSessionsView.as_view(), name='traffic-sessions'),
+    path('funnel/', TrafficFunnelView.as_view(), name='traffic-funnel'),
+    path('retention/', TrafficRetentionView.as_view(), name='traffic-retention'),
     path('daily/', DailyTrafficStats.as_view(), name='daily-traffic-stats'),
     path('weekly/', WeeklyTrafficStats.as_view(), name='weekly-traffic-stats'),
     path('monthly/', MonthlyTrafficStats.as_view(), name='monthly-traffic-stats'),
     path('yearly/', YearlyTrafficStats.as_view(), name='yearly-traffic-stats'),
     path('active-users/', ActiveUsersView.as_view(), name='active-users'),
     path('user-requests/<int:user_id>/', UserRequestLogView.as_view(), name='user_log_requests'),
+    path('export/', TrafficExportView.as_view(), name='traffic-export'),
+    path('events/', TrafficEventsView.as_view(), name='traffic-events'),
+    path('live/', live_traffic, name='traffic-live'),
 
     path('', index, name='index-monitoring'),
     path('stats/', StatsView.as_view(), name='stats'),
@@ -0,0 +1,71 @@
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+UNKNOWN_FAMILY = 'Other'
+
+UserAgentFamilies = namedtuple('UserAgentFamilies', ('browser', 'os', 'device'))
+
+# Правила проверяются по порядку, побеждает первое совпадение: строки Chrome содержат Safari, Edge и Opera - Chrome,
+# строки iOS - "like Mac OS X", Android - Linux
+BROWSER_RULES = (
+    ('Googlebot', r'Googlebot'),
+    ('Bingbot', r'bingbot'),
+    ('YandexBot', r'YandexBot'),
+    ('Yandex Browser', r'YaBrowser/'),
+    ('Edge', r'Edg(e|A|iOS)?/'),
+    ('Opera', r'OPR/|Opera'),
+    ('Samsung Internet', r'SamsungBrowser/'),
+    ('Firefox', r'Firefox/|FxiOS/'),
+    ('Chrome', r'Chrome/|CriOS/'),
+    ('Safari', r'Version/[\d.]+.*Safari/'),
+    ('WebView', r'AppleWebKit/.*Mobile/'),
+    ('Internet Explorer', r'MSIE |Trident/'),
+)
+
+OS_RULES = (
+    ('Windows Phone', r'Windows Phone'),
+    ('Windows', r'Windows'),
+    ('iOS', r'iPhone|iPad|iPod'),
+    ('Android', r'Android'),
+    ('Chrome OS', r'CrOS'),
+    ('macOS', r'Mac OS X|Macintosh'),
+    ('Linux', r'Linux|X11'),
+)
+
+DEVICE_RULES = (
+    ('Bot', r'bot|crawl|spider|slurp|facebookexternalhit|HeadlessChrome'),
+    ('Tablet', r'iPad|Tablet|Android(?!.*Mobile)'),
+    ('Mobile', r'Mobi|iPhone|iPod|Windows Phone'),
+)
+
+_BROWSERS = [(family, re.compile(pattern)) for family, pattern in BROWSER_RULES]
+_OS = [(family, re.compile(pattern)) for family, pattern in OS_RULES]
+_DEVICES = [(family, re.compile(pattern, re.IGNORECASE)) for family, pattern in DEVICE_RULES]
+
+
+def _match(rules, value, default):
+    return next((family for family, pattern in rules if pattern.search(value)), default)
+
+
+@lru_cache(maxsize=4096)
+def parse_user_agent(value):
+    """
+    Семейства браузера, ОС и устройства по строке User-Agent.
+    Разбираются только распространённые семейства, остальное - Other. Результат кэшируется в процессе,
+    а в БД хранится в самой записи справочника UserAgent, поэтому каждая строка разбирается один раз.
+    """
+    if not value:
+        return UserAgentFamilies(UNKNOWN_FAMILY, UNKNOWN_FAMILY, UNKNOWN_FAMILY)
+
+    device = _match(_DEVICES, value, None)
+    if device is None:
+        device = 'Desktop' if _match(_OS, value, None) in ('Windows', 'macOS', 'Linux', 'Chrome OS') else UNKNOWN_FAMILY
+
+    browser = _match(_BROWSERS, value, 'Other bot' if device == 'Bot' else UNKNOWN_FAMILY)
+    return UserAgentFamilies(browser, _match(_OS, value, UNKNOWN_FAMILY), device)
+
+
+def user_agent_fields(value):
+    """Поля browser, os, device новой записи UserAgent."""
+    return parse_user_agent(value)._asdict()
@@ -1,430 +1,887 @@
-from calendar import monthrange
+import logging
 from collections import OrderedDict
 from babel.dates import format_date
+from django.conf import settings
+from django.db import connection
 from django.contrib.auth import get_user_model
-from django.core.paginator import Paginator, PageNotAnInteger, EmptyPage
+from django.core.paginator import Paginator
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponse, HttpResponseForbidden, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, get_object_or_404
-from django.utils.timezone import now, localtime
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.crypto import constant_time_compare
+from django.utils.http import http_date
+from django.utils.timezone import now, localtime, get_current_timezone_name
 from django.views.generic import TemplateView
+from adrf import generics as async_generics
+from adrf.views import APIView as AsyncAPIView
+from asgiref.sync import sync_to_async
 from rest_framework import generics
+from rest_framework.authentication import SessionAuthentication
 from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import JSONParser
+from rest_framework.permissions import AllowAny
 from rest_framework.views import APIView
 from rest_framework.pagination import PageNumberPagination
-from .models import TrafficStat
+from .models import TrafficStat, UserActivitySummary
+from .breakdown import DIMENSIONS as BREAKDOWN_DIMENSIONS, MAX_BREAKDOWN_LIMIT, top_keys
+from .caching import get_stats_cache_settings, get_or_compute, is_closed_period, period_cache_key
+from .events import event_hits, get_events_settings, record_events, validate_events
+from .export import EXPORT_FORMATS, pyarrow
+from .funnels import DEFAULT_FUNNEL_WINDOW, MAX_FUNNEL_STEPS, MAX_FUNNEL_WINDOW, funnel
+from .hll import relative_error
+from .live import LiveFeed
+from .metrics import get_metrics_registry, get_metrics_settings
+from .pagination import KeysetPage, KeysetPagination, estimate_count
+from .presence import get_presence_tracker
+from .retention import (
+    DEFAULT_RETENTION_PERIODS, MAX_RETENTION_PERIODS, RETENTION_GRANULARITIES, default_retention_range,
+    retention_matrix,
+)
+from .sessions import MAX_SESSIONS_LIMIT, session_stats
+from .stats import get_period_stats, empty_period_stats, max_bucket_count, SERIES_GRANULARITIES
+from .visitors import get_visitor_id_settings, identify_visitor
 from tracking.models import Visitor
 from .serializers import TrafficStatSerializer
 from rest_framework.response import Response
 from rest_framework import status
-from django.db.models import Count, Max, F, Avg, Sum
+from django.db.models import Count, Max, F, Avg, Sum, Q, ExpressionWrapper, BooleanField
 from django.utils import timezone
 from babel import Locale
 from django.db.models.functions import TruncDay, TruncMonth, TruncHour
-from datetime import datetime, timedelta, date
+from datetime import datetime, timedelta, date, time
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
 
 User = get_user_model()
 
+logger = logging.getLogger(__name__)
+
+
+MONTH_NAMES = [
+    "январь", "февраль", "март", "апрель", "май", "июнь",
+    "июль", "август", "сентябрь", "октябрь", "ноябрь", "декабрь",
+]
+
+
+UNIQUES_MODES = ('exact', 'approximate')
+
+UNIQUES_PARAMETER = openapi.Parameter(
+    name='uniques',
+    in_=openapi.IN_QUERY,
+    description=(
+        "Подсчёт уникальных пользователей и гостей: exact (по умолчанию) или approximate - "
+        f"по скетчам HyperLogLog, стандартная ошибка ~{relative_error():.1%}, быстрее на больших периодах"
+    ),
+    type=openapi.TYPE_STRING,
+    enum=list(UNIQUES_MODES),
+    required=False
+)
+
+
+SERIES_DATETIME_FORMAT = "YYYY-MM-DD или YYYY-MM-DDTHH:MM[:SS][±HH:MM]"
+
+RANGE_PARAMETERS = [
+    openapi.Parameter(
+        name='start',
+        in_=openapi.IN_QUERY,
+        description=f"Начало интервала, включительно: {SERIES_DATETIME_FORMAT}. Без смещения - время в зоне tz.",
+        type=openapi.TYPE_STRING,
+        required=True
+    ),
+    openapi.Parameter(
+        name='end',
+        in_=openapi.IN_QUERY,
+        description=f"Конец интервала, не включается: {SERIES_DATETIME_FORMAT}.",
+        type=openapi.TYPE_STRING,
+        required=True
+    ),
+    openapi.Parameter(
+        name='tz',
+        in_=openapi.IN_QUERY,
+        description="Временная зона IANA, например Europe/Moscow. По умолчанию TIME_ZONE.",
+        type=openapi.TYPE_STRING,
+        required=False
+    ),
+]
+
+
+def parse_series_datetime(value, name, zone):
+    """Граница интервала: дата или дата и время ISO 8601; без смещения - локальное время зоны zone."""
+    try:
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        raise ValidationError({"error": f"Неверный формат {name}. Используйте {SERIES_DATETIME_FORMAT}"})
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment, zone)
+    return moment
+
+
+def parse_range(params):
+    """Интервал [start, end) и временная зона из параметров запроса: (start, end, tz)."""
+    tz = params.get('tz') or timezone.get_current_timezone_name()
+    try:
+        zone = ZoneInfo(tz)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValidationError({"error": f"Неизвестная временная зона {tz}"})
+
+    if not params.get('start') or not params.get('end'):
+        raise ValidationError({"error": "Параметры start и end обязательны"})
+    start = parse_series_datetime(params['start'], 'start', zone)
+    end = parse_series_datetime(params['end'], 'end', zone)
+    if end <= start:
+        raise ValidationError({"error": "end должен быть позже start"})
+
+    return start, end, tz
+
 
-class DailyTrafficStats(generics.ListAPIView):
+class CachedStatsMixin:
+    """
+    Кеширование ответа статистики по ключу (эндпоинт, интервал, параметры): закрытый интервал - на CLOSED_TTL
+    секунд или до опоздавших хитов, текущий - на CURRENT_TTL секунд. Клиент с If-None-Match / If-Modified-Since получает 304.
+    """
+
+    def cached_response(self, request, start, end, variant, compute):
+        cache_settings = get_stats_cache_settings()
+        if not cache_settings['ENABLED']:
+            response_status, data = compute()
+            return Response(data, status=response_status)
+
+        closed = is_closed_period(end)
+        use_rollups = getattr(settings, 'TRAFFIC_USE_ROLLUPS', True)
+        entry = get_or_compute(
+            period_cache_key(type(self).__name__, start, end, *variant, use_rollups),
+            compute,
+            cache_settings['CLOSED_TTL'] if closed else cache_settings['CURRENT_TTL'],
+        )
+
+        response = Response(entry['data'], status=entry['status'])
+        response['ETag'] = entry['etag']
+        response['Last-Modified'] = http_date(entry['last_modified'])
+        if closed:
+            patch_cache_control(response, private=True, max_age=3600)
+        else:
+            patch_cache_control(response, private=True, no_cache=True)
+
+        return get_conditional_response(
+            request, etag=entry['etag'], last_modified=entry['last_modified'], response=response
+        )
+
+
+class TrafficSeriesView(CachedStatsMixin, async_generics.ListAPIView):
+    """
+    Временной ряд статистики за произвольный интервал [start, end) с гранулярностью от минуты до месяца
+    в указанной временной зоне. Корзины строятся и заполняются нулями в SQL (date_trunc + generate_series),
+    весь ряд считается одним запросом get_period_stats.
+    Обработчики асинхронные: под ASGI запрос не занимает поток, пока ждёт кеш и БД.
+    """
     serializer_class = TrafficStatSerializer
 
+    def get_series(self, request):
+        """Возвращает (start, end, granularity, tz, label)."""
+        granularity = request.query_params.get('granularity', 'day')
+        if granularity not in SERIES_GRANULARITIES:
+            raise ValidationError({
+                "error": f"Неверное значение granularity. Используйте {', '.join(SERIES_GRANULARITIES)}"
+            })
+
+        start, end, tz = parse_range(request.query_params)
+
+        max_buckets = getattr(settings, 'TRAFFIC_SERIES_MAX_BUCKETS', 5000)
+        if max_bucket_count(start, end, granularity) > max_buckets:
+            raise ValidationError({
+                "error": f"Слишком много корзин для granularity={granularity}, не больше {max_buckets}. "
+                         f"Сократите интервал или укрупните гранулярность"
+            })
+
+        return start, end, granularity, tz, f"{start.isoformat()} - {end.isoformat()}"
+
+    def is_approximate(self, request):
+        uniques = request.query_params.get('uniques', 'exact')
+        if uniques not in UNIQUES_MODES:
+            raise ValidationError({"error": "Неверное значение uniques. Используйте exact или approximate"})
+        return uniques == 'approximate'
+
+    def compute(self, start, end, granularity, tz, label, approximate):
+        """Возвращает (status, data) ответа за интервал."""
+        stats = get_period_stats(start, end, granularity, tz=tz, approximate=approximate)
+        zone = ZoneInfo(tz)
+
+        return status.HTTP_200_OK, {
+            'start': start.isoformat(),
+            'end': end.isoformat(),
+            'granularity': granularity,
+            'tz': tz,
+            'series': [
+                {'bucket': timezone.make_aware(bucket, zone).isoformat(), **values}
+                for bucket, values in stats.items()
+            ],
+        }
+
     @swagger_auto_schema(
         manual_parameters=[
+            *RANGE_PARAMETERS,
             openapi.Parameter(
-                name='date',
+                name='granularity',
                 in_=openapi.IN_QUERY,
-                description="Дата в формате YYYY-MM-DD. Если не указана, статистика будет по текущему дню.",
+                description="Размер корзины, по умолчанию day. Первая и последняя корзины могут быть неполными.",
                 type=openapi.TYPE_STRING,
-                format=openapi.FORMAT_DATE,
+                enum=list(SERIES_GRANULARITIES),
                 required=False
-            )
+            ),
+            UNIQUES_PARAMETER,
         ]
     )
-    def get(self, request, *args, **kwargs):
-        date_str = request.query_params.get('date', None)
+    async def get(self, request, *args, **kwargs):
+        # Кеш, БД и построение ответа синхронные, в цикле событий остаётся только ожидание
+        return await sync_to_async(self.build_response)(request)
 
-        if date_str:
-            try:
-                selected_date = datetime.strptime(date_str, '%Y-%m-%d').date()
-            except ValueError:
-                return Response(
-                    {"error": "Неверный формат даты. Используйте YYYY-MM-DD"},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-        else:
-            selected_date = timezone.now().date()
+    def build_response(self, request):
+        start, end, granularity, tz, label = self.get_series(request)
+        approximate = self.is_approximate(request)
 
-        start_of_day = timezone.make_aware(datetime.combine(selected_date, datetime.min.time()))
-        end_of_day = timezone.make_aware(datetime.combine(selected_date, datetime.max.time()))
+        return self.cached_response(
+            request, start, end, (granularity, tz, approximate),
+            lambda: self.compute(start, end, granularity, tz, label, approximate),
+        )
 
-        queryset = TrafficStat.objects.filter(created_at__range=(start_of_day, end_of_day))
-        queryset = queryset.annotate(hour=TruncHour('created_at')).values('hour').annotate(count=Count('id')).order_by(
-            'hour')
 
-        if not queryset.exists():
-            return Response(
-                {"error": f"Нет данных по дате {selected_date}"},
-                status=status.HTTP_404_NOT_FOUND
-            )
+class TrafficBreakdownView(CachedStatsMixin, AsyncAPIView):
+    """
+    Самые частые значения измерения за интервал [start, end): пути, User-Agent, их семейства (браузер, ОС,
+    устройство), IP и события - с числом хитов и уникальных посетителей. Полные сутки читаются из суточных
+    сводок частых значений (traffic/breakdown.py), а не группировкой TrafficStat за весь интервал.
+    """
 
-        data = []
-        all_hours = {hour: {"count": 0, "unique_registered_users": 0, "unique_guests": 0} for hour in range(24)}
-        for stat in queryset:
-            all_hours[stat['hour'].hour] = {
-                "count": stat['count'],
-                "unique_registered_users": TrafficStat.objects.filter(
-                    created_at__hour=stat['hour'].hour, created_at__date=selected_date, user__isnull=False
-                ).values('user').distinct().count(),
-                "unique_guests": TrafficStat.objects.filter(
-                    created_at__hour=stat['hour'].hour, created_at__date=selected_date, user_id__isnull=True
-                ).values('ip_address').distinct().count(),
+    @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter(
+                name='dimension',
+                in_=openapi.IN_QUERY,
+                description="Измерение разбивки",
+                type=openapi.TYPE_STRING,
+                enum=list(BREAKDOWN_DIMENSIONS),
+                required=True
+            ),
+            *RANGE_PARAMETERS,
+            openapi.Parameter(
+                name='limit',
+                in_=openapi.IN_QUERY,
+                description=f"Число значений, по умолчанию 10, не больше {MAX_BREAKDOWN_LIMIT}",
+                type=openapi.TYPE_INTEGER,
+                required=False
+            ),
+        ]
+    )
+    async def get(self, request, *args, **kwargs):
+        return await sync_to_async(self.build_response)(request)
+
+    def build_response(self, request):
+        dimension = request.query_params.get('dimension')
+        if dimension not in BREAKDOWN_DIMENSIONS:
+            raise ValidationError({
+                "error": f"Неверное значение dimension. Используйте {', '.join(BREAKDOWN_DIMENSIONS)}"
+            })
+        limit = parse_limit(request.query_params, MAX_BREAKDOWN_LIMIT)
+
+        start, end, tz = parse_range(request.query_params)
+
+        def compute():
+            items, approximate = top_keys(dimension, start, end, limit)
+            return status.HTTP_200_OK, {
+                'dimension': dimension,
+                'start': start.isoformat(),
+                'end': end.isoformat(),
+                'approximate': approximate,
+                'items': items,
             }
 
-        for hour, values in all_hours.items():
-            data.append({
-                'hour': hour,
-                'count': values["count"],
-                'unique_registered_users': values["unique_registered_users"],
-                'unique_guests': values["unique_guests"]
-            })
+        return self.cached_response(request, start, end, (dimension, limit), compute)
 
-        return Response(data, status=status.HTTP_200_OK)
 
+def parse_limit(params, maximum):
+    try:
+        limit = int(params.get('limit', 10))
+    except ValueError:
+        raise ValidationError({"error": "limit должен быть целым числом"})
+    if not 1 <= limit <= maximum:
+        raise ValidationError({"error": f"limit должен быть от 1 до {maximum}"})
+    return limit
 
-class WeeklyTrafficStats(generics.ListAPIView):
-    serializer_class = TrafficStatSerializer
+
+class TrafficSessionsView(CachedStatsMixin, AsyncAPIView):
+    """
+    Сессии за интервал [start, end): число, доля отказов, средняя длительность, просмотров на сессию,
+    частые страницы входа и выхода и начальные пути. Сессии строятся оконными функциями по TrafficStat,
+    закрытые сутки UTC читаются из сводки TrafficSessionSummary (traffic/sessions.py).
+    """
 
     @swagger_auto_schema(
         manual_parameters=[
+            *RANGE_PARAMETERS,
             openapi.Parameter(
-                name='week',
+                name='limit',
                 in_=openapi.IN_QUERY,
-                description="Неделя в формате YYYY-WW. Если не указан, статистика по текущей неделе.",
-                type=openapi.TYPE_STRING,
-                format=openapi.FORMAT_DATE,
+                description=f"Число страниц входа, выхода и путей, по умолчанию 10, не больше {MAX_SESSIONS_LIMIT}",
+                type=openapi.TYPE_INTEGER,
                 required=False
-            )
+            ),
         ]
     )
-    def get(self, request, *args, **kwargs):
-        week_str = request.query_params.get('week', None)
+    async def get(self, request, *args, **kwargs):
+        return await sync_to_async(self.build_response)(request)
+
+    def build_response(self, request):
+        limit = parse_limit(request.query_params, MAX_SESSIONS_LIMIT)
+        start, end, tz = parse_range(request.query_params)
+
+        def compute():
+            return status.HTTP_200_OK, {
+                'start': start.isoformat(),
+                'end': end.isoformat(),
+                **session_stats(start, end, limit),
+            }
 
-        if week_str:
-            try:
-                year, week = map(int, week_str.split('-'))
-                selected_date = date.fromisocalendar(year, week, 1)
-                start_of_week = timezone.make_aware(datetime.combine(selected_date, datetime.min.time()),
-                                                    timezone.get_current_timezone())
+        return self.cached_response(request, start, end, (limit,), compute)
 
-            except ValueError:
-                return Response(
-                    {"error": "Неверный формат недели. Используйте YYYY-WW"},
-                    status=status.HTTP_400_BAD_REQUEST
+
+class TrafficFunnelView(CachedStatsMixin, AsyncAPIView):
+    """
+    Воронка за интервал [start, end): число посетителей, прошедших шаги step по порядку в пределах окна window.
+    Хиты шагов читаются одним проходом по серверному курсору в порядке (session_id, created_at) (traffic/funnels.py).
+    """
+
+    @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter(
+                name='step',
+                in_=openapi.IN_QUERY,
+                description=(
+                    f"Шаг воронки, параметр повторяется от 2 до {MAX_FUNNEL_STEPS} раз: путь страницы (/cart/) "
+                    f"или имя клиентского события (signup)"
+                ),
+                type=openapi.TYPE_ARRAY,
+                items=openapi.Items(type=openapi.TYPE_STRING),
+                collection_format='multi',
+                required=True
+            ),
+            *RANGE_PARAMETERS,
+            openapi.Parameter(
+                name='window',
+                in_=openapi.IN_QUERY,
+                description=(
+                    f"Наибольшее время от первого шага до последнего, минуты, по умолчанию {DEFAULT_FUNNEL_WINDOW}, "
+                    f"не больше {MAX_FUNNEL_WINDOW}"
+                ),
+                type=openapi.TYPE_INTEGER,
+                required=False
+            ),
+        ]
+    )
+    async def get(self, request, *args, **kwargs):
+        return await sync_to_async(self.build_response)(request)
+
+    def build_response(self, request):
+        steps = request.query_params.getlist('step')
+        if not 2 <= len(steps) <= MAX_FUNNEL_STEPS or not all(steps):
+            raise ValidationError({"error": f"Укажите от 2 до {MAX_FUNNEL_STEPS} непустых параметров step"})
+        try:
+            window = int(request.query_params.get('window', DEFAULT_FUNNEL_WINDOW))
+        except ValueError:
+            raise ValidationError({"error": "window должен быть целым числом минут"})
+        if not 1 <= window <= MAX_FUNNEL_WINDOW:
+            raise ValidationError({"error": f"window должен быть от 1 до {MAX_FUNNEL_WINDOW} минут"})
+
+        start, end, tz = parse_range(request.query_params)
+
+        def compute():
+            return status.HTTP_200_OK, {
+                'start': start.isoformat(),
+                'end': end.isoformat(),
+                'window': window,
+                'steps': funnel(steps, start, end, timedelta(minutes=window)),
+            }
+
+        return self.cached_response(request, start, end, (tuple(steps), window), compute)
+
+
+class TrafficRetentionView(CachedStatsMixin, AsyncAPIView):
+    """
+    Удержание когорт: пользователи по неделе или месяцу первого визита и доля активных в каждом следующем периоде.
+    Матрица считается одним запросом по Visitor, почасовым агрегатам и хвосту TrafficStat (traffic/retention.py)
+    и кешируется как статистика за период.
+    """
+
+    @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter(
+                name='granularity',
+                in_=openapi.IN_QUERY,
+                description="Период когорты, по умолчанию week",
+                type=openapi.TYPE_STRING,
+                enum=list(RETENTION_GRANULARITIES),
+                required=False
+            ),
+            *[
+                openapi.Parameter(
+                    name=parameter.name, in_=parameter.in_, type=parameter.type, required=False,
+                    description=f"{parameter.description} По умолчанию - последние {DEFAULT_RETENTION_PERIODS} "
+                                f"периодов, включая текущий.",
                 )
+                for parameter in RANGE_PARAMETERS
+            ],
+        ]
+    )
+    async def get(self, request, *args, **kwargs):
+        return await sync_to_async(self.build_response)(request)
+
+    def build_response(self, request):
+        granularity = request.query_params.get('granularity', 'week')
+        if granularity not in RETENTION_GRANULARITIES:
+            raise ValidationError({
+                "error": f"Неверное значение granularity. Используйте {', '.join(RETENTION_GRANULARITIES)}"
+            })
+
+        if request.query_params.get('start') or request.query_params.get('end'):
+            start, end, tz = parse_range(request.query_params)
         else:
-            now = timezone.localtime(timezone.now())
+            start, end = default_retention_range(granularity)
+            tz = get_current_timezone_name()
+        if max_bucket_count(start, end, granularity) > MAX_RETENTION_PERIODS:
+            raise ValidationError({"error": f"Не больше {MAX_RETENTION_PERIODS} периодов"})
+
+        def compute():
+            return status.HTTP_200_OK, {
+                'granularity': granularity,
+                'start': start.isoformat(),
+                'end': end.isoformat(),
+                'tz': tz,
+                'cohorts': retention_matrix(start, end, granularity, tz),
+            }
 
-            iso_year, iso_week, iso_weekday = now.isocalendar()
+        return self.cached_response(request, start, end, (granularity, tz), compute)
 
-            start_of_week = now - timezone.timedelta(days=iso_weekday - 1)
-            start_of_week = timezone.make_aware(datetime.combine(start_of_week.date(), datetime.min.time()),
-                                                timezone.get_current_timezone())
 
-        end_of_week = start_of_week + timezone.timedelta(days=6, hours=23, minutes=59, seconds=59)
-        end_of_week = timezone.make_aware(datetime.combine(end_of_week.date(), datetime.max.time()),
-                                          timezone.get_current_timezone())
+class PeriodTrafficStatsView(TrafficSeriesView):
+    """
+    Статистика за календарный период - обёртка над TrafficSeriesView в текущей временной зоне.
+    Наследник разбирает период из параметров (get_period) и форматирует корзину (format_bucket).
+    """
+    granularity = None
+
+    def get_period(self, request):
+        """Возвращает (first_day, next_day, label): первый день периода и первый день следующего."""
+        raise NotImplementedError
+
+    def format_bucket(self, bucket, values):
+        raise NotImplementedError
+
+    def no_data_message(self, label):
+        return f"Нет данных за период {label}"
+
+    def get_series(self, request):
+        first_day, next_day, label = self.get_period(request)
+        return (
+            timezone.make_aware(datetime.combine(first_day, datetime.min.time())),
+            timezone.make_aware(datetime.combine(next_day, datetime.min.time())),
+            self.granularity,
+            timezone.get_current_timezone_name(),
+            label,
+        )
 
-        queryset = TrafficStat.objects.filter(created_at__range=(start_of_week, end_of_week))
-        queryset = queryset.annotate(day=TruncDay('created_at')).values('day').annotate(count=Count('id')).order_by('day')
+    def compute(self, start, end, granularity, tz, label, approximate):
+        stats = get_period_stats(start, end, granularity, tz=tz, approximate=approximate)
 
-        if not queryset.exists():
-            return Response(
-                {"error": f"Нет данных для недели {week_str}"},
-                status=status.HTTP_404_NOT_FOUND
-            )
+        if not any(values['count'] for values in stats.values()):
+            return status.HTTP_404_NOT_FOUND, {"error": self.no_data_message(label)}
+
+        return status.HTTP_200_OK, [self.format_bucket(bucket, values) for bucket, values in stats.items()]
+
+
+class DailyTrafficStats(PeriodTrafficStatsView):
+    granularity = 'hour'
+
+    def get_period(self, request):
+        date_str = request.query_params.get('date', None)
+
+        if date_str:
+            try:
+                selected_date = datetime.strptime(date_str, '%Y-%m-%d').date()
+            except ValueError:
+                raise ValidationError({"error": "Неверный формат даты. Используйте YYYY-MM-DD"})
+        else:
+            selected_date = timezone.localdate()
+
+        return selected_date, selected_date + timedelta(days=1), selected_date
+
+    def no_data_message(self, label):
+        return f"Нет данных по дате {label}"
 
-        all_days = {
-            (start_of_week + timedelta(days=i)).date(): {
-                "count": 0,
-                "unique_registered_users": 0,
-                "unique_guests": 0
-            } for i in range(7)
+    def format_bucket(self, bucket, values):
+        return {
+            'hour': bucket.hour,
+            'count': values["count"],
+            'unique_registered_users': values["unique_registered_users"],
+            'unique_guests': values["unique_guests"]
         }
 
-        for stat in queryset:
-            stat_date = stat['day'].date()
-            all_days[stat_date]["count"] = stat['count']
-            all_days[stat_date]["unique_registered_users"] = TrafficStat.objects.filter(
-                created_at__date=stat_date, user__isnull=False
-            ).values('user').distinct().count()
-            all_days[stat_date]["unique_guests"] = TrafficStat.objects.filter(
-                created_at__date=stat_date, user_id__isnull=True
-            ).values('ip_address').distinct().count()
-
-        data = []
-        locale = Locale('ru', 'RU')
-        for day, values in all_days.items():
-            data.append({
-                "day": format_date(day, format='long', locale=locale),
-                "day_of_week": format_date(day, format='EEEE', locale=locale),
-                "count": values["count"],
-                "unique_registered_users": values["unique_registered_users"],
-                "unique_guests": values["unique_guests"]
-            })
+    @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter(
+                name='date',
+                in_=openapi.IN_QUERY,
+                description="Дата в формате YYYY-MM-DD. Если не указана, статистика будет по текущему дню.",
+                type=openapi.TYPE_STRING,
+                format=openapi.FORMAT_DATE,
+                required=False
+            ),
+            UNIQUES_PARAMETER,
+        ]
+    )
+    async def get(self, request, *args, **kwargs):
+        return await super().get(request, *args, **kwargs)
 
-        return Response(data, status=status.HTTP_200_OK)
 
+class WeeklyTrafficStats(PeriodTrafficStatsView):
+    granularity = 'day'
 
-class MonthlyTrafficStats(generics.ListAPIView):
-    serializer_class = TrafficStatSerializer
+    def get_period(self, request):
+        week_str = request.query_params.get('week', None)
+
+        if week_str:
+            try:
+                year, week = map(int, week_str.split('-'))
+                start_date = date.fromisocalendar(year, week, 1)
+            except ValueError:
+                raise ValidationError({"error": "Неверный формат недели. Используйте YYYY-WW"})
+        else:
+            today = timezone.localdate()
+            start_date = today - timedelta(days=today.isoweekday() - 1)
+
+        return start_date, start_date + timedelta(days=7), week_str or start_date.strftime('%G-%V')
+
+    def no_data_message(self, label):
+        return f"Нет данных для недели {label}"
+
+    def format_bucket(self, bucket, values):
+        locale = Locale('ru', 'RU')
+        return {
+            "day": format_date(bucket.date(), format='long', locale=locale),
+            "day_of_week": format_date(bucket.date(), format='EEEE', locale=locale),
+            "count": values["count"],
+            "unique_registered_users": values["unique_registered_users"],
+            "unique_guests": values["unique_guests"]
+        }
 
     @swagger_auto_schema(
         manual_parameters=[
             openapi.Parameter(
-                name='month',
+                name='week',
                 in_=openapi.IN_QUERY,
-                description="Месяц в формате YYYY-MM. Если не указан, статистика по текущему месяцу.",
+                description="Неделя в формате YYYY-WW. Если не указан, статистика по текущей неделе.",
                 type=openapi.TYPE_STRING,
                 format=openapi.FORMAT_DATE,
                 required=False
-            )
+            ),
+            UNIQUES_PARAMETER,
         ]
     )
-    def get(self, request, *args, **kwargs):
+    async def get(self, request, *args, **kwargs):
+        return await super().get(request, *args, **kwargs)
+
+
+class MonthlyTrafficStats(PeriodTrafficStatsView):
+    granularity = 'day'
+
+    def get_period(self, request):
         month_str = request.query_params.get('month', None)
 
         if month_str:
             try:
                 selected_month = datetime.strptime(month_str, '%Y-%m')
             except ValueError:
-                return Response(
-                    {"error": "Неверный формат месяца. Используйте YYYY-MM"},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
+                raise ValidationError({"error": "Неверный формат месяца. Используйте YYYY-MM"})
         else:
-            selected_month = timezone.now()
+            selected_month = timezone.localdate()
 
-        start_of_month = timezone.make_aware(datetime(selected_month.year, selected_month.month, 1))
-        days_in_month = monthrange(selected_month.year, selected_month.month)[1]
-        next_month = selected_month.replace(month=(selected_month.month % 12) + 1)
-        end_of_month = timezone.make_aware(datetime(next_month.year, next_month.month, 1) - timezone.timedelta(days=1))
+        first_day = date(selected_month.year, selected_month.month, 1)
+        # Первое число следующего месяца, в декабре - следующего года
+        next_month = (first_day + timedelta(days=31)).replace(day=1)
 
-        queryset = TrafficStat.objects.filter(created_at__range=(start_of_month, end_of_month))
-        queryset = queryset.annotate(day=TruncDay('created_at')).values('day').annotate(count=Count('id')).order_by(
-            'day')
+        return first_day, next_month, first_day.strftime('%Y-%m')
 
-        if not queryset.exists():
-            return Response(
-                {"error": f"Нет данных для месяца {month_str or selected_month.strftime('%Y-%m')}"},
-                status=status.HTTP_404_NOT_FOUND
-            )
+    def no_data_message(self, label):
+        return f"Нет данных для месяца {label}"
 
-        all_days = {
-            (start_of_month + timedelta(days=i)).date(): {
-                "count": 0,
-                "unique_registered_users": 0,
-                "unique_guests": 0
-            } for i in range(days_in_month)
+    def format_bucket(self, bucket, values):
+        return {
+            "day": format_date(bucket.date(), format='d MMMM', locale=Locale('ru', 'RU')),  # Пример: "3 февраля"
+            "count": values["count"],
+            "unique_registered_users": values["unique_registered_users"],
+            "unique_guests": values["unique_guests"]
         }
 
-        for stat in queryset:
-            stat_date = stat['day'].date()
-            all_days[stat_date]["count"] = stat['count']
-            all_days[stat_date]["unique_registered_users"] = TrafficStat.objects.filter(
-                created_at__date=stat_date, user__isnull=False
-            ).values('user').distinct().count()
-            all_days[stat_date]["unique_guests"] = TrafficStat.objects.filter(
-                created_at__date=stat_date, user_id__isnull=True
-            ).values('ip_address').distinct().count()
-
-        data = []
-        locale = Locale('ru', 'RU')
-        for day, values in all_days.items():
-            data.append({
-                "day": format_date(day, format='d MMMM', locale=locale),  # Пример: "3 февраля"
-                "count": values["count"],
-                "unique_registered_users": values["unique_registered_users"],
-                "unique_guests": values["unique_guests"]
-            })
-
-        return Response(data, status=status.HTTP_200_OK)
-
-
-class YearlyTrafficStats(generics.ListAPIView):
-    serializer_class = TrafficStatSerializer
-
     @swagger_auto_schema(
         manual_parameters=[
             openapi.Parameter(
-                name='year',
+                name='month',
                 in_=openapi.IN_QUERY,
-                description="Год в формате YYYY. Если не указан, статистика по текущему году.",
+                description="Месяц в формате YYYY-MM. Если не указан, статистика по текущему месяцу.",
                 type=openapi.TYPE_STRING,
                 format=openapi.FORMAT_DATE,
                 required=False
-            )
+            ),
+            UNIQUES_PARAMETER,
         ]
     )
-    def get(self, request, *args, **kwargs):
+    async def get(self, request, *args, **kwargs):
+        return await super().get(request, *args, **kwargs)
+
+
+class YearlyTrafficStats(PeriodTrafficStatsView):
+    granularity = 'month'
+
+    def get_period(self, request):
         year_str = request.query_params.get('year', None)
 
         if year_str:
             try:
-                selected_year = datetime.strptime(year_str, '%Y')
+                selected_year = datetime.strptime(year_str, '%Y').year
             except ValueError:
-                return Response(
-                    {"error": "Неверный формат года. Используйте YYYY"},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
+                raise ValidationError({"error": "Неверный формат года. Используйте YYYY"})
         else:
-            selected_year = timezone.now()
+            selected_year = timezone.localdate().year
 
-        start_of_year = timezone.make_aware(datetime(selected_year.year, 1, 1))
-        end_of_year = timezone.make_aware(datetime(selected_year.year, 12, 31, 23, 59, 59))
+        return date(selected_year, 1, 1), date(selected_year + 1, 1, 1), selected_year
 
-        queryset = TrafficStat.objects.filter(created_at__range=(start_of_year, end_of_year))
-        queryset = queryset.annotate(month=TruncMonth('created_at')).values('month').annotate(
-            count=Count('id')).order_by('month')
+    def no_data_message(self, label):
+        return f"Нет данных для года {label}"
 
-        if not queryset.exists():
-            return Response(
-                {"error": f"Нет данных для года {year_str or selected_year.year}"},
-                status=status.HTTP_404_NOT_FOUND
-            )
+    def format_bucket(self, bucket, values):
+        return {
+            "month": bucket.month,
+            "month_name": MONTH_NAMES[bucket.month - 1],
+            "count": values["count"],
+            "unique_registered_users": values["unique_registered_users"],
+            "unique_guests": values["unique_guests"]
+        }
 
-        data = []
-
-        all_months = [
-            {"month": 1, "month_name": "январь", "count": 0, "unique_registered_users": 0, "unique_guests": 0},
-            {"month": 2, "month_name": "февраль", "count": 0, "unique_registered_users": 0, "unique_guests": 0},
-            {"month": 3, "month_name": "март", "count": 0, "unique_registered_users": 0, "unique_guests": 0},
-            {"month": 4, "month_name": "апрель", "count": 0, "unique_registered_users": 0, "unique_guests": 0},
-            {"month": 5, "month_name": "май", "count": 0, "unique_registered_users": 0, "unique_guests": 0},
-            {"month": 6, "month_name": "июнь", "count": 0, "unique_registered_users": 0, "unique_guests": 0},
-            {"month": 7, "month_name": "июль", "count": 0, "unique_registered_users": 0, "unique_guests": 0},
-            {"month": 8, "month_name": "август", "count": 0, "unique_registered_users": 0, "unique_guests": 0},
-            {"month": 9, "month_name": "сентябрь", "count": 0, "unique_registered_users": 0, "unique_guests": 0},
-            {"month": 10, "month_name": "октябрь", "count": 0, "unique_registered_users": 0, "unique_guests": 0},
-            {"month": 11, "month_name": "ноябрь", "count": 0, "unique_registered_users": 0, "unique_guests": 0},
-            {"month": 12, "month_name": "декабрь", "count": 0, "unique_registered_users": 0, "unique_guests": 0},
+    @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter(
+                name='year',
+                in_=openapi.IN_QUERY,
+                description="Год в формате YYYY. Если не указан, статистика по текущему году.",
+                type=openapi.TYPE_STRING,
+                format=openapi.FORMAT_DATE,
+                required=False
+            ),
+            UNIQUES_PARAMETER,
         ]
+    )
+    async def get(self, request, *args, **kwargs):
+        return await super().get(request, *args, **kwargs)
 
-        for stat in queryset:
-            month = stat['month'].month
-            month_data = next((item for item in all_months if item["month"] == month), None)
 
-            if month_data:
-                unique_registered_users = TrafficStat.objects.filter(
-                    created_at__month=month,
-                    user__isnull=False
-                ).values('user').distinct().count()
+"""
+Функция для облегчения ActiveUsersView и работы с context в html
+"""
 
-                unique_guests_count = TrafficStat.objects.filter(
-                    created_at__month=month,
-                    user_id__isnull=True
-                ).values('ip_address').distinct().count()
 
-                month_data['count'] = stat['count']
-                month_data['unique_registered_users'] = unique_registered_users
-                month_data['unique_guests'] = unique_guests_count
+def format_duration(seconds):
+    seconds = int(seconds or 0)
+    return f"{seconds // 3600:02}:{(seconds % 3600) // 60:02}:{seconds % 60:02}"
 
-        data = all_months
 
-        return Response(data, status=status.HTTP_200_OK)
+ONLINE_WINDOW = timedelta(minutes=5)
 
+REGISTERED_USERS_SORT_FIELDS = {
+    'online': ('is_online',),
+    'username': ('user__username',),
+    'full_name': ('user__first_name', 'user__last_name'),
+    'email': ('user__email',),
+    'visit_count': ('visit_count',),
+    'avg_time_on_site': ('avg_time_on_site',),
+    'start_time': ('last_visit_at',),
+    'last_hit': ('last_hit_at',),
+}
+DEFAULT_REGISTERED_USERS_SORT = '-online'
 
-"""
-Функция для облегчения ActiveUsersView и работы с context в html
-"""
 
+def active_visitors(current_time=None):
+    """Незавершённые и неистёкшие сессии, с которых были запросы за последние ONLINE_WINDOW."""
+    current_time = current_time or now()
+    recent_sessions = TrafficStat.objects.filter(created_at__gte=current_time - ONLINE_WINDOW).values('session_id')
 
-def get_active_and_registered_users():
-    five_minutes_ago = now() - timedelta(minutes=5)
+    return Visitor.objects.filter(
+        Q(expiry_time__isnull=True) | Q(expiry_time__gt=current_time),
+        user__isnull=False,
+        end_time__isnull=True,
+        session_key__in=recent_sessions,
+    )
 
-    start_date = now() - timedelta(days=7)
-    end_date = now()
 
-    all_users = User.objects.all()
+def presence_online_user_ids():
+    """
+    Множество id онлайн-пользователей из трекера присутствия, None - если трекер отключён или недоступен.
+    После ошибки хранилища трекер retry_interval секунд не обращается к нему, и ответ сразу строится по БД.
+    """
+    tracker = get_presence_tracker()
+    if tracker is None:
+        return None
+
+    try:
+        online_user_ids = tracker.online_user_ids()
+        return set(online_user_ids) if online_user_ids is not None else None
+    except Exception:
+        logger.exception("Трекер присутствия недоступен, онлайн-статус считается по БД")
+        return None
 
-    user_stats = Visitor.objects.user_stats(start_date, end_date)
-    user_sessions = {user.id: {'visit_count': user.visit_count,
-                               'avg_time_on_site': user.time_on_site
-                               } for user in user_stats}
 
-    active_sessions = (
-        TrafficStat.objects
-        .filter(created_at__gte=five_minutes_ago)
-        .values('session_id')
-        .annotate(last_active=Max('created_at'))
+def registered_users_queryset(sort=None, online_user_ids=None, search=None):
+    """
+    Строки UserActivitySummary с пользователями: одно чтение таблицы сводки, страница по индексу сортируемого поля.
+    sort - имя из REGISTERED_USERS_SORT_FIELDS, с префиксом "-" для убывания.
+    search - подстрока имени пользователя, имени, фамилии или email.
+    online_user_ids - id онлайн-пользователей из трекера присутствия; без них онлайн-статус считается
+    по TrafficStat за ONLINE_WINDOW.
+    """
+    sort = sort or DEFAULT_REGISTERED_USERS_SORT
+    sort_fields = REGISTERED_USERS_SORT_FIELDS.get(sort.lstrip('-'))
+    if sort_fields is None:
+        raise ValidationError({"error": f"Недопустимое поле сортировки: {sort}"})
+
+    if online_user_ids is None:
+        is_online = Q(user__in=active_visitors().values('user'))
+    else:
+        is_online = Q(user__in=list(online_user_ids))
+
+    queryset = UserActivitySummary.objects.select_related('user').annotate(
+        is_online=ExpressionWrapper(is_online, output_field=BooleanField()),
     )
+    if search:
+        queryset = queryset.filter(
+            Q(user__username__icontains=search) | Q(user__first_name__icontains=search) |
+            Q(user__last_name__icontains=search) | Q(user__email__icontains=search)
+        )
 
-    active_users_data = {}
-    for session in active_sessions:
-        visitor = Visitor.objects.filter(session_key=session['session_id']).select_related('user').first()
-        if not visitor or not visitor.user:
-            continue
+    # Второй ключ в том же направлении, что и первый: страница читается одним проходом индекса (поле, user_id)
+    descending = sort.startswith('-')
+    ordering = [F(field).desc(nulls_last=True) if descending else F(field).asc(nulls_last=True) for field in sort_fields]
 
-        if visitor.session_ended() or visitor.session_expired():
-            continue
+    return queryset.order_by(*ordering, '-user' if descending else 'user')
 
-        user = visitor.user
-        time_on_site_seconds = visitor.time_on_site
-        time_on_site = f"{time_on_site_seconds // 3600:02}:{(time_on_site_seconds % 3600) // 60:02}:{time_on_site_seconds % 60:02}"
 
-        last_active_time = session['last_active']
-        is_online = last_active_time >= five_minutes_ago
+def online_times_on_site(user_ids):
+    """Время на сайте в текущей (последней незавершённой) сессии для каждого из user_ids."""
+    if not user_ids:
+        return {}
+    current_time = now()
+    return dict(
+        Visitor.objects.filter(
+            Q(expiry_time__isnull=True) | Q(expiry_time__gt=current_time), user__in=user_ids, end_time__isnull=True
+        )
+        .order_by('user', '-start_time').distinct('user').values_list('user', 'time_on_site')
+    )
 
-        active_users_data[user.id] = {
-            'is_online': is_online,
-            'time_on_site': time_on_site
-        }
 
-    registered_users = []
-    for user in all_users:
-        session_data = user_sessions.get(user.id, {})
-        visit_count = session_data.get('visit_count', 0)
-        avg_time_on_site_seconds = session_data.get('avg_time_on_site', timedelta(0))
-        if isinstance(avg_time_on_site_seconds, timedelta):
-            avg_time_on_site_seconds = avg_time_on_site_seconds.total_seconds()
-
-        avg_time_on_site = (
-            f"{int(avg_time_on_site_seconds) // 3600:02}:{(int(avg_time_on_site_seconds) % 3600) // 60:02}:{int(avg_time_on_site_seconds) % 60:02}"
-            if avg_time_on_site_seconds else "00:00:00"
-        )
+def serialize_registered_user(summary, online_time_on_site=None):
+    user = summary.user
+    return {
+        'id': user.id,
+        'username': user.username,
+        'full_name': user.get_full_name(),
+        'email': user.email,
+        'is_online': summary.is_online,
+        'time_on_site': format_duration(online_time_on_site) if summary.is_online else '-',
+        'visit_count': summary.visit_count,
+        'avg_time_on_site': format_duration(summary.avg_time_on_site),
+        'start_time': timezone.localtime(summary.last_visit_at) if summary.last_visit_at else "Неизвестно",
+        'last_hit': timezone.localtime(summary.last_hit_at) if summary.last_hit_at else None,
+    }
 
-        visitor = Visitor.objects.filter(user=user).order_by('-start_time').first()
-        if visitor:
-            start_time = visitor.start_time
-            start_time_local = timezone.localtime(start_time)
-        else:
-            start_time_local = "Неизвестно"
-
-        user_data = {
-            'id': user.id,
-            'username': user.username,
-            'full_name': user.get_full_name(),
-            'email': user.email,
-            'is_online': active_users_data.get(user.id, {}).get('is_online', False),
-            'time_on_site': active_users_data.get(user.id, {}).get('time_on_site', '-'),
-            'visit_count': visit_count,
-            'avg_time_on_site': avg_time_on_site,
-            'start_time': start_time_local
-        }
-        registered_users.append(user_data)
 
-    registered_users.sort(key=lambda x: (x['is_online']), reverse=True)
+def get_online_users_count(online_user_ids=None):
+    if online_user_ids is None:
+        online_user_ids = presence_online_user_ids()
+    if online_user_ids is not None:
+        return len(online_user_ids)
+    return active_visitors().values('user').distinct().count()
 
-    return registered_users
+
+def get_active_and_registered_users(sort=None, page=1, page_size=25, online_user_ids=None, search=None):
+    """
+    Страница таблицы зарегистрированных пользователей: объект Page, object_list которого - список словарей.
+    Число запросов не зависит от количества пользователей: подсчёт, выборка страницы по UserActivitySummary
+    и время текущей сессии онлайн-пользователей страницы.
+    """
+    paginator = Paginator(registered_users_queryset(sort, online_user_ids, search), page_size)
+    page_obj = paginator.get_page(page)
+    online_times = online_times_on_site([summary.user_id for summary in page_obj.object_list if summary.is_online])
+    page_obj.object_list = [
+        serialize_registered_user(summary, online_times.get(summary.user_id)) for summary in page_obj.object_list
+    ]
+    return page_obj
 
 
 class ActiveUsersView(APIView):
+    @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter(
+                name='page',
+                in_=openapi.IN_QUERY,
+                description="Номер страницы",
+                type=openapi.TYPE_INTEGER,
+                required=False
+            ),
+            openapi.Parameter(
+                name='page_size',
+                in_=openapi.IN_QUERY,
+                description="Размер страницы (не больше 100)",
+                type=openapi.TYPE_INTEGER,
+                required=False
+            ),
+            openapi.Parameter(
+                name='sort',
+                in_=openapi.IN_QUERY,
+                description="Сортировка: " + ", ".join(REGISTERED_USERS_SORT_FIELDS) +
+                            ". Префикс '-' - по убыванию. По умолчанию -online",
+                type=openapi.TYPE_STRING,
+                required=False
+            ),
+            openapi.Parameter(
+                name='search',
+                in_=openapi.IN_QUERY,
+                description="Поиск по имени пользователя, имени, фамилии и email",
+                type=openapi.TYPE_STRING,
+                required=False
+            ),
+        ]
+    )
     def get(self, request, *args, **kwargs):
+        try:
+            page_size = int(request.query_params.get('page_size', StandardResultsSetPagination.page_size))
+        except ValueError:
+            raise ValidationError({"error": "Некорректный page_size"})
+        page_size = max(1, min(page_size, StandardResultsSetPagination.max_page_size))
+
+        online_user_ids = presence_online_user_ids()
+        page_obj = get_active_and_registered_users(
+            sort=request.query_params.get('sort'),
+            page=request.query_params.get('page', 1),
+            page_size=page_size,
+            online_user_ids=online_user_ids,
+            search=request.query_params.get('search'),
+        )
 
-        data = get_active_and_registered_users()
-        online_users_count = sum(1 for user in data if user['is_online'])
-
-        return Response({'registered_users': data, 'online_users_count': online_users_count}, status=status.HTTP_200_OK)
+        return Response({
+            'registered_users': page_obj.object_list,
+            'online_users_count': get_online_users_count(online_user_ids),
+            'count': page_obj.paginator.count,
+            'total_pages': page_obj.paginator.num_pages,
+            'current_page': page_obj.number,
+        }, status=status.HTTP_200_OK)
 
 
 class StandardResultsSetPagination(PageNumberPagination):
@@ -438,11 +895,11 @@ def filter_traffic_stats(request, user=None):
     Функция фильтрации запросов по параметрам в запросе
     Может быть использована как в API для swagger, так и для рендеринга страницы user_requests.html
     """
-    queryset = TrafficStat.objects.all()
+    queryset = TrafficStat.objects.select_related('user_agent', 'url')
 
     if user:
-        user_sessions = Visitor.objects.filter(user=user).values_list("session_key", flat=True)
-        queryset = queryset.filter(session_id__in=user_sessions).order_by('-created_at')
+        # Фильтр по user_id использует индекс (user_id, created_at), без подзапроса по всем сессиям пользователя
+        queryset = queryset.filter(user=user).order_by('-created_at', '-id')
 
     params = request.GET if hasattr(request, "GET") else request.query_params
 
@@ -466,7 +923,8 @@ def filter_traffic_stats(request, user=None):
 
     url_filter = params.get("url", '')
     if url_filter:
-        queryset = queryset.filter(url__icontains=url_filter)
+        # Триграммный индекс справочника отбирает подходящие пути, журнал фильтруется по их id
+        queryset = queryset.filter(url__value__icontains=url_filter)
 
     return queryset
 
@@ -475,6 +933,20 @@ class UserRequestLogView(generics.ListAPIView):
     serializer_class = TrafficStatSerializer
     pagination_class = StandardResultsSetPagination
 
+    def get_queryset(self):
+        user_id = self.kwargs.get('user_id')
+        try:
+            user = User.objects.get(id=user_id)
+        except User.DoesNotExist:
+            return Response(
+                {"error": "Данный пользователь не найден"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        queryset = filter_traffic_stats(self.request, user)
+        return queryset
+
+
     @swagger_auto_schema(
         manual_parameters=[
             openapi.Parameter(
@@ -500,25 +972,41 @@ class UserRequestLogView(generics.ListAPIView):
                 type=openapi.TYPE_STRING,
                 required=False
             ),
+            openapi.Parameter(
+                name='pagination',
+                in_=openapi.IN_QUERY,
+                description="cursor - курсорная пагинация по (created_at, id): любая страница стоит как первая",
+                type=openapi.TYPE_STRING,
+                enum=['page', 'cursor'],
+                required=False
+            ),
+            openapi.Parameter(
+                name='cursor',
+                in_=openapi.IN_QUERY,
+                description="Курсор из ссылок next/previous (режим pagination=cursor)",
+                type=openapi.TYPE_STRING,
+                required=False
+            ),
+            openapi.Parameter(
+                name='with_count',
+                in_=openapi.IN_QUERY,
+                description="Вернуть общее число записей (режим pagination=cursor): "
+                            "точно до TRAFFIC_LOG_COUNT_CAP, дальше - оценка",
+                type=openapi.TYPE_BOOLEAN,
+                required=False
+            ),
         ]
     )
-
-    def get_queryset(self):
-        user_id = self.kwargs.get('user_id')
-        try:
-            user = User.objects.get(id=user_id)
-        except User.DoesNotExist:
-            return Response(
-                {"error": "Данный пользователь не найден"},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-
-        queryset = filter_traffic_stats(self.request, user)
-        return queryset
-
-
     def get(self, request, *args, **kwargs):
         queryset = self.get_queryset()
+
+        if request.query_params.get('pagination') == 'cursor':
+            paginator = KeysetPagination()
+            page = paginator.paginate_queryset(queryset, request)
+            serializer = TrafficStatSerializer(page, many=True)
+            with_count = request.query_params.get('with_count', '').lower() in ('1', 'true')
+            return paginator.get_paginated_response(serializer.data, estimate_count(queryset) if with_count else None)
+
         paginator = self.pagination_class()
         paginated_queryset = paginator.paginate_queryset(queryset, request)
         serializer = TrafficStatSerializer(paginated_queryset, many=True)
@@ -536,21 +1024,199 @@ class UserRequestLogView(generics.ListAPIView):
         return Response(response_data, status=status.HTTP_200_OK)
 
 
+class TrafficExportView(APIView):
+    """
+    Потоковая выгрузка хитов с фильтрами filter_traffic_stats.
+    Строки читаются серверным курсором и отдаются порциями, память не зависит от объёма выгрузки.
+    """
+
+    @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter(
+                name='export_format',
+                in_=openapi.IN_QUERY,
+                description="Формат: csv (по умолчанию), ndjson или parquet (требуется пакет pyarrow)",
+                type=openapi.TYPE_STRING,
+                enum=list(EXPORT_FORMATS),
+                required=False
+            ),
+            openapi.Parameter(
+                name='user_id',
+                in_=openapi.IN_QUERY,
+                description="Только хиты указанного пользователя",
+                type=openapi.TYPE_INTEGER,
+                required=False
+            ),
+            openapi.Parameter(
+                name='start_date',
+                in_=openapi.IN_QUERY,
+                description='Начальная дата в формате YYYY-MM-DDTHH:MM:SS',
+                type=openapi.TYPE_STRING,
+                format=openapi.FORMAT_DATETIME,
+                required=False
+            ),
+            openapi.Parameter(
+                name='end_date',
+                in_=openapi.IN_QUERY,
+                description='Конечная дата в формате YYYY-MM-DDTHH:MM:SS',
+                type=openapi.TYPE_STRING,
+                format=openapi.FORMAT_DATETIME,
+                required=False
+            ),
+            openapi.Parameter(
+                name='url',
+                in_=openapi.IN_QUERY,
+                description='Фильтрация по URL',
+                type=openapi.TYPE_STRING,
+                required=False
+            ),
+        ]
+    )
+    def get(self, request, *args, **kwargs):
+        export_format = request.query_params.get('export_format', 'csv')
+        if export_format not in EXPORT_FORMATS:
+            raise ValidationError({"error": "Неверный формат. Используйте " + ", ".join(EXPORT_FORMATS)})
+        if export_format == 'parquet' and pyarrow is None:
+            raise ValidationError({"error": "Для формата parquet необходимо установить пакет pyarrow"})
+
+        user = None
+        user_id = request.query_params.get('user_id')
+        if user_id:
+            user = get_object_or_404(User, id=user_id)
+
+        queryset = filter_traffic_stats(request, user)
+        stream, content_type = EXPORT_FORMATS[export_format]
+
+        response = StreamingHttpResponse(stream(queryset), content_type=content_type)
+        response['Content-Disposition'] = (
+            f'attachment; filename="traffic-{localtime():%Y%m%d-%H%M%S}.{export_format}"'
+        )
+        return response
+
+
+class BeaconJSONParser(JSONParser):
+    """JSON в теле text/plain: navigator.sendBeacon с таким типом не требует предварительного CORS-запроса."""
+    media_type = 'text/plain'
+
+
+def is_same_origin(request):
+    """
+    Запрос отправлен страницей этого же сайта. Sec-Fetch-Site выставляет браузер, и страница его не подделает;
+    без него сравнивается Origin с хостом запроса и CSRF_TRUSTED_ORIGINS. Запрос без обоих заголовков не доверенный.
+    """
+    fetch_site = request.META.get('HTTP_SEC_FETCH_SITE')
+    if fetch_site:
+        return fetch_site == 'same-origin'
+    origin = request.META.get('HTTP_ORIGIN')
+    if not origin or origin == 'null':
+        return False
+    return origin == f"{request.scheme}://{request.get_host()}" or origin in settings.CSRF_TRUSTED_ORIGINS
+
+
+class BeaconSessionAuthentication(SessionAuthentication):
+    """
+    Пользователь из сессии Django без проверки CSRF-токена: маяк не может передать заголовок с токеном.
+    Вместо токена проверяется источник запроса: маяк со стороннего сайта считается анонимным,
+    иначе любая страница могла бы записать события от имени вошедшего посетителя.
+    """
+
+    def authenticate(self, request):
+        if not is_same_origin(request._request):
+            return None
+        return super().authenticate(request)
+
+    def enforce_csrf(self, request):
+        return
+
+
+class TrafficEventsView(APIView):
+    """
+    Пачка клиентских событий (клики, конверсии, произвольные события со свойствами) от маяка traffic/js/beacon.js.
+    События проверяются за один проход и записываются одной операцией record_events - одним COPY или одной записью
+    в спул, поэтому число запросов к API и к БД не растёт с числом событий.
+    Посетитель определяется так же, как в TrafficTrackingMiddleware: маяк не передаёт заголовки, поэтому
+    пользователь берётся из сессии Django без проверки CSRF-токена, но только для запросов с этого же сайта.
+    Пачка со стороннего сайта записывается анонимно: без пользователя и без идентификатора посетителя.
+    """
+    authentication_classes = (BeaconSessionAuthentication,)
+    permission_classes = (AllowAny,)
+    parser_classes = (JSONParser, BeaconJSONParser)
+
+    @swagger_auto_schema(
+        request_body=openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            required=['events'],
+            properties={
+                'events': openapi.Schema(
+                    type=openapi.TYPE_ARRAY,
+                    items=openapi.Schema(
+                        type=openapi.TYPE_OBJECT,
+                        required=['name'],
+                        properties={
+                            'name': openapi.Schema(type=openapi.TYPE_STRING, description="Имя события"),
+                            'url': openapi.Schema(
+                                type=openapi.TYPE_STRING, description="Путь страницы, по умолчанию - из Referer"
+                            ),
+                            'properties': openapi.Schema(
+                                type=openapi.TYPE_OBJECT, description="Свойства события, небольшой JSON-объект"
+                            ),
+                            'age_ms': openapi.Schema(
+                                type=openapi.TYPE_INTEGER,
+                                description="Сколько миллисекунд назад произошло событие на момент отправки пачки"
+                            ),
+                        },
+                    ),
+                ),
+            },
+        ),
+        responses={202: "Число записанных событий и отклонённые события с причинами"},
+    )
+    def post(self, request, *args, **kwargs):
+        events_settings = get_events_settings()
+        events = request.data.get('events') if isinstance(request.data, dict) else None
+        if not isinstance(events, list):
+            raise ValidationError({"error": "Ожидается объект с массивом events"})
+        if len(events) > events_settings['MAX_BATCH']:
+            raise ValidationError({"error": f"Не больше {events_settings['MAX_BATCH']} событий в пачке"})
+
+        accepted, rejected = validate_events(events, events_settings)
+
+        response = Response(status=status.HTTP_202_ACCEPTED)
+        session_id = None
+        if is_same_origin(request._request):
+            session_id = identify_visitor(request._request, response, get_visitor_id_settings())
+        record_events(event_hits(accepted, request._request, request.user, session_id))
+
+        response.data = {'accepted': len(accepted), 'rejected': rejected}
+        return response
+
+
 def index(request):
     end_date = now()
     start_date = end_date - timedelta(days=7)
 
     visitor_stats = Visitor.objects.stats(start_date, end_date)
-    user_stats = Visitor.objects.user_stats(start_date, end_date)
 
-    registered_users = get_active_and_registered_users()
-    online_users_count = sum(1 for user in registered_users if user['is_online'])
+    sort = request.GET.get('sort') or DEFAULT_REGISTERED_USERS_SORT
+    if sort.lstrip('-') not in REGISTERED_USERS_SORT_FIELDS:
+        sort = DEFAULT_REGISTERED_USERS_SORT
+
+    search = request.GET.get('search', '')
+    online_user_ids = presence_online_user_ids()
+    page_obj = get_active_and_registered_users(
+        sort=sort, page=request.GET.get('page', 1), page_size=StandardResultsSetPagination.page_size,
+        online_user_ids=online_user_ids, search=search,
+    )
 
     context = {
         "visitor_stats": visitor_stats,
-        "user_stats": user_stats,
-        "registered_users": registered_users,
-        "online_users_count": online_users_count,
+        "registered_users": page_obj.object_list,
+        "online_users_count": get_online_users_count(online_user_ids),
+        "sort": sort,
+        "search": search,
+        "total_pages": page_obj.paginator.num_pages,
+        "current_page": page_obj.number,
+        "live_stream": live_stream_enabled(request),
     }
 
     return render(request, 'traffic/index.html', context)
@@ -559,31 +1225,117 @@ def index(request):
 class StatsView(TemplateView):
     template_name = "traffic/stats.html"
 
+    def get_context_data(self, **kwargs):
+        return {**super().get_context_data(**kwargs), "live_stream": live_stream_enabled(self.request)}
+
+
+def live_snapshot():
+    """Снимок для живой ленты: показатели текущих часа, дня и месяца и id пользователей онлайн."""
+    current = localtime()
+    today = current.date()
+    hour_start = timezone.make_aware(datetime.combine(today, time(current.hour)))
+    day_start = timezone.make_aware(datetime.combine(today, datetime.min.time()))
+    month_start = timezone.make_aware(datetime.combine(today.replace(day=1), datetime.min.time()))
+    next_month = (today.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+    periods = {
+        'hour': (hour_start, hour_start + timedelta(hours=1)),
+        'day': (day_start, timezone.make_aware(datetime.combine(today + timedelta(days=1), datetime.min.time()))),
+        'month': (month_start, timezone.make_aware(datetime.combine(next_month, datetime.min.time()))),
+    }
+
+    buckets = {}
+    for granularity, (start, end) in periods.items():
+        stats = get_period_stats(start, end, granularity)
+        buckets[granularity] = {
+            'start': timezone.make_naive(start).isoformat(),
+            **next(iter(stats.values()), empty_period_stats()),
+        }
+
+    online_user_ids = presence_online_user_ids()
+    if online_user_ids is None:
+        online_user_ids = set(active_visitors().values_list('user', flat=True))
+
+    return {'buckets': buckets, 'online_count': len(online_user_ids), 'online_user_ids': online_user_ids}
+
+
+live_feed = LiveFeed(live_snapshot)
+
+
+def live_stream_enabled(request):
+    """
+    Живая лента работает только под ASGI: под WSGI каждое подключение SSE занимало бы синхронный воркер
+    на всё время жизни вкладки. Страницы мониторинга под WSGI опрашивают JSON-эндпоинты.
+    """
+    return isinstance(request, ASGIRequest)
+
+
+def release_connection():
+    if not connection.in_atomic_block:
+        connection.close()
+
+
+async def live_traffic(request):
+    """
+    Поток server-sent events: hits - показатели текущих часа, дня и месяца, online - число пользователей онлайн,
+    presence - переходы пользователей в онлайн и из онлайна. При подключении приходит полный снимок, далее - изменения.
+    Под WSGI недоступен (404).
+    """
+    if not live_stream_enabled(request):
+        return JsonResponse({"error": "Живая лента доступна только под ASGI"}, status=status.HTTP_404_NOT_FOUND)
+
+    user = await request.auser()
+    if not user.is_authenticated:
+        return JsonResponse({"error": "Требуется авторизация"}, status=status.HTTP_403_FORBIDDEN)
+
+    # Поток открыт долго и к БД не обращается: соединение, открытое для авторизации, освобождается сразу
+    await sync_to_async(release_connection)()
+
+    response = StreamingHttpResponse(live_feed.stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
 
 def user_requests(request, user_id):
     user = get_object_or_404(User, id=user_id)
 
     queryset = filter_traffic_stats(request, user)
 
-    page_number = request.GET.get('page', 1)
-    paginator = Paginator(queryset, StandardResultsSetPagination.page_size)
-
-    try:
-        page_obj = paginator.page(page_number)
-    except PageNotAnInteger:
-        page_obj = paginator.page(1)
-    except EmptyPage:
-        page_obj = paginator.page(paginator.num_pages)
+    page = KeysetPage(queryset, request.GET.get('cursor'), StandardResultsSetPagination.page_size)
+    count, count_is_estimate = estimate_count(queryset)
 
     context = {
         "user": user,
-        "logs": page_obj.object_list,
+        "logs": page.object_list,
         "start_date": request.GET.get('start_date'),
         "end_date": request.GET.get('end_date'),
         "url_filter": request.GET.get('url', ''),
-        "total_pages": paginator.num_pages,
-        "current_page": page_obj.number,
+        "next_cursor": page.next_cursor,
+        "previous_cursor": page.previous_cursor,
+        "count": count,
+        "count_is_estimate": count_is_estimate,
     }
 
     return render(request, 'traffic/user_requests.html', context)
 
+
+
+def metrics(request):
+    """
+    Гистограммы TrafficMetricsMiddleware в текстовом формате Prometheus.
+    С заданным TOKEN доступны по заголовку Authorization: Bearer <TOKEN>, без него - только сотрудникам (is_staff):
+    задержки и число запросов по представлениям не публикуются по умолчанию.
+    """
+    registry = get_metrics_registry()
+    if registry is None:
+        raise Http404
+
+    token = get_metrics_settings()['TOKEN']
+    if token:
+        if not constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            return HttpResponseForbidden()
+    elif not request.user.is_staff:
+        raise Http404
+
+    return HttpResponse(registry.exposition(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,68 @@
+import secrets
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import timezone
+from django.utils.crypto import salted_hmac
+
+# Идентификатор посетителя без сессии берётся из сессии Django (session), подписанной cookie со случайным id (cookie)
+# или только из отпечатка IP + User-Agent + день (fingerprint)
+MODE_SESSION = 'session'
+MODE_COOKIE = 'cookie'
+MODE_FINGERPRINT = 'fingerprint'
+
+DEFAULT_VISITOR_ID_SETTINGS = {
+    'MODE': MODE_SESSION,
+    'COOKIE_NAME': 'traffic_vid',
+    'COOKIE_MAX_AGE': 365 * 24 * 3600,
+    'SALT': 'traffic.visitor',
+}
+
+VISITOR_ID_LENGTH = 32
+
+
+def get_visitor_id_settings():
+    visitor_id = {**DEFAULT_VISITOR_ID_SETTINGS, **getattr(settings, 'TRAFFIC_VISITOR_ID', {})}
+    if visitor_id['MODE'] not in (MODE_SESSION, MODE_COOKIE, MODE_FINGERPRINT):
+        raise ImproperlyConfigured(f"Неизвестный режим идентификации посетителя: {visitor_id['MODE']}")
+    return visitor_id
+
+
+def fingerprint(request, salt, day=None):
+    """
+    Псевдоидентификатор сессии: HMAC от IP, User-Agent и дня на SECRET_KEY, той же длины, что и ключ сессии.
+    Стабилен в течение дня для клиента без cookie, исходные IP и User-Agent по нему не восстанавливаются.
+    """
+    day = day or timezone.localdate()
+    value = f"{request.META.get('REMOTE_ADDR')}|{request.META.get('HTTP_USER_AGENT', '')}|{day.isoformat()}"
+    return salted_hmac(salt, value).hexdigest()[:VISITOR_ID_LENGTH]
+
+
+def identify_visitor(request, response, visitor_id_settings):
+    """
+    Идентификатор посетителя для хита. Ключ существующей сессии (в том числе созданной при входе) имеет приоритет:
+    по нему онлайн-статус зарегистрированных пользователей сопоставляется с Visitor.session_key.
+    В режиме cookie случайный идентификатор сохраняется в подписанной cookie и не зависит от IP, User-Agent и дня:
+    посетители за одним NAT с одинаковым браузером не склеиваются.
+    """
+    session = getattr(request, 'session', None)
+    if session is not None and session.session_key:
+        return session.session_key
+
+    mode = visitor_id_settings['MODE']
+    if mode == MODE_SESSION:
+        return None
+
+    salt = visitor_id_settings['SALT']
+    if mode == MODE_FINGERPRINT:
+        return fingerprint(request, salt)
+
+    cookie_name = visitor_id_settings['COOKIE_NAME']
+    visitor_id = request.get_signed_cookie(cookie_name, default=None, salt=salt)
+    if visitor_id is None:
+        visitor_id = secrets.token_hex(VISITOR_ID_LENGTH // 2)
+        response.set_signed_cookie(
+            cookie_name, visitor_id, salt=salt, max_age=visitor_id_settings['COOKIE_MAX_AGE'],
+            secure=settings.SESSION_COOKIE_SECURE, httponly=True, samesite='Lax',
+        )
+    return visitor_id
@@ -7,10 +7,37 @@ For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
 """
 
+import asyncio
 import os
 
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'user_tracking.settings')
 
-application = get_asgi_application()
+
+class ConcurrencyLimitMiddleware:
+    """
+    Ограничивает число одновременно обрабатываемых HTTP-запросов в процессе, остальные ждут в очереди.
+    Каждый запрос под ASGI получает собственное соединение с БД, без ограничения
+    сотни одновременных запросов исчерпывают max_connections PostgreSQL.
+    Долгие потоковые ответы из exempt_paths (живая лента) не держат БД и в лимите не учитываются.
+    """
+
+    def __init__(self, app, limit, exempt_paths=()):
+        self.app = app
+        self.semaphore = asyncio.Semaphore(limit)
+        self.exempt_paths = tuple(exempt_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['path'].startswith(self.exempt_paths):
+            return await self.app(scope, receive, send)
+
+        async with self.semaphore:
+            return await self.app(scope, receive, send)
+
+
+application = ConcurrencyLimitMiddleware(
+    get_asgi_application(),
+    int(os.environ.get('ASGI_MAX_CONCURRENCY', 20)),
+    exempt_paths=('/api/traffic/live/',),
+)
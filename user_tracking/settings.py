@@ -76,6 +76,7 @@ MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'tracking.middleware.VisitorTrackingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    'traffic.middleware.TrafficMetricsMiddleware',
     'traffic.middleware.TrafficTrackingMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -133,6 +134,107 @@ SESSION_ENGINE = 'django.contrib.sessions.backends.db'
 SESSION_COOKIE_NAME = 'sessionid'
 SESSION_COOKIE_AGE = 7200
 
+# Идентификация анонимных посетителей (traffic/visitors.py): session - сессия Django на каждого посетителя,
+# cookie - подписанная cookie со случайным идентификатором, fingerprint - HMAC от IP + User-Agent + дня без cookie.
+# В режимах cookie и fingerprint анонимные запросы не создают записей django_session, а строка гостей
+# в visitor_stats главной страницы (Visitor.objects.stats) остаётся пустой
+TRAFFIC_VISITOR_ID = {
+    'MODE': config('TRAFFIC_VISITOR_ID_MODE', default='session'),
+}
+# django-tracking2 иначе сохраняет сессию и Visitor для каждого анонимного запроса
+TRACK_ANONYMOUS_USERS = TRAFFIC_VISITOR_ID['MODE'] == 'session'
+
+# Буферизация записи хитов в TrafficTrackingMiddleware (traffic/buffer.py)
+# OVERFLOW: drop - отбросить хит, block - подождать BLOCK_TIMEOUT секунд, spill - записать на диск в SPILL_DIR
+TRAFFIC_BUFFER = {
+    'ENABLED': config('TRAFFIC_BUFFER_ENABLED', default=False, cast=bool),
+    'MAX_SIZE': 10000,
+    'BATCH_SIZE': 500,
+    'FLUSH_INTERVAL': 2.0,
+    'OVERFLOW': config('TRAFFIC_BUFFER_OVERFLOW', default='spill'),
+    'BLOCK_TIMEOUT': 0.5,
+    'SPILL_DIR': os.path.join(BASE_DIR, 'var', 'traffic_spill'),
+}
+
+# Правила учёта запросов (traffic/rules.py): INCLUDE/EXCLUDE - регулярные выражения начала пути
+# (EXCLUDE по умолчанию исключает статику, ресурсы админки и живую ленту),
+# SAMPLING - выборочная запись шумных маршрутов и ботов, записанный хит получает вес 1 / RATE
+TRAFFIC_TRACKING = {
+    'SAMPLING': [
+        # Запросы самого дашборда к API статистики
+        {'PATH': r'/api/traffic/', 'RATE': config('TRAFFIC_DASHBOARD_SAMPLE_RATE', default=1.0, cast=float)},
+        {'USER_AGENT': r'bot|crawler|spider', 'RATE': config('TRAFFIC_BOT_SAMPLE_RATE', default=0.01, cast=float)},
+    ],
+}
+
+# Размер LRU-кэша строка -> id справочников UserAgent и UrlPath в каждом процессе (traffic/dictionaries.py)
+TRAFFIC_DICTIONARY_CACHE_SIZE = 10000
+
+# Спул хитов на диске вместо записи в БД из процесса приложения (traffic/spool.py).
+# Сегменты загружает через COPY один воркер на хост: manage.py traffic_ingest --loop
+TRAFFIC_SPOOL = {
+    'ENABLED': config('TRAFFIC_SPOOL_ENABLED', default=False, cast=bool),
+    'DIR': config('TRAFFIC_SPOOL_DIR', default=os.path.join(BASE_DIR, 'var', 'traffic_spool')),
+    'SEGMENT_SECONDS': 1.0,
+}
+
+# Статистика за период из почасовых агрегатов (manage.py traffic_rollup); False - напрямую по TrafficStat
+TRAFFIC_USE_ROLLUPS = config('TRAFFIC_USE_ROLLUPS', default=True, cast=bool)
+
+# Секционирование TrafficStat по created_at (manage.py traffic_partitions)
+# INTERVAL: day или month; RETENTION_DAYS: None - хранить сырые хиты бессрочно
+TRAFFIC_PARTITIONING = {
+    'INTERVAL': config('TRAFFIC_PARTITION_INTERVAL', default='month'),
+    'PREMAKE': 2,
+    'RETENTION_DAYS': config('TRAFFIC_RETENTION_DAYS', default=None, cast=lambda v: int(v) if v else None),
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': config('REDIS_CACHE_URL', default='redis://redis_user_tracking:6379/1'),
+    }
+}
+
+# Кеш ответов статистики за период (traffic/caching.py): закрытые периоды - CLOSED_TTL секунд, текущий - CURRENT_TTL
+TRAFFIC_STATS_CACHE = {
+    'ENABLED': config('TRAFFIC_STATS_CACHE_ENABLED', default=True, cast=bool),
+    'CURRENT_TTL': 60,
+    'CLOSED_TTL': 24 * 60 * 60,
+    'CLOSED_AFTER': 600,
+}
+
+# Живая лента (server-sent events, /api/traffic/live/): один опрос БД на процесс раз в INTERVAL секунд
+TRAFFIC_LIVE = {
+    'INTERVAL': 5.0,
+    'KEEPALIVE': 15.0,
+}
+
+# Онлайн-присутствие без запросов к БД (traffic/presence.py); пустой BACKEND - онлайн считается по TrafficStat
+# BACKEND: traffic.presence.RedisPresenceBackend, CachePresenceBackend или MemoryPresenceBackend
+TRAFFIC_PRESENCE = {
+    'BACKEND': config('TRAFFIC_PRESENCE_BACKEND', default='traffic.presence.RedisPresenceBackend'),
+    'OPTIONS': {
+        'URL': config('REDIS_URL', default='redis://redis_user_tracking:6379/0'),
+    },
+    'WINDOW': 300,
+    'SWEEP_INTERVAL': 60,
+    'RETRY_INTERVAL': 30,
+}
+
+# Замеры запросов к представлениям traffic (traffic/metrics.py): заголовок Server-Timing и гистограммы /metrics.
+# Воркеры gunicorn передают наблюдения в общий хеш Redis раз в FLUSH_INTERVAL секунд
+TRAFFIC_METRICS = {
+    'ENABLED': config('TRAFFIC_METRICS_ENABLED', default=True, cast=bool),
+    'SERVER_TIMING': config('TRAFFIC_SERVER_TIMING', default=True, cast=bool),
+    'BACKEND': config('TRAFFIC_METRICS_BACKEND', default='traffic.metrics.RedisMetricsBackend'),
+    'OPTIONS': {
+        'URL': config('REDIS_URL', default='redis://redis_user_tracking:6379/0'),
+    },
+    'FLUSH_INTERVAL': 15,
+    'TOKEN': config('TRAFFIC_METRICS_TOKEN', default=None),
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
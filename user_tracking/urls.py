@@ -22,6 +22,7 @@ from drf_yasg.generators import OpenAPISchemaGenerator
 from rest_framework import permissions
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
+from traffic.views import metrics
 
 
 class CustomSchemaGenerator(OpenAPISchemaGenerator):
@@ -50,7 +51,8 @@ urlpatterns = [
     path('docs/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
 
     re_path(r'^tracking/', include('tracking.urls')),
-    path('api/traffic/', include('traffic.urls'))
+    path('api/traffic/', include('traffic.urls')),
+    path('metrics', metrics, name='traffic-metrics'),
 ]
 
 if settings.DEBUG: